@@ -1,36 +1,77 @@
-from flask import Flask, send_from_directory
+from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 from config import Config
+from cooperative import cooperative
 from models import db
-import os
+from routing import read_routing
+from engine_tuning import engine_tuning
+from cache import content_cache
+from hashing import password_hasher
+from membership import membership
+from events import discussion_events
+from metrics import metrics
+from profiling import request_profiler
+from assets import static_assets
+from compression import api_compression
 
 # Initialize Flask app
-app = Flask(__name__, static_folder='static', static_url_path='')
+# The React build in static/ is served by assets.py, not Flask's static route
+app = Flask(__name__, static_folder=None)
 app.config.from_object(Config)
 
 # Initialize extensions 
-CORS(app)
+# First, so the others see whether the worker is cooperative
+cooperative.init_app(app)
+CORS(app, expose_headers=['X-Next-Cursor', 'ETag', 'X-Profile-Id'])
+# Replica binds and engine options are read by db.init_app, so they come first
+read_routing.init_app(app)
+engine_tuning.init_app(app)
 db.init_app(app)
+with app.app_context():
+    engine_tuning.install(db.engines)
 migrate = Migrate(app, db)
 jwt = JWTManager(app)
+content_cache.init_app(app)
+password_hasher.init_app(app)
+membership.init_app(app)
+discussion_events.init_app(app)
+metrics.init_app(app)
+request_profiler.init_app(app)
+static_assets.init_app(app)
+api_compression.init_app(app)
 
 # Register blueprints/routes
 from routes import api_bp
 app.register_blueprint(api_bp, url_prefix='/api')
+
+# Register CLI commands
+from progress import reconcile_progress_command
+from query_plans import check_query_plans_command
+from query_budget import check_query_budgets_command
+from datagen import generate_data_command
+from profiling import profile_token_command
+from assets import compress_assets_command
+from engine_tuning import db_settings_command
+app.cli.add_command(reconcile_progress_command)
+app.cli.add_command(check_query_plans_command)
+app.cli.add_command(check_query_budgets_command)
+app.cli.add_command(generate_data_command)
+app.cli.add_command(profile_token_command)
+app.cli.add_command(compress_assets_command)
+app.cli.add_command(db_settings_command)
+
 # Serve React App
 @app.route('/')
 def serve():
-    return send_from_directory(app.static_folder, 'index.html')
+    return static_assets.serve('index.html')
 
 @app.route('/<path:path>')
 def static_proxy(path):
-    # Handle React Router routes
-    if not os.path.exists(os.path.join(app.static_folder, path)):
-        return send_from_directory(app.static_folder, 'index.html')
-    return send_from_directory(app.static_folder, path)
+    # Unknown paths are React Router routes and get index.html
+    return static_assets.serve(path)
 
 if __name__ == "__main__":
     app.run(debug=True) 
@@ -0,0 +1,181 @@
+"""Serving of the bundled React build (``static/``, copied there by build.sh).
+
+The directory is scanned once at startup into a manifest of URL path ->
+file, size, modification time, MIME type and compressed variants, so a
+request costs one dict lookup and one ``open``. Unknown paths get
+``index.html`` for client-side routes, except under ``static/`` where only
+fingerprinted bundles live; restart the app after replacing the build.
+
+Compressed variants are ``<file>.br`` and ``<file>.gz`` siblings written by
+``flask compress-assets`` at build time (brotli needs the ``brotli``
+package). A compressible file with no ``.gz`` is gzipped on first request
+into a per-host cache directory. The variant is picked from
+``Accept-Encoding`` (br, then gzip) and sent with ``Vary: Accept-Encoding``.
+
+Fingerprinted files (CRA's ``name.<hash>.js``) are cached for a year as
+immutable; everything else, ``index.html`` included, is revalidated with its
+ETag on every use.
+"""
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+import click
+from flask import abort, current_app, request
+from werkzeug.wsgi import wrap_file
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# CRA output: main.3f2a1b9c.js, 787.d4c1f6a2.chunk.js, logo.6ce24c58023cc2f8fd88fe9d219db6c6.svg
+FINGERPRINTED = re.compile(r'\.[0-9a-f]{8,}\.(?:chunk\.)?[A-Za-z0-9]+$')
+COMPRESSIBLE_TYPES = re.compile(r'^(?:text/|application/(?:javascript|json|manifest\+json|xml)|image/svg\+xml)')
+COMPRESSED_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+# Smaller files are not worth a compressed variant
+MIN_COMPRESS_SIZE = 1024
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+def compressible(path, size):
+    mimetype = mimetypes.guess_type(path)[0] or ''
+    return size >= MIN_COMPRESS_SIZE and (bool(COMPRESSIBLE_TYPES.match(mimetype)) or path.endswith('.map'))
+
+class Asset:
+    def __init__(self, path, size, mtime_ns):
+        self.path = path
+        self.size = size
+        self.mtime = mtime_ns / 1e9
+        self.mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.etag = f'{mtime_ns:x}-{size:x}'
+        self.immutable = bool(FINGERPRINTED.search(os.path.basename(path)))
+        self.compressible = compressible(path, size)
+        # encoding -> (path, size)
+        self.variants = {}
+
+class StaticAssets:
+    def __init__(self):
+        self.directory = None
+        self.cache_directory = None
+        self.assets = {}
+
+    def init_app(self, app):
+        self.directory = app.config['STATIC_DIR'] or os.path.join(app.root_path, 'static')
+        namespace = hashlib.sha1(os.path.abspath(self.directory).encode()).hexdigest()[:12]
+        self.cache_directory = os.path.join(tempfile.gettempdir(), 'studyhub-assets', namespace)
+        app.extensions['static_assets'] = self
+        self.scan()
+
+    def scan(self):
+        """Rebuild the manifest from the files under the static directory."""
+        assets = {}
+        variants = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                url = os.path.relpath(path, self.directory).replace(os.sep, '/')
+                stat = os.stat(path)
+                for encoding, suffix in COMPRESSED_SUFFIXES.items():
+                    if name.endswith(suffix):
+                        variants.append((url[:-len(suffix)], encoding, path, stat))
+                        break
+                else:
+                    assets[url] = Asset(path, stat.st_size, stat.st_mtime_ns)
+        for url, encoding, path, stat in variants:
+            asset = assets.get(url)
+            # A variant older than its file is left over from a previous build
+            if asset is not None and stat.st_size < asset.size and stat.st_mtime >= asset.mtime:
+                asset.variants[encoding] = (path, stat.st_size)
+        self.assets = assets
+        logger.info('Static manifest: %d files under %s', len(assets), self.directory)
+
+    def _gzip_variant(self, asset):
+        """Gzip ``asset`` into the cache directory once, shared by the workers on the host."""
+        cached = os.path.join(self.cache_directory, asset.etag + '-' + os.path.basename(asset.path) + '.gz')
+        try:
+            if not os.path.exists(cached):
+                os.makedirs(self.cache_directory, exist_ok=True)
+                fd, tmp = tempfile.mkstemp(dir=self.cache_directory, suffix='.tmp')
+                with open(asset.path, 'rb') as source, os.fdopen(fd, 'wb') as raw:
+                    with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=9, mtime=0) as target:
+                        shutil.copyfileobj(source, target)
+                os.replace(tmp, cached)
+            size = os.path.getsize(cached)
+        except OSError:
+            logger.warning('Could not gzip %s', asset.path, exc_info=True)
+            asset.compressible = False
+            return None
+        if size >= asset.size:
+            asset.compressible = False
+            return None
+        asset.variants['gzip'] = (cached, size)
+        return asset.variants['gzip']
+
+    def _negotiate(self, asset):
+        """(encoding or None, path, size) for the request's Accept-Encoding."""
+        accepted = request.accept_encodings
+        for encoding in ('br', 'gzip'):
+            if not accepted[encoding]:
+                continue
+            variant = asset.variants.get(encoding)
+            if variant is None and encoding == 'gzip' and asset.compressible:
+                variant = self._gzip_variant(asset)
+            if variant is not None:
+                return (encoding,) + variant
+        return None, asset.path, asset.size
+
+    def serve(self, path):
+        asset = self.assets.get(path)
+        if asset is None:
+            if path.startswith('static/'):
+                abort(404)
+            asset = self.assets.get('index.html')
+            if asset is None:
+                abort(404)
+        encoding, file_path, size = self._negotiate(asset)
+        try:
+            f = open(file_path, 'rb')
+        except OSError:
+            abort(404)
+        response = current_app.response_class(
+            wrap_file(request.environ, f), mimetype=asset.mimetype, direct_passthrough=True
+        )
+        response.content_length = size
+        response.last_modified = asset.mtime
+        response.set_etag(f'{asset.etag}-{encoding}' if encoding else asset.etag)
+        response.headers['Cache-Control'] = IMMUTABLE if asset.immutable else REVALIDATE
+        if encoding:
+            response.content_encoding = encoding
+        if asset.variants or asset.compressible:
+            response.vary.add('Accept-Encoding')
+        return response.make_conditional(request, accept_ranges=True, complete_length=size)
+
+static_assets = StaticAssets()
+
+@click.command('compress-assets')
+def compress_assets_command():
+    """Write .gz (and, with the brotli package, .br) variants of the static files."""
+    written = 0
+    for asset in static_assets.assets.values():
+        if not asset.compressible:
+            continue
+        with open(asset.path, 'rb') as f:
+            data = f.read()
+        encoded = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            encoded['.br'] = brotli.compress(data, quality=11)
+        for suffix, body in encoded.items():
+            if len(body) < len(data):
+                with open(asset.path + suffix, 'wb') as f:
+                    f.write(body)
+                written += 1
+    if brotli is None:
+        click.echo('brotli is not installed; wrote gzip variants only.')
+    click.echo(f'Wrote {written} compressed variant(s) under {static_assets.directory}.')
@@ -0,0 +1,298 @@
+"""Endpoint load benchmark with latency percentiles and regression baselines.
+
+Boots ``app`` from wsgi.py against --database-url, or a scratch SQLite database
+built with the migrations and seeded with ``generate_data`` when none is given,
+then replays request mixes with --concurrency threads, each with its own test
+client. Requests go through the whole WSGI app, without a network socket. For
+every route it reports p50/p95/p99 latency, throughput, errors and queries per
+request; results can be saved as a JSON baseline and compared with one:
+
+    cd backend
+    python -m benchmarks.load --save baseline.json
+    python -m benchmarks.load --mix workspace --compare baseline.json --threshold 0.15
+
+A comparison exits non-zero when a route's p95 latency or queries per request
+grow, or its throughput drops, by more than the threshold. Query counts of the
+cached routes vary with the hit rate; an extra query on a route that always
+issues the same ones shows up as a jump of 50% or more.
+Routes with fewer than MIN_SAMPLES requests in either run are too noisy to
+compare and are skipped; compare runs made with the same settings.
+An existing database must have been seeded with ``flask generate-data``.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MIN_SAMPLES = 20
+
+# Request kind -> weight, per mix
+MIXES = {
+    'login-storm': {'login': 1},
+    'catalog-browse': {'catalog': 2, 'catalog_revalidate': 3, 'course': 4},
+    'workspace': {'workspace': 3, 'item_list': 1},
+    'completion-toggles': {'toggle_completion': 1},
+    'discussions': {'item_discussions': 6, 'course_discussions': 2, 'post_item_discussion': 1},
+    'search': {'search': 1},
+    'mixed': {
+        'login': 1, 'catalog': 2, 'catalog_revalidate': 4, 'course': 4, 'workspace': 8, 'item_list': 2,
+        'toggle_completion': 3, 'item_discussions': 6, 'course_discussions': 2, 'post_item_discussion': 1,
+    },
+}
+
+class Fixtures:
+    """Users, enrollments and items sampled from the database for building requests."""
+
+    def __init__(self, app, password, sample=500, seed=1):
+        from flask_jwt_extended import create_access_token
+        from sqlalchemy import func, select
+        from models import db, ITEM_TYPES, User, Enrollment, CourseItem
+        segments = {discriminator: item_type for item_type, discriminator in ITEM_TYPES.items()}
+        with app.app_context():
+            enrollments = db.session.execute(
+                select(User.id, User.email, Enrollment.course_id)
+                .join(Enrollment, Enrollment.user_id == User.id)
+                .where(User.email.like('gen%@example.com'))
+                .order_by(func.random())
+                .limit(sample)
+            ).all()
+            if not enrollments:
+                raise SystemExit('No generated users with enrollments; seed the database with flask generate-data')
+            course_ids = sorted({e.course_id for e in enrollments})
+            self.items = defaultdict(list)
+            for item in db.session.execute(
+                select(CourseItem.id, CourseItem.course_id, CourseItem.item_type).where(CourseItem.course_id.in_(course_ids))
+            ):
+                self.items[item.course_id].append((segments[item.item_type], item.id))
+            self.enrollments = [e for e in enrollments if self.items[e.course_id]]
+            self.tokens = {e.id: create_access_token(identity=str(e.id)) for e in self.enrollments}
+        self.password = password
+        self.etags = {}
+
+    def pick(self, rng):
+        """A random (user id, email, course id, (item type, item id)) the user is enrolled for."""
+        e = rng.choice(self.enrollments)
+        return e.id, e.email, e.course_id, rng.choice(self.items[e.course_id])
+
+def build_request(kind, fixtures, rng):
+    """(method, path, JSON body, headers) for one request of ``kind``."""
+    user_id, email, course_id, (item_type, item_id) = fixtures.pick(rng)
+    auth = {'Authorization': f'Bearer {fixtures.tokens[user_id]}'}
+    if kind == 'login':
+        return 'POST', '/api/login', {'email': email, 'password': fixtures.password}, {}
+    if kind == 'catalog':
+        return 'GET', '/api/courses', None, {}
+    if kind == 'catalog_revalidate':
+        # A browser revalidating its copy; a 304 unless the catalog changed
+        etag = fixtures.etags.get('/api/courses')
+        return 'GET', '/api/courses', None, {'If-None-Match': etag} if etag else {}
+    if kind == 'course':
+        return 'GET', f'/api/courses/{course_id}', None, {}
+    if kind == 'workspace':
+        return 'GET', f'/api/courses/{course_id}/workspace', None, auth
+    if kind == 'item_list':
+        return 'GET', f'/api/courses/{course_id}/{item_type}', None, auth
+    if kind == 'toggle_completion':
+        return 'POST', f'/api/{item_type}/{item_id}/completion', {'is_complete': rng.random() < 0.6}, auth
+    if kind == 'item_discussions':
+        return 'GET', f'/api/{item_type}/{item_id}/discussions', None, auth
+    if kind == 'course_discussions':
+        return 'GET', f'/api/discussions/{course_id}', None, {}
+    if kind == 'search':
+        # Topic words are in many generated posts, so the candidate bound is reached
+        from datagen import TOPICS
+        return 'GET', f'/api/search?q={rng.choice(TOPICS)}', None, auth
+    if kind == 'post_item_discussion':
+        return 'POST', f'/api/{item_type}/{item_id}/discussions', {'content': f'Benchmark post {rng.random():.6f}'}, auth
+    raise ValueError(f'Unknown request kind: {kind}')
+
+def percentile(values, p):
+    """Nearest-rank percentile of sorted ``values``."""
+    return values[max(0, min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1))]
+
+def run_mix(app, fixtures, weights, requests, concurrency, seed, warmup):
+    """Replay ``requests`` requests of a mix; returns its summary with per-route stats."""
+    from models import db
+    from sqlalchemy import event
+    adapter = app.url_map.bind('localhost')
+    local = threading.local()
+    with app.app_context():
+        engine = db.engine
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        local.queries = getattr(local, 'queries', 0) + 1
+
+    kinds, kind_weights = zip(*weights.items())
+    samples = defaultdict(list)
+    remaining = [warmup + requests]
+    measure_started = []
+    lock = threading.Lock()
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        client = app.test_client()
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+                measured = remaining[0] < requests
+                if measured and not measure_started:
+                    measure_started.append(time.perf_counter())
+            kind = rng.choices(kinds, kind_weights)[0]
+            method, path, body, headers = build_request(kind, fixtures, rng)
+            local.queries = 0
+            started = time.perf_counter()
+            response = client.open(path, method=method, json=body, headers=headers)
+            response.get_data()
+            elapsed = time.perf_counter() - started
+            response.close()
+            if path == '/api/courses' and response.headers.get('ETag'):
+                fixtures.etags[path] = response.headers['ETag']
+            if measured:
+                endpoint = adapter.match(path.partition('?')[0], method=method)[0]
+                with lock:
+                    samples[endpoint].append((elapsed, local.queries, response.status_code))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - measure_started[0]
+    event.remove(engine, 'before_cursor_execute', count_query)
+    routes = {}
+    for endpoint, rows in sorted(samples.items()):
+        latencies = sorted(elapsed for elapsed, _, _ in rows)
+        routes[endpoint] = {
+            'count': len(rows),
+            'errors': sum(1 for _, _, status in rows if status >= 400),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+            'throughput': round(len(rows) / wall, 2),
+            'queries_per_request': round(sum(queries for _, queries, _ in rows) / len(rows), 3),
+        }
+    return {'requests': sum(r['count'] for r in routes.values()), 'throughput': round(requests / wall, 2), 'routes': routes}
+
+def compare(results, baseline, threshold):
+    """Regression messages for routes that got slower or issue more queries than the baseline."""
+    regressions = []
+    for mix, summary in results['mixes'].items():
+        base_mix = baseline.get('mixes', {}).get(mix)
+        if base_mix is None:
+            continue
+        for endpoint, route in summary['routes'].items():
+            base = base_mix['routes'].get(endpoint)
+            if base is None or min(base['count'], route['count']) < MIN_SAMPLES:
+                continue
+            if route['p95_ms'] > base['p95_ms'] * (1 + threshold):
+                regressions.append(f'{mix} {endpoint}: p95 {base["p95_ms"]:.1f} -> {route["p95_ms"]:.1f} ms')
+            if route['throughput'] < base['throughput'] * (1 - threshold):
+                regressions.append(f'{mix} {endpoint}: throughput {base["throughput"]:.1f} -> {route["throughput"]:.1f}/s')
+            if route['queries_per_request'] > base['queries_per_request'] * (1 + threshold):
+                regressions.append(
+                    f'{mix} {endpoint}: queries/request {base["queries_per_request"]:.2f} -> {route["queries_per_request"]:.2f}'
+                )
+    return regressions
+
+def print_mix(mix, summary, baseline_mix=None):
+    print(f'\n{mix}: {summary["requests"]} requests, {summary["throughput"]:.1f} req/s')
+    print(f'  {"route":34} {"count":>6} {"err":>4} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"req/s":>8} {"queries":>8}')
+    for endpoint, r in summary['routes'].items():
+        line = (
+            f'  {endpoint:34} {r["count"]:6} {r["errors"]:4} {r["p50_ms"]:8.2f} {r["p95_ms"]:8.2f} '
+            f'{r["p99_ms"]:8.2f} {r["throughput"]:8.1f} {r["queries_per_request"]:8.2f}'
+        )
+        base = (baseline_mix or {}).get('routes', {}).get(endpoint)
+        if base and base['p95_ms']:
+            line += f'  p95 {(r["p95_ms"] / base["p95_ms"] - 1) * 100:+.0f}%'
+        print(line)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--database-url', help='Seeded database to use (default: a scratch SQLite database)')
+    parser.add_argument('--mix', action='append', choices=sorted(MIXES), help='Mix to run (repeatable; default all)')
+    parser.add_argument('--requests', type=int, default=500, help='Measured requests per mix')
+    parser.add_argument('--warmup', type=int, default=50, help='Unmeasured requests before each mix')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--password', default='password', help='Password of the generated users')
+    parser.add_argument('--users', type=int, default=2000, help='Users to generate in a scratch database')
+    parser.add_argument('--courses', type=int, default=20, help='Courses to generate in a scratch database')
+    parser.add_argument('--save', metavar='FILE', help='Write the results as a JSON baseline')
+    parser.add_argument('--compare', metavar='FILE', help='Baseline to compare with')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Allowed relative slowdown before a regression')
+    args = parser.parse_args(argv)
+    # The app is run from the backend directory
+    save = os.path.abspath(args.save) if args.save else None
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    with tempfile.TemporaryDirectory() as scratch:
+        # Config is read when the app is imported
+        os.environ['DATABASE_URL'] = args.database_url or f'sqlite:///{os.path.join(scratch, "load.db")}'
+        os.chdir(BACKEND_DIR)
+        sys.path.insert(0, BACKEND_DIR)
+        from wsgi import app
+        if not args.database_url:
+            from flask_migrate import upgrade
+            from datagen import generate_data
+            with app.app_context():
+                upgrade()
+                generate_data(
+                    courses=args.courses, items_per_course=18, users=args.users, enrollment_density=0.2,
+                    completion_ratio=0.4, posts_per_thread=10, seed=args.seed, password=args.password,
+                )
+        fixtures = Fixtures(app, args.password, seed=args.seed)
+        from models import db
+        with app.app_context():
+            dialect = db.engine.dialect.name
+        results = {
+            'meta': {
+                'created': datetime.utcnow().isoformat(timespec='seconds'),
+                'database': dialect,
+                'concurrency': args.concurrency,
+                'requests': args.requests,
+                'seed': args.seed,
+                'python': platform.python_version(),
+            },
+            'mixes': {},
+        }
+        print(f'{dialect} database, concurrency {args.concurrency}')
+        for mix in args.mix or list(MIXES):
+            summary = run_mix(app, fixtures, MIXES[mix], args.requests, args.concurrency, args.seed, args.warmup)
+            results['mixes'][mix] = summary
+            print_mix(mix, summary, (baseline or {}).get('mixes', {}).get(mix))
+
+    if save:
+        with open(save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f'\nSaved baseline to {save}')
+    if baseline is not None:
+        settings = ('database', 'concurrency', 'requests')
+        if any(baseline.get('meta', {}).get(key) != results['meta'][key] for key in settings):
+            print(f'\nWarning: the baseline was recorded with different {"/".join(settings)}')
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f'\n{len(regressions)} regression(s) beyond {args.threshold:.0%}:')
+            for regression in regressions:
+                print(f'  {regression}')
+            sys.exit(1)
+        print(f'\nNo regressions beyond {args.threshold:.0%} against {args.compare}')
+
+if __name__ == '__main__':
+    main()
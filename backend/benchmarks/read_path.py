@@ -0,0 +1,213 @@
+"""Before/after micro-benchmark for the column-only read path in reads.py.
+
+For each GET route whose data access moved to reads.py, runs the ORM code the
+route used before and the code it uses now against a scratch SQLite database
+built with the migrations, and reports per-call latency (median and p95) and
+allocation (peak traced memory and allocated blocks left live until the
+session is closed). Each call runs in its own request context and session, as
+a request would; the content cache is bypassed so every call reads the
+database. Both versions must return the same data.
+
+    cd backend && python -m benchmarks.read_path [--courses 20] [--users 500] [--posts 2000]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from flask import request
+from flask_migrate import upgrade
+from sqlalchemy import and_, insert, or_, select
+from sqlalchemy.orm import joinedload
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import reads
+from catalog import load_catalog, load_course, load_course_items
+from models import db, ITEM_TYPES, User, Course, Enrollment, Discussion, CourseItem, ItemCompletion, ItemDiscussion
+from pagination import decode_cursor, page_size, paginate_discussions
+from query_plans import create_check_app
+from routes import discussion_json, discussion_row_json
+
+# A stored scrypt hash is about this long; the ORM path loads it with every user
+PASSWORD_HASH = 'scrypt:32768:8:1$' + 'x' * 16 + '$' + 'f' * 128
+
+def seed(courses, users, posts):
+    """Bulk-load the benchmark data; returns the ids the scenarios read."""
+    start = datetime(2026, 1, 1)
+    db.session.execute(insert(User), [
+        {'name': f'Student {i}', 'email': f'student{i}@example.com', 'student_id': f'S-{i}', 'password_hash': PASSWORD_HASH}
+        for i in range(1, users + 1)
+    ])
+    db.session.execute(insert(Course), [
+        {'id': c, 'title': f'Course {c}', 'description': f'Description of course {c} ' * 8} for c in range(1, courses + 1)
+    ])
+    db.session.execute(insert(CourseItem.__table__), [
+        {'course_id': c, 'item_type': discriminator, 'title': f'{discriminator} {n}', 'description': f'Instructions for {discriminator} {n} ' * 6}
+        for c in range(1, courses + 1) for discriminator in ITEM_TYPES.values() for n in range(10)
+    ])
+    db.session.execute(insert(Enrollment), [
+        {'user_id': u, 'course_id': c, 'progress': (u * c) % 100, 'date_enrolled': start}
+        for u in range(1, users + 1) for c in range(1, courses + 1) if (u + c) % 4 == 0 or u == 1
+    ])
+    item_id = db.session.execute(select(CourseItem.id).where(CourseItem.course_id == 1).order_by(CourseItem.id)).scalars().first()
+    db.session.execute(insert(ItemCompletion), [
+        {'user_id': 1, 'item_id': i, 'is_complete': True}
+        for i in db.session.execute(select(CourseItem.id).where(CourseItem.course_id == 1)).scalars() if i % 2
+    ])
+    db.session.execute(insert(Discussion), [
+        {'course_id': 1, 'user_id': 1 + p % users, 'content': f'Course discussion post {p} ' * 5, 'timestamp': start + timedelta(seconds=p)}
+        for p in range(posts)
+    ])
+    db.session.execute(insert(ItemDiscussion), [
+        {'item_id': item_id, 'user_id': 1 + p % users, 'content': f'Lab discussion post {p} ' * 5, 'timestamp': start + timedelta(seconds=p)}
+        for p in range(posts)
+    ])
+    db.session.commit()
+    return item_id
+
+# The ORM code the routes used before reads.py
+
+def orm_catalog():
+    return [
+        {'id': c.id, 'title': c.title, 'description': c.description, 'instructor_id': c.instructor_id}
+        for c in Course.query.all()
+    ]
+
+def orm_course(course_id):
+    course = db.session.get(Course, course_id)
+    enrolled_users = db.session.execute(select(Enrollment.user_id).where(Enrollment.course_id == course_id)).scalars().all()
+    return {'id': course.id, 'title': course.title, 'description': course.description, 'instructor_id': course.instructor_id, 'enrolled_users': enrolled_users}
+
+def orm_enrollments(user_id):
+    return [
+        {'id': e.id, 'course_id': e.course_id, 'progress': e.progress, 'date_enrolled': e.date_enrolled.isoformat() if e.date_enrolled else None}
+        for e in Enrollment.query.filter_by(user_id=user_id).all()
+    ]
+
+def orm_discussion_page(model, thread_column, thread_id):
+    query = model.query.options(joinedload(model.user)).filter(thread_column == thread_id)
+    cursor = request.args.get('cursor')
+    if cursor:
+        timestamp, row_id = decode_cursor(cursor)
+        query = query.filter(or_(model.timestamp < timestamp, and_(model.timestamp == timestamp, model.id < row_id)))
+    limit = page_size()
+    discussions = query.order_by(model.timestamp.desc(), model.id.desc()).limit(limit + 1).all()
+    return [discussion_json(d) for d in discussions[:limit]]
+
+def orm_workspace(user_id, course_id):
+    items = load_course_items(course_id)
+    item_ids = [item['id'] for entries in items.values() for item in entries]
+    completed = set(db.session.execute(
+        select(ItemCompletion.item_id)
+        .where(ItemCompletion.user_id == user_id, ItemCompletion.is_complete == True, ItemCompletion.item_id.in_(item_ids))
+    ).scalars())
+    enrollment = Enrollment.query.filter_by(user_id=user_id, course_id=course_id).first()
+    return items, completed, enrollment.progress if enrollment else None
+
+# The same data through reads.py
+
+def discussion_page(model, thread_column, thread_id):
+    discussions, _ = paginate_discussions(model, thread_column, thread_id)
+    return [discussion_row_json(r) for r in discussions]
+
+def workspace(user_id, course_id):
+    items = load_course_items(course_id)
+    completed = reads.completed_item_ids(user_id, [item['id'] for entries in items.values() for item in entries])
+    return items, completed, reads.enrollment_progress(user_id, course_id)
+
+def enrollments(user_id):
+    return [
+        {'id': e.id, 'course_id': e.course_id, 'progress': e.progress, 'date_enrolled': e.date_enrolled.isoformat() if e.date_enrolled else None}
+        for e in reads.user_enrollments(user_id)
+    ]
+
+def scenarios(item_id, cursor):
+    """(route, request path, before, after)"""
+    return [
+        ('get_courses', '/api/courses', orm_catalog, load_catalog),
+        ('get_course', '/api/courses/1', lambda: orm_course(1), lambda: load_course(1)),
+        ('get_enrollments', '/api/enrollments/1', lambda: orm_enrollments(1), lambda: enrollments(1)),
+        ('get_discussions', '/api/discussions/1',
+         lambda: orm_discussion_page(Discussion, Discussion.course_id, 1),
+         lambda: discussion_page(Discussion, Discussion.course_id, 1)),
+        ('get_discussions (limit=200, cursor)', f'/api/discussions/1?limit=200&cursor={cursor}',
+         lambda: orm_discussion_page(Discussion, Discussion.course_id, 1),
+         lambda: discussion_page(Discussion, Discussion.course_id, 1)),
+        ('get_lab_discussions', f'/api/labs/{item_id}/discussions',
+         lambda: orm_discussion_page(ItemDiscussion, ItemDiscussion.item_id, item_id),
+         lambda: discussion_page(ItemDiscussion, ItemDiscussion.item_id, item_id)),
+        ('get_workspace', '/api/courses/1/workspace', lambda: orm_workspace('1', 1), lambda: workspace('1', 1)),
+    ]
+
+def call(app, path, fn):
+    with app.test_request_context(path):
+        try:
+            return fn()
+        finally:
+            db.session.remove()
+
+def measure(app, path, fn, iterations):
+    for _ in range(min(iterations, 20)):
+        call(app, path, fn)
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        call(app, path, fn)
+        timings.append(time.perf_counter() - start)
+    peaks, blocks = [], []
+    tracemalloc.start()
+    try:
+        for _ in range(max(iterations // 10, 5)):
+            with app.test_request_context(path):
+                tracemalloc.reset_peak()
+                base, _ = tracemalloc.get_traced_memory()
+                blocks_before = sys.getallocatedblocks()
+                fn()
+                blocks.append(sys.getallocatedblocks() - blocks_before)
+                peaks.append(tracemalloc.get_traced_memory()[1] - base)
+                db.session.remove()
+    finally:
+        tracemalloc.stop()
+    timings.sort()
+    return {
+        'median_us': statistics.median(timings) * 1e6,
+        'p95_us': timings[int(len(timings) * 0.95) - 1] * 1e6,
+        'peak_kib': statistics.median(peaks) / 1024,
+        'blocks': statistics.median(blocks),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--courses', type=int, default=20)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--posts', type=int, default=2000)
+    parser.add_argument('--iterations', type=int, default=300)
+    args = parser.parse_args(argv)
+    with tempfile.TemporaryDirectory() as scratch:
+        app = create_check_app(f'sqlite:///{os.path.join(scratch, "bench.db")}')
+        app.config['TESTING'] = False
+        with app.app_context():
+            upgrade()
+            item_id = seed(args.courses, args.users, args.posts)
+            db.session.remove()
+        # A cursor some way into the thread, for the deep-page scenario
+        with app.test_request_context('/api/discussions/1?limit=200'):
+            _, cursor = paginate_discussions(Discussion, Discussion.course_id, 1)
+            db.session.remove()
+        print(f'{args.courses} courses, {args.users} users, {args.posts} posts per thread, {args.iterations} iterations')
+        print(f'{"route":38} {"":6} {"median µs":>10} {"p95 µs":>10} {"peak KiB":>9} {"blocks":>7}')
+        for route, path, before, after in scenarios(item_id, cursor):
+            if call(app, path, before) != call(app, path, after):
+                raise SystemExit(f'{route}: before and after return different data')
+            results = {label: measure(app, path, fn, args.iterations) for label, fn in (('before', before), ('after', after))}
+            for label, r in results.items():
+                print(f'{route if label == "before" else "":38} {label:6} {r["median_us"]:10.0f} {r["p95_us"]:10.0f} {r["peak_kib"]:9.1f} {r["blocks"]:7.0f}')
+            speedup = results['before']['median_us'] / results['after']['median_us']
+            print(f'{"":38} {"":6} {speedup:9.2f}x')
+
+if __name__ == '__main__':
+    main()
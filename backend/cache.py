@@ -0,0 +1,204 @@
+"""Two-tier read cache: an in-process LRU with TTL in front of a shared backend.
+
+The L1 tier lives in each gunicorn worker. The L2 tier is shared by all workers
+on a host: by default a directory of JSON files, placed in /dev/shm (shared
+memory) when available. A Redis-compatible server can be used instead by
+setting CACHE_L2_URL to a redis:// URL (requires the ``redis`` package).
+Values must be JSON serializable.
+
+Invalidation is explicit: deleting a key removes it from this worker's L1 and
+from L2. Other workers' L1 copies expire after CACHE_L1_TTL seconds, so keep
+that short. Entries loaded with a ``version`` are stored with it, and a read
+that knows a newer version treats them as misses, so a versioned response
+never pairs a new version with another worker's stale copy.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+class LRUCache:
+    """Thread-safe in-process LRU cache with a per-entry TTL."""
+
+    def __init__(self, max_entries=256, ttl=5):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return ``(found, value)``."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class FileBackend:
+    """L2 backend storing one JSON file per key in a shared directory."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + '.json')
+
+    def get(self, key):
+        try:
+            with open(self._path(key)) as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return False, None
+        if entry['expires'] < time.time():
+            self.delete(key)
+            return False, None
+        return True, entry['value']
+
+    def set(self, key, value, ttl):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'expires': time.time() + ttl, 'value': value}, f)
+        os.replace(tmp, self._path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+class RedisBackend:
+    """L2 backend for any server speaking the Redis protocol."""
+
+    def __init__(self, url, prefix):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            return False, None
+        return True, json.loads(raw)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, json.dumps(value), ex=max(1, int(ttl)))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+def default_l2_directory():
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, 'studyhub-cache')
+
+def create_backend(url, namespace):
+    """Build an L2 backend from CACHE_L2_URL: ``file://[/path]``, ``redis://...`` or empty for none.
+
+    ``namespace`` keeps apps pointed at different databases from sharing entries.
+    """
+    if not url:
+        return None
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBackend(url, prefix=f'studyhub:{namespace}:')
+    if url.startswith('file://'):
+        return FileBackend(os.path.join(url[len('file://'):] or default_l2_directory(), namespace))
+    raise ValueError(f'Unsupported CACHE_L2_URL: {url}')
+
+def fresh(entry, version):
+    """True if a stored entry is usable when ``version`` is current."""
+    # Anything else was written by an older release into a persistent L2
+    if not isinstance(entry, dict) or entry.keys() != {'version', 'value'}:
+        return False
+    return version is None or (entry['version'] is not None and entry['version'] >= version)
+
+class TwoTierCache:
+    def __init__(self):
+        self.l1 = LRUCache()
+        self.l2 = None
+        self.l2_ttl = 300
+        self.counters = dict.fromkeys(('l1_hits', 'l2_hits', 'misses', 'l2_errors', 'invalidations'), 0)
+
+    def init_app(self, app):
+        self.l1 = LRUCache(app.config['CACHE_L1_MAX_ENTRIES'], app.config['CACHE_L1_TTL'])
+        namespace = hashlib.sha1(app.config['SQLALCHEMY_DATABASE_URI'].encode()).hexdigest()[:12]
+        self.l2 = create_backend(app.config['CACHE_L2_URL'], namespace)
+        self.l2_ttl = app.config['CACHE_L2_TTL']
+        app.extensions['content_cache'] = self
+
+    def _l2(self, operation, *args):
+        # The shared tier is an optimization; treat its failures as misses
+        try:
+            return getattr(self.l2, operation)(*args)
+        except Exception:
+            self.counters['l2_errors'] += 1
+            logger.warning('L2 cache %s failed', operation, exc_info=True)
+            return False, None
+
+    def get_or_load(self, key, loader, version=None):
+        """Return the cached value for ``key``, calling ``loader()`` on a miss.
+
+        With ``version``, entries stored for an older version are misses. A
+        ``None`` result from the loader is returned but not cached.
+        """
+        found, entry = self.l1.get(key)
+        if found and fresh(entry, version):
+            self.counters['l1_hits'] += 1
+            return entry['value']
+        if self.l2 is not None:
+            found, entry = self._l2('get', key)
+            if found and fresh(entry, version):
+                self.counters['l2_hits'] += 1
+                self.l1.set(key, entry)
+                return entry['value']
+        self.counters['misses'] += 1
+        value = loader()
+        if value is not None:
+            # Loaded after the version was read, so at least that new
+            entry = {'version': version, 'value': value}
+            self.l1.set(key, entry)
+            if self.l2 is not None:
+                self._l2('set', key, entry, self.l2_ttl)
+        return value
+
+    def delete(self, *keys):
+        for key in keys:
+            self.counters['invalidations'] += 1
+            self.l1.delete(key)
+            if self.l2 is not None:
+                self._l2('delete', key)
+
+    def stats(self):
+        return dict(self.counters, l1_evictions=self.l1.evictions, l1_entries=len(self.l1))
+
+content_cache = TwoTierCache()
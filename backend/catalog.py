@@ -0,0 +1,62 @@
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import reads
+from cache import content_cache
+from models import ITEM_TYPES
+from routing import read_routing
+from versioning import CATALOG, course_scope, known_version
+
+def load_catalog():
+    return [
+        {'id': c.id, 'title': c.title, 'description': c.description, 'instructor_id': c.instructor_id}
+        for c in reads.courses()
+    ]
+
+def load_course(course_id):
+    course = reads.course(course_id)
+    if course is None:
+        return None
+    enrolled_users = reads.course_user_ids(course_id)
+    return {'id': course.id, 'title': course.title, 'description': course.description, 'instructor_id': course.instructor_id, 'enrolled_users': enrolled_users}
+
+def load_course_items(course_id):
+    items = {item_type: [] for item_type in ITEM_TYPES}
+    segments = {discriminator: item_type for item_type, discriminator in ITEM_TYPES.items()}
+    for r in reads.course_items(course_id):
+        items[segments[r.item_type]].append({'id': r.id, 'title': r.title, 'description': r.description})
+    return items
+
+def load_from_primary(loader, *args):
+    # Shared cache entries outlive replica lag, so they are filled from the primary
+    with read_routing.primary():
+        return loader(*args)
+
+# Versioned routes pass the version of their ETag, so the body is never older than the tag
+
+def get_catalog():
+    return content_cache.get_or_load(CATALOG, lambda: load_from_primary(load_catalog), known_version(CATALOG))
+
+def get_course_detail(course_id):
+    """Course detail with enrolled user ids, or None if the course does not exist."""
+    scope = course_scope(course_id)
+    return content_cache.get_or_load(scope, lambda: load_from_primary(load_course, course_id), known_version(scope))
+
+def get_course_items(course_id):
+    """Labs, quizzes and exams of a course as ``{item_type: [item, ...]}``."""
+    scope = course_scope(course_id)
+    return content_cache.get_or_load(f'{scope}:items', lambda: load_from_primary(load_course_items, course_id), known_version(scope))
+
+def invalidate_scope(scope):
+    if scope == CATALOG:
+        content_cache.delete(CATALOG)
+    else:
+        content_cache.delete(scope, f'{scope}:items')
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed_scopes(session):
+    for scope in session.info.pop('changed_scopes', ()):
+        invalidate_scope(scope)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_rolled_back_scopes(session):
+    session.info.pop('changed_scopes', None)
@@ -0,0 +1,157 @@
+"""Accept-Encoding negotiated compression of API responses.
+
+An ``after_request`` hook on ``api_bp`` requests gzips (or, with the
+``brotli`` package installed, brotli-compresses) JSON and text responses of
+at least API_COMPRESSION_MIN_SIZE bytes, at API_GZIP_LEVEL / API_BROTLI_QUALITY.
+Streamed responses are compressed chunk by chunk as they are produced, each
+chunk flushed so the client can start parsing; Server-Sent Events and
+responses that already have a Content-Encoding are left alone.
+
+Every compressible response gets ``Vary: Accept-Encoding``. Its strong ETag
+is weakened (``W/"..."``) whenever the client accepts an encoding, compressed
+or not, so one client always sees one ETag for a version; ``If-None-Match``
+uses weak comparison, so conditional GETs keep answering 304.
+
+The thread CPU time spent compressing, with bytes in and out, is counted per
+endpoint and encoding and exported by metrics.py.
+"""
+import threading
+import time
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/plain', 'text/html', 'text/csv')
+
+class GzipEncoder:
+    name = 'gzip'
+
+    def __init__(self, level):
+        # wbits 31: zlib stream with a gzip header and trailer
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+class BrotliEncoder:
+    name = 'br'
+
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+class ApiCompression:
+    def __init__(self):
+        self.min_size = 1024
+        self.gzip_level = 6
+        self.brotli_quality = 4
+        # (endpoint, encoding) -> [responses, bytes in, bytes out, CPU seconds]
+        self.totals = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.min_size = app.config['API_COMPRESSION_MIN_SIZE']
+        self.gzip_level = app.config['API_GZIP_LEVEL']
+        self.brotli_quality = app.config['API_BROTLI_QUALITY']
+        app.extensions['api_compression'] = self
+        app.after_request(self._after_request)
+
+    def _encoder(self):
+        """Encoder for the best encoding the client accepts, or None."""
+        accepted = request.accept_encodings
+        candidates = []
+        if brotli is not None and self.brotli_quality >= 0 and accepted['br']:
+            candidates.append((accepted['br'], 1, 'br'))
+        if self.gzip_level > 0 and accepted['gzip']:
+            candidates.append((accepted['gzip'], 0, 'gzip'))
+        if not candidates:
+            return None
+        # Highest quality value wins; brotli on a tie
+        name = max(candidates)[2]
+        return BrotliEncoder(self.brotli_quality) if name == 'br' else GzipEncoder(self.gzip_level)
+
+    def record(self, endpoint, encoding, size_in, size_out, cpu):
+        with self._lock:
+            totals = self.totals.setdefault((endpoint, encoding), [0, 0, 0, 0.0])
+            totals[0] += 1
+            totals[1] += size_in
+            totals[2] += size_out
+            totals[3] += cpu
+
+    def stats(self):
+        with self._lock:
+            return {key: list(values) for key, values in self.totals.items()}
+
+    def _after_request(self, response):
+        if request.blueprint != 'api' or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+            return response
+        if 'Content-Encoding' in response.headers or response.cache_control.no_transform:
+            return response
+        response.vary.add('Accept-Encoding')
+        encoder = self._encoder()
+        if encoder is None:
+            return response
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        if response.status_code not in (200, 201) or response.direct_passthrough:
+            return response
+        endpoint = request.url_rule.endpoint if request.url_rule else 'unmatched'
+        if response.is_streamed:
+            response.response = self._stream(response.response, encoder, endpoint)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            started = time.thread_time()
+            compressed = encoder.compress(data) + encoder.finish()
+            self.record(endpoint, encoder.name, len(data), len(compressed), time.thread_time() - started)
+            response.set_data(compressed)
+        response.content_encoding = encoder.name
+        return response
+
+    def _stream(self, chunks, encoder, endpoint):
+        size_in = size_out = 0
+        cpu = 0.0
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                started = time.thread_time()
+                compressed = encoder.compress(chunk) + encoder.flush()
+                cpu += time.thread_time() - started
+                size_in += len(chunk)
+                size_out += len(compressed)
+                if compressed:
+                    yield compressed
+            started = time.thread_time()
+            tail = encoder.finish()
+            cpu += time.thread_time() - started
+            size_out += len(tail)
+            yield tail
+            self.record(endpoint, encoder.name, size_in, size_out, cpu)
+        finally:
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()
+
+api_compression = ApiCompression()
@@ -3,5 +3,68 @@ import os
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY', 'dev')
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///app.db')
+    # Comma-separated read replica URLs; GET requests read from them (routing.py)
+    DATABASE_REPLICA_URLS = os.environ.get('DATABASE_REPLICA_URLS', '')
+    REPLICA_POOL_SIZE = int(os.environ.get('REPLICA_POOL_SIZE', 5))
+    REPLICA_MAX_OVERFLOW = int(os.environ.get('REPLICA_MAX_OVERFLOW', 10))
+    READ_AFTER_WRITE_SECONDS = float(os.environ.get('READ_AFTER_WRITE_SECONDS', 5))
+    REPLICA_RETRY_SECONDS = float(os.environ.get('REPLICA_RETRY_SECONDS', 30))
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'super-secret') 
+    # Engine profiles (engine_tuning.py); WEB_CONCURRENCY is gunicorn's worker count
+    WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))
+    WORKER_CONCURRENCY = int(os.environ.get('WORKER_CONCURRENCY', 1))
+    DATABASE_MAX_CONNECTIONS = int(os.environ.get('DATABASE_MAX_CONNECTIONS', 20))
+    DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', 0))
+    DATABASE_POOL_RECYCLE = int(os.environ.get('DATABASE_POOL_RECYCLE', 1800))
+    DATABASE_STATEMENT_TIMEOUT = float(os.environ.get('DATABASE_STATEMENT_TIMEOUT', 30))
+    # Seconds a greenlet may run without yielding before it is reported (cooperative.py)
+    EVENT_LOOP_MAX_BLOCKING = float(os.environ.get('EVENT_LOOP_MAX_BLOCKING', 0.1))
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_BUSY_TIMEOUT = float(os.environ.get('SQLITE_BUSY_TIMEOUT', 5))
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', 16384))
+    JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'super-secret')
+    COMPLETION_BATCH_LIMIT = int(os.environ.get('COMPLETION_BATCH_LIMIT', 500))
+    DISCUSSION_PAGE_SIZE = int(os.environ.get('DISCUSSION_PAGE_SIZE', 50))
+    DISCUSSION_MAX_PAGE_SIZE = int(os.environ.get('DISCUSSION_MAX_PAGE_SIZE', 200))
+    CONTENT_CACHE_CONTROL = os.environ.get('CONTENT_CACHE_CONTROL', 'no-cache')
+    CACHE_L1_MAX_ENTRIES = int(os.environ.get('CACHE_L1_MAX_ENTRIES', 256))
+    CACHE_L1_TTL = float(os.environ.get('CACHE_L1_TTL', 5))
+    CACHE_L2_URL = os.environ.get('CACHE_L2_URL', 'file://')
+    CACHE_L2_TTL = float(os.environ.get('CACHE_L2_TTL', 300))
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_QUEUE_LIMIT = int(os.environ.get('PASSWORD_HASH_QUEUE_LIMIT', 16))
+    PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))
+    MEMBERSHIP_CACHE_MAX_ENTRIES = int(os.environ.get('MEMBERSHIP_CACHE_MAX_ENTRIES', 4096))
+    MEMBERSHIP_CACHE_TTL = float(os.environ.get('MEMBERSHIP_CACHE_TTL', 30))
+    DISCUSSION_EVENTS_URL = os.environ.get('DISCUSSION_EVENTS_URL', 'memory://')
+    SSE_HEARTBEAT = float(os.environ.get('SSE_HEARTBEAT', 15))
+    SSE_STREAM_TIMEOUT = float(os.environ.get('SSE_STREAM_TIMEOUT', 300))
+    SSE_TOKEN_TTL = float(os.environ.get('SSE_TOKEN_TTL', 60))
+    SSE_MAX_SUBSCRIBERS = int(os.environ.get('SSE_MAX_SUBSCRIBERS', 100))
+    SSE_HISTORY = int(os.environ.get('SSE_HISTORY', 200))
+    SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', 20))
+    SEARCH_MAX_PAGE_SIZE = int(os.environ.get('SEARCH_MAX_PAGE_SIZE', 100))
+    SEARCH_CANDIDATES = int(os.environ.get('SEARCH_CANDIDATES', 2000))
+    JSON_STREAM_CHUNK_SIZE = int(os.environ.get('JSON_STREAM_CHUNK_SIZE', 16384))
+    JSON_STREAM_YIELD_PER = int(os.environ.get('JSON_STREAM_YIELD_PER', 500))
+    DATA_GENERATOR_BATCH_SIZE = int(os.environ.get('DATA_GENERATOR_BATCH_SIZE', 10000))
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+    METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+    METRICS_DIR = os.environ.get('METRICS_DIR', '')
+    # Bearer token for Prometheus scrapes of /api/metrics; admins can read it with their JWT
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+    # Comma-separated emails of the users allowed to read the /api/*/stats and /api/metrics routes
+    ADMIN_EMAILS = os.environ.get('ADMIN_EMAILS', '')
+    PROFILE_SECRET = os.environ.get('PROFILE_SECRET', '')
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.002))
+    PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', 30))
+    PROFILE_DIR = os.environ.get('PROFILE_DIR', '')
+    PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 50))
+    STATIC_DIR = os.environ.get('STATIC_DIR', '')
+    API_COMPRESSION_MIN_SIZE = int(os.environ.get('API_COMPRESSION_MIN_SIZE', 1024))
+    API_GZIP_LEVEL = int(os.environ.get('API_GZIP_LEVEL', 6))
+    API_BROTLI_QUALITY = int(os.environ.get('API_BROTLI_QUALITY', 4))
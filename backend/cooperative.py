@@ -0,0 +1,93 @@
+"""Cooperative (gevent) worker support.
+
+With ``GUNICORN_WORKER_CLASS=gevent`` (see gunicorn.conf.py) every worker
+serves up to WORKER_CONCURRENCY requests at once on greenlets, switching
+whenever one waits for I/O. gunicorn monkey-patches the worker before it
+imports the app, and ``init_app`` notices and then:
+
+- installs a psycopg2 wait callback, so Postgres queries yield to other
+  greenlets instead of blocking the worker;
+- starts gevent's monitor thread, which logs the stack of any greenlet that
+  keeps the event loop busy for more than EVENT_LOOP_MAX_BLOCKING seconds
+  without yielding, and counts it in ``/api/metrics``.
+
+Known blocking calls go through ``submit``, which runs them on native
+threads and returns a future whose ``result`` yields to other greenlets while
+it waits. Password hashing (hashing.py) uses it. SQLite queries cannot yield, so use Postgres
+with cooperative workers.
+"""
+import logging
+import sys
+
+logger = logging.getLogger(__name__)
+
+def active():
+    """True in a process whose sockets gevent has monkey-patched."""
+    monkey = sys.modules.get('gevent.monkey')
+    return monkey is not None and monkey.is_module_patched('socket')
+
+def gevent_wait_callback(connection):
+    """psycopg2 wait callback that waits for the socket on the gevent hub."""
+    from gevent.socket import wait_read, wait_write
+    from psycopg2 import OperationalError, extensions
+    while True:
+        state = connection.poll()
+        if state == extensions.POLL_OK:
+            return
+        if state == extensions.POLL_READ:
+            wait_read(connection.fileno())
+        elif state == extensions.POLL_WRITE:
+            wait_write(connection.fileno())
+        else:
+            raise OperationalError(f'Bad result from poll: {state!r}')
+
+class Cooperative:
+    def __init__(self):
+        self.enabled = False
+        self.max_blocking = 0.1
+        self.counters = dict.fromkeys(('offloaded', 'loop_blocked'), 0)
+        self._executor = None
+
+    def init_app(self, app):
+        self.max_blocking = app.config['EVENT_LOOP_MAX_BLOCKING']
+        app.extensions['cooperative'] = self
+        if self.enabled or not active():
+            return
+        import gevent
+        from gevent import events
+        try:
+            from psycopg2 import extensions
+        except ImportError:
+            extensions = None
+        if extensions is not None:
+            extensions.set_wait_callback(gevent_wait_callback)
+        if self.max_blocking > 0:
+            gevent.config.monitor_thread = True
+            gevent.config.max_blocking_time = self.max_blocking
+            gevent.config.print_blocking_reports = False
+            events.subscribers.append(self._report)
+            gevent.get_hub().start_periodic_monitoring_thread()
+        self.enabled = True
+
+    def _report(self, event):
+        from gevent.events import EventLoopBlocked
+        if isinstance(event, EventLoopBlocked):
+            self.counters['loop_blocked'] += 1
+            # The blocked greenlet's stack; the rest of the report lists every thread and greenlet
+            lines = event.info[:event.info.index('Info:')] if 'Info:' in event.info else event.info
+            logger.warning('Event loop blocked for over %.3f s:\n%s', event.blocking_time, '\n'.join(lines).strip('=\n'))
+
+    def submit(self, function, *args):
+        """Start ``function(*args)`` on a native thread; only for cooperative workers.
+
+        Returns a ``concurrent.futures.Future``. Its done callbacks run on the
+        event loop, so they must not block.
+        """
+        import gevent
+        from gevent.threadpool import ThreadPoolExecutor
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(gevent.get_hub().threadpool.maxsize)
+        self.counters['offloaded'] += 1
+        return self._executor.submit(function, *args)
+
+cooperative = Cooperative()
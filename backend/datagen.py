@@ -0,0 +1,311 @@
+"""Synthetic data for capacity and load testing: ``flask generate-data``.
+
+Adds the demo content (seed_courses.py) if it is missing, then appends
+generated courses, items, users, enrollments, completions and discussion
+threads. Rows get their ids up front, so nothing is read back while loading,
+and are streamed to the database in batches: DBAPI ``executemany`` on SQLite,
+``COPY`` on Postgres. Enrollment counters and progress are computed as the
+completions are generated. Everything is loaded in one transaction, and the
+content versions of the new courses are bumped so cached copies and ETags
+are refreshed (bulk writes bypass the ORM hooks in versioning.py).
+
+Generated users all share the password given with ``--password``.
+"""
+import io
+import random
+import time
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import func, select
+from hashing import password_hasher
+from models import db, ITEM_TYPES, User, Course, CourseItem, Enrollment, ItemCompletion, Discussion, ItemDiscussion
+from progress import total_column, completed_column
+from seed_courses import seed_demo_content
+from versioning import CATALOG, bump_versions, course_scope
+
+# Share of a course's items of each type; the demo courses have 5 labs, 3 quizzes and 1 exam
+ITEM_MIX = {'labs': 5, 'quizzes': 3, 'exams': 1}
+
+TOPICS = (
+    'api', 'database', 'schema', 'query', 'index', 'cache', 'deployment', 'container', 'pipeline', 'test',
+    'regression', 'model', 'dataset', 'feature', 'pandas', 'numpy', 'encryption', 'network', 'firewall',
+    'prototype', 'wireframe', 'interview', 'usability', 'layout', 'component', 'function', 'recursion',
+    'algorithm', 'graph', 'tree', 'sorting', 'complexity', 'authentication', 'token', 'session', 'shell',
+)
+WORDS = (
+    'the', 'a', 'to', 'and', 'is', 'in', 'my', 'it', 'for', 'this', 'i', 'of', 'with', 'on', 'how', 'why',
+    'does', 'anyone', 'get', 'error', 'when', 'should', 'we', 'use', 'lab', 'quiz', 'exam', 'step', 'help',
+    'works', 'fails', 'example', 'question', 'answer', 'thanks', 'instead', 'after', 'before', 'again',
+)
+FIRST_NAMES = ('Amina', 'Brian', 'Chen', 'Dana', 'Elif', 'Faith', 'Grace', 'Hassan', 'Ivy', 'James', 'Kofi', 'Lena')
+LAST_NAMES = ('Achieng', 'Baker', 'Cruz', 'Diallo', 'Evans', 'Fischer', 'Gupta', 'Hughes', 'Ito', 'Kamau', 'Mensah')
+
+class BulkLoader:
+    """Streams row tuples into a table in batches on the session's connection."""
+
+    def __init__(self, connection, batch_size):
+        self.connection = connection
+        self.batch_size = batch_size
+        self.postgres = connection.dialect.name == 'postgresql'
+
+    def load(self, table, columns, rows):
+        """Insert ``rows`` (tuples in ``columns`` order) into ``table``; returns the row count."""
+        count = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                count += self._write(table, columns, batch)
+                batch = []
+        if batch:
+            count += self._write(table, columns, batch)
+        return count
+
+    def _write(self, table, columns, batch):
+        cursor = self.connection.connection.cursor()
+        try:
+            if self.postgres:
+                buffer = io.StringIO()
+                for row in batch:
+                    buffer.write('\t'.join(map(copy_text, row)))
+                    buffer.write('\n')
+                buffer.seek(0)
+                cursor.copy_expert(f'COPY "{table.name}" ({", ".join(columns)}) FROM STDIN', buffer)
+            else:
+                placeholders = ', '.join('?' for _ in columns)
+                cursor.executemany(
+                    f'INSERT INTO "{table.name}" ({", ".join(columns)}) VALUES ({placeholders})',
+                    [tuple(map(sqlite_value, row)) for row in batch],
+                )
+        finally:
+            cursor.close()
+        return len(batch)
+
+    def reset_sequences(self, tables):
+        """Move Postgres id sequences past the ids assigned here."""
+        if not self.postgres:
+            return
+        cursor = self.connection.connection.cursor()
+        try:
+            for table in tables:
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence('\"{table.name}\"', 'id'), "
+                    f'(SELECT coalesce(max(id), 0) + 1 FROM "{table.name}"), false)'
+                )
+        finally:
+            cursor.close()
+
+def copy_text(value):
+    """A value in Postgres COPY text format."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, datetime):
+        return value.isoformat(' ')
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def sqlite_value(value):
+    # The format SQLAlchemy's SQLite DateTime type stores, so string comparisons order correctly
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S.%f')
+    return value
+
+def next_ids(tables):
+    """First free id of each table."""
+    return {
+        table: (db.session.execute(select(func.max(table.c.id))).scalar() or 0) + 1
+        for table in tables
+    }
+
+def item_types_for(count):
+    """Item type of each of ``count`` items of a course, following ITEM_MIX."""
+    weight = sum(ITEM_MIX.values())
+    counts = {item_type: count * share // weight for item_type, share in ITEM_MIX.items()}
+    counts['labs'] += count - sum(counts.values())
+    return [item_type for item_type in ITEM_MIX for _ in range(counts[item_type])]
+
+def post_text(rng):
+    words = rng.choices(WORDS, k=rng.randint(6, 30)) + rng.choices(TOPICS, k=rng.randint(1, 4))
+    rng.shuffle(words)
+    return ' '.join(words).capitalize() + '?' * (rng.random() < 0.3)
+
+class Generator:
+    def __init__(self, options, ids, rng):
+        self.options = options
+        self.ids = ids
+        self.rng = rng
+        self.course_ids = range(ids[Course.__table__], ids[Course.__table__] + options['courses'])
+        self.user_ids = range(ids[User.__table__], ids[User.__table__] + options['users'])
+        # course id -> [(item id, item type)], course id -> enrolled user ids
+        self.items = {}
+        self.enrolled = {}
+        self.started = datetime.utcnow() - timedelta(days=90)
+
+    def courses(self):
+        for course_id in self.course_ids:
+            topic = self.rng.choice(TOPICS).capitalize()
+            yield course_id, f'{topic} {course_id}', f'Generated course on {topic.lower()} for load testing.'
+
+    def course_items(self):
+        item_id = self.ids[CourseItem.__table__]
+        for course_id in self.course_ids:
+            items = self.items[course_id] = []
+            for n, item_type in enumerate(item_types_for(self.options['items_per_course']), 1):
+                items.append((item_id, item_type))
+                label = ITEM_TYPES[item_type].capitalize()
+                yield item_id, course_id, ITEM_TYPES[item_type], f'{label} {n}: {self.rng.choice(TOPICS)}', f'{label} {n} of course {course_id}.'
+                item_id += 1
+
+    def users(self, password_hash):
+        for user_id in self.user_ids:
+            name = f'{self.rng.choice(FIRST_NAMES)} {self.rng.choice(LAST_NAMES)}'
+            yield user_id, name, f'gen{user_id}@example.com', f'GEN-{user_id}', None, False, password_hash
+
+    def enrollments_and_completions(self):
+        """Enrollment rows; completion rows are collected per batch into ``self.pending_completions``."""
+        density = self.options['enrollment_density']
+        ratio = self.options['completion_ratio']
+        enrollment_id = self.ids[Enrollment.__table__]
+        totals = {
+            course_id: {t: sum(1 for _, item_type in items if item_type == t) for t in ITEM_TYPES}
+            for course_id, items in self.items.items()
+        }
+        self.pending_completions = []
+        for user_id in self.user_ids:
+            for course_id in self.course_ids:
+                if self.rng.random() >= density:
+                    continue
+                self.enrolled.setdefault(course_id, []).append(user_id)
+                items = self.items[course_id]
+                done = self.completed_count(len(items), ratio)
+                completed = dict.fromkeys(ITEM_TYPES, 0)
+                for item_id, item_type in self.rng.sample(items, done):
+                    completed[item_type] += 1
+                    self.pending_completions.append((user_id, item_id))
+                total = len(items)
+                progress = sum(completed.values()) * 100 // total if total else 0
+                counters = []
+                for item_type in ITEM_TYPES:
+                    counters += [completed[item_type], totals[course_id][item_type]]
+                enrolled_at = self.started + timedelta(seconds=self.rng.randrange(90 * 86400))
+                yield (enrollment_id, user_id, course_id, progress, enrolled_at, *counters)
+                enrollment_id += 1
+
+    def completed_count(self, total, ratio):
+        # Beta-distributed so students range from barely started to finished
+        if ratio <= 0 or total == 0:
+            return 0
+        if ratio >= 1:
+            return total
+        return round(total * self.rng.betavariate(2 * ratio, 2 * (1 - ratio)))
+
+    def thread(self, authors, first_id):
+        """(id, user id, content, timestamp) of the posts of one thread, oldest first."""
+        count = self.options['posts_per_thread']
+        at = self.started
+        for n in range(count):
+            at += timedelta(seconds=self.rng.randrange(1, 90 * 86400 // max(count, 1)))
+            yield first_id + n, self.rng.choice(authors), post_text(self.rng), at
+
+    def authors(self, course_id):
+        # Posts come from the course's students, or anyone if it has none
+        return self.enrolled.get(course_id) or self.user_ids
+
+    def discussions(self):
+        post_id = self.ids[Discussion.__table__]
+        for course_id in self.course_ids:
+            if not self.authors(course_id):
+                continue
+            for post in self.thread(self.authors(course_id), post_id):
+                yield post[0], post[2], post[1], course_id, post[3]
+            post_id += self.options['posts_per_thread']
+
+    def item_discussions(self):
+        post_id = self.ids[ItemDiscussion.__table__]
+        for course_id in self.course_ids:
+            authors = self.authors(course_id)
+            if not authors:
+                continue
+            for item_id, _ in self.items[course_id]:
+                for post in self.thread(authors, post_id):
+                    yield post[0], item_id, post[1], post[2], post[3]
+                post_id += self.options['posts_per_thread']
+
+def generate_data(courses, items_per_course, users, enrollment_density, completion_ratio,
+                  posts_per_thread, seed=1, password='password', batch_size=None, log=None):
+    """Seed the demo content and append a generated dataset in one transaction.
+
+    Returns ``{table name: rows added}``. Commits.
+    """
+    log = log or (lambda message: None)
+    options = dict(
+        courses=courses, items_per_course=items_per_course, users=users, enrollment_density=enrollment_density,
+        completion_ratio=completion_ratio, posts_per_thread=posts_per_thread,
+    )
+    counts = {'demo': seed_demo_content()}
+    tables = [model.__table__ for model in (Course, CourseItem, User, Enrollment, ItemCompletion, Discussion, ItemDiscussion)]
+    generator = Generator(options, next_ids(tables), random.Random(seed))
+    loader = BulkLoader(db.session.connection(), batch_size or current_app.config['DATA_GENERATOR_BATCH_SIZE'])
+    counter_columns = []
+    for item_type in ITEM_TYPES:
+        counter_columns += [completed_column(item_type).key, total_column(item_type).key]
+    completion_id = generator.ids[ItemCompletion.__table__]
+
+    def completions():
+        nonlocal completion_id
+        for user_id, item_id in generator.pending_completions:
+            yield completion_id, user_id, item_id, True
+            completion_id += 1
+        generator.pending_completions.clear()
+
+    def enrollments_with_completions():
+        # Flush completions as they pile up so memory stays bounded by the batch size
+        for row in generator.enrollments_and_completions():
+            yield row
+            if len(generator.pending_completions) >= loader.batch_size:
+                counts['item_completion'] = counts.get('item_completion', 0) + loader.load(
+                    ItemCompletion.__table__, ('id', 'user_id', 'item_id', 'is_complete'), completions()
+                )
+
+    steps = (
+        (Course.__table__, ('id', 'title', 'description'), generator.courses),
+        (CourseItem.__table__, ('id', 'course_id', 'item_type', 'title', 'description'), generator.course_items),
+        (User.__table__, ('id', 'name', 'email', 'student_id', 'track', 'is_instructor', 'password_hash'),
+         lambda: generator.users(password_hasher.hash(password))),
+        (Enrollment.__table__, ('id', 'user_id', 'course_id', 'progress', 'date_enrolled', *counter_columns),
+         enrollments_with_completions),
+        (ItemCompletion.__table__, ('id', 'user_id', 'item_id', 'is_complete'), completions),
+        (Discussion.__table__, ('id', 'content', 'user_id', 'course_id', 'timestamp'), generator.discussions),
+        (ItemDiscussion.__table__, ('id', 'item_id', 'user_id', 'content', 'timestamp'), generator.item_discussions),
+    )
+    for table, columns, rows in steps:
+        started = time.perf_counter()
+        counts[table.name] = counts.get(table.name, 0) + loader.load(table, columns, rows())
+        log(f'{table.name}: {counts[table.name]} rows in {time.perf_counter() - started:.1f}s')
+    loader.reset_sequences(tables)
+    scopes = {CATALOG, *(course_scope(course_id) for course_id in generator.course_ids)}
+    bump_versions(db.session.connection(), scopes)
+    # Cached copies of these scopes are dropped on commit (see catalog.py)
+    db.session.info.setdefault('changed_scopes', set()).update(scopes)
+    db.session.commit()
+    return counts
+
+@click.command('generate-data')
+@click.option('--courses', default=20, show_default=True, help='Generated courses.')
+@click.option('--items-per-course', default=18, show_default=True, help='Labs, quizzes and exams per course, in a 5:3:1 mix.')
+@click.option('--users', default=1000, show_default=True, help='Generated users.')
+@click.option('--enrollment-density', default=0.2, show_default=True, help='Chance that a user is enrolled in a course.')
+@click.option('--completion-ratio', default=0.4, show_default=True, help='Mean share of items each enrolled user has completed.')
+@click.option('--posts-per-thread', default=10, show_default=True, help='Posts in each course and item discussion thread.')
+@click.option('--seed', default=1, show_default=True, help='Random seed.')
+@click.option('--password', default='password', show_default=True, help='Password of every generated user.')
+@click.option('--batch-size', type=int, help='Rows per insert batch (default DATA_GENERATOR_BATCH_SIZE).')
+@with_appcontext
+def generate_data_command(**options):
+    """Seed the demo content and add a synthetic dataset for load testing."""
+    started = time.perf_counter()
+    counts = generate_data(log=click.echo, **options)
+    click.echo(f'Generated {sum(counts.values())} rows ({counts["demo"]} demo rows) in {time.perf_counter() - started:.1f}s')
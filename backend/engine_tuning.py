@@ -0,0 +1,142 @@
+"""Per-dialect engine settings for the primary database and its replicas.
+
+``init_app`` runs before ``db.init_app`` and fills in the engine options of
+every bind. Options set explicitly in SQLALCHEMY_ENGINE_OPTIONS or in a bind
+are kept.
+
+- SQLite: each new connection gets the WAL journal (SQLITE_JOURNAL_MODE),
+  so readers do not block the writer. It also gets SQLITE_BUSY_TIMEOUT, so
+  writers wait for the lock instead of failing with "database is locked",
+  plus synchronous=SQLITE_SYNCHRONOUS, SQLITE_MMAP_SIZE bytes of mmap I/O and
+  a SQLITE_CACHE_SIZE KiB page cache. These are set by ``install`` after
+  ``db.init_app``.
+- Postgres: each worker gets an equal share of DATABASE_MAX_CONNECTIONS,
+  split across WEB_CONCURRENCY workers. Its pool keeps WORKER_CONCURRENCY
+  connections open, or DATABASE_POOL_SIZE if set. The rest of the share is
+  overflow. Connections are pinged before use, replaced after
+  DATABASE_POOL_RECYCLE seconds, and run with statement_timeout =
+  DATABASE_STATEMENT_TIMEOUT seconds (0 disables it, e.g. for migrations).
+
+gunicorn logs the settings each engine actually gets when a worker starts
+(``post_worker_init`` in gunicorn.conf.py); ``flask db-settings`` prints them.
+"""
+import click
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+SQLITE_PRAGMAS = ('journal_mode', 'busy_timeout', 'synchronous', 'mmap_size', 'cache_size')
+
+def in_memory(url):
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+def postgres_options(config):
+    """Pool and connection options for one worker's Postgres engine."""
+    share = max(1, config['DATABASE_MAX_CONNECTIONS'] // max(1, config['WEB_CONCURRENCY']))
+    pool_size = min(config['DATABASE_POOL_SIZE'] or config['WORKER_CONCURRENCY'], share)
+    options = {
+        'pool_size': pool_size,
+        'max_overflow': share - pool_size,
+        'pool_pre_ping': True,
+        'pool_recycle': config['DATABASE_POOL_RECYCLE'],
+    }
+    timeout_ms = int(config['DATABASE_STATEMENT_TIMEOUT'] * 1000)
+    if timeout_ms > 0:
+        options['connect_args'] = {'options': f'-c statement_timeout={timeout_ms}'}
+    return options
+
+def sqlite_pragmas(config, url):
+    pragmas = {
+        'busy_timeout': int(config['SQLITE_BUSY_TIMEOUT'] * 1000),
+        'synchronous': config['SQLITE_SYNCHRONOUS'],
+        'cache_size': -config['SQLITE_CACHE_SIZE'],
+    }
+    # WAL and mmap need a database file
+    if not in_memory(url):
+        pragmas = dict(journal_mode=config['SQLITE_JOURNAL_MODE'], mmap_size=config['SQLITE_MMAP_SIZE'], **pragmas)
+    return pragmas
+
+def settings_report(dbapi_connection, dialect_name):
+    """Effective settings of an open DBAPI connection, as ``name=value`` strings."""
+    cursor = dbapi_connection.cursor()
+    try:
+        if dialect_name == 'sqlite':
+            queries = [(name, f'PRAGMA {name}') for name in SQLITE_PRAGMAS]
+        elif dialect_name == 'postgresql':
+            queries = [(name, f'SHOW {name}') for name in ('statement_timeout', 'max_connections')]
+        else:
+            return []
+        report = []
+        for name, query in queries:
+            cursor.execute(query)
+            report.append(f'{name}={cursor.fetchone()[0]}')
+        return report
+    finally:
+        cursor.close()
+
+class EngineTuning:
+    def __init__(self):
+        # bind key (None for the primary) -> SQLite pragmas
+        self.pragmas = {}
+        self.engines = {}
+
+    def init_app(self, app):
+        """Fill in the engine options of every bind; call before ``db.init_app``."""
+        config = app.config
+        binds = config.setdefault('SQLALCHEMY_BINDS', {})
+        targets = [(None, config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {}), config['SQLALCHEMY_DATABASE_URI'])]
+        for key, value in binds.items():
+            if not isinstance(value, dict):
+                value = binds[key] = {'url': value}
+            targets.append((key, value, value['url']))
+        self.pragmas = {}
+        for key, options, url in targets:
+            url = make_url(url)
+            if url.get_backend_name() == 'postgresql':
+                for name, value in postgres_options(config).items():
+                    options.setdefault(name, value)
+            elif url.get_backend_name() == 'sqlite':
+                self.pragmas[key] = sqlite_pragmas(config, url)
+        app.extensions['engine_tuning'] = self
+
+    def install(self, engines):
+        """Apply the SQLite pragmas to new connections."""
+        self.engines = dict(engines)
+        for key, engine in engines.items():
+            pragmas = self.pragmas.get(key)
+            if pragmas:
+                def apply_pragmas(dbapi_connection, record, pragmas=pragmas):
+                    cursor = dbapi_connection.cursor()
+                    try:
+                        for name, value in pragmas.items():
+                            cursor.execute(f'PRAGMA {name}={value}')
+                    finally:
+                        cursor.close()
+
+                event.listen(engine, 'connect', apply_pragmas)
+
+    def log_settings(self, log):
+        """Log every installed engine's effective settings to ``log``, e.g. gunicorn's error log."""
+        try:
+            for line in settings_lines(self.engines):
+                log.info('Database %s', line)
+        except Exception:
+            log.warning('Could not read the database settings', exc_info=True)
+
+def describe(engine, dbapi_connection):
+    return ', '.join(settings_report(dbapi_connection, engine.dialect.name) + [engine.pool.status()])
+
+def settings_lines(engines):
+    """``<bind> (<url>): <settings>`` for each engine, read from a pooled connection."""
+    for key, engine in sorted(engines.items(), key=lambda item: item[0] or ''):
+        with engine.connect() as connection:
+            report = describe(engine, connection.connection.dbapi_connection)
+        yield f'{key or "primary"} ({engine.url.render_as_string()}): {report}'
+
+engine_tuning = EngineTuning()
+
+@click.command('db-settings')
+def db_settings_command():
+    """Print the effective settings of the primary database and each replica."""
+    from models import db
+    for line in settings_lines(db.engines):
+        click.echo(line)
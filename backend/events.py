@@ -0,0 +1,373 @@
+"""Live discussion events for Server-Sent Events streams.
+
+Routes publish ``created``/``updated``/``deleted`` events for a discussion
+thread after committing; stream endpoints subscribe to one thread. Which
+processes see an event depends on DISCUSSION_EVENTS_URL:
+
+- ``memory://`` (default): only the publishing worker's subscribers.
+- ``file://[/path]``: a shared append-only log (under /dev/shm by default)
+  tailed by every worker on the host.
+- ``postgresql://...``: Postgres LISTEN/NOTIFY, for workers on several hosts.
+
+Each worker keeps the last SSE_HISTORY events of every thread it has seen so a
+reconnecting client can resume from its Last-Event-ID. Event ids are
+microsecond timestamps, made strictly increasing per publisher. When a client's
+last id is older than what a worker can vouch for (the worker started later,
+or the history was trimmed) the stream starts with a ``reset`` event telling
+the client to refetch the thread.
+
+A stream holds its request for up to SSE_STREAM_TIMEOUT seconds, so the
+stream routes exist only in cooperative (gevent) workers, where that costs a
+greenlet rather than a whole worker. EventSource cannot send headers, so
+clients authenticate with a stream token from ``stream_token``. Such a token
+is valid for SSE_TOKEN_TTL seconds, only for one user and one thread. The
+token sits in the URL, so it should never be the user's access token.
+"""
+import hashlib
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+logger = logging.getLogger(__name__)
+
+Event = namedtuple('Event', 'id thread type data')
+
+class TooManySubscribers(Exception):
+    pass
+
+def thread_key(item_type, item_id):
+    return f'{item_type}:{item_id}'
+
+class Subscription:
+    def __init__(self, thread, backlog, max_queue):
+        self.thread = thread
+        self.backlog = backlog
+        self.queue = queue.Queue(max_queue)
+        self.overflowed = False
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # A stalled client; end its stream and let it resume from history
+            self.overflowed = True
+
+class Broker:
+    """In-process broker; subclasses carry events between workers."""
+
+    def __init__(self, history=200, max_subscribers=100, max_threads=1024):
+        self.history_size = history
+        self.max_subscribers = max_subscribers
+        self.max_threads = max_threads
+        self.started = self._now()
+        self._last_id = 0
+        self._horizon = self.started
+        self._history = OrderedDict()
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _now():
+        return time.time_ns() // 1000
+
+    def next_id(self):
+        with self._lock:
+            self._last_id = max(self._now(), self._last_id + 1)
+            return self._last_id
+
+    def publish(self, thread, event_type, data):
+        self._deliver(Event(self.next_id(), thread, event_type, data))
+
+    def _deliver(self, event):
+        with self._lock:
+            entry = self._history.get(event.thread)
+            if entry is None:
+                entry = self._history[event.thread] = {'floor': self._horizon, 'events': deque()}
+                while len(self._history) > self.max_threads:
+                    _, evicted = self._history.popitem(last=False)
+                    if evicted['events']:
+                        self._horizon = max(self._horizon, evicted['events'][-1].id)
+            self._history.move_to_end(event.thread)
+            events = entry['events']
+            events.append(event)
+            if len(events) > self.history_size:
+                entry['floor'] = events.popleft().id
+            subscribers = list(self._subscribers.get(event.thread, ()))
+        for subscription in subscribers:
+            subscription.put(event)
+
+    def subscribe(self, thread, last_event_id=None, max_queue=100):
+        """Subscribe to a thread. ``backlog`` holds the events to replay first;
+        None means the client has to refetch the thread.
+        """
+        self.start()
+        with self._lock:
+            if sum(len(s) for s in self._subscribers.values()) >= self.max_subscribers:
+                raise TooManySubscribers()
+            entry = self._history.get(thread)
+            backlog = []
+            if last_event_id is not None:
+                floor = entry['floor'] if entry else self._horizon
+                if last_event_id < floor:
+                    backlog = None
+                elif entry:
+                    backlog = [e for e in entry['events'] if e.id > last_event_id]
+            subscription = Subscription(thread, backlog, max_queue)
+            self._subscribers.setdefault(thread, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.thread)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.thread]
+
+    def start(self):
+        """Start carrying events from other workers (no-op in process)."""
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(s) for s in self._subscribers.values())
+
+def encode(event):
+    return json.dumps({'id': event.id, 'thread': event.thread, 'type': event.type, 'data': event.data})
+
+def decode(raw):
+    fields = json.loads(raw)
+    return Event(fields['id'], fields['thread'], fields['type'], fields['data'])
+
+class ListeningBroker(Broker):
+    """Broker whose events arrive through a listener thread in each worker."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._listener_pid = None
+
+    def publish(self, thread, event_type, data):
+        self.start()
+        self._send(Event(self.next_id(), thread, event_type, data))
+
+    def start(self):
+        # One listener per process; gunicorn forks workers after the app is loaded
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+            self.started = self._horizon = self._last_id = self._now()
+            self._history.clear()
+            self._subscribers.clear()
+        threading.Thread(target=self._listen_forever, name='discussion-events', daemon=True).start()
+
+    def _listen_forever(self):
+        while True:
+            try:
+                self._listen()
+            except Exception:
+                logger.warning('Discussion event listener failed; restarting', exc_info=True)
+                time.sleep(1)
+
+    def _listening(self):
+        # Called once the listener receives events. Anything published before
+        # may have been missed, so resuming from an earlier id must refetch.
+        with self._lock:
+            self._horizon = self._last_id = max(self._now(), self._last_id)
+            self._history.clear()
+
+class FileBroker(ListeningBroker):
+    """Events appended to a shared log file that every worker tails."""
+
+    def __init__(self, directory, max_bytes=1 << 20, poll_interval=0.1, **kwargs):
+        super().__init__(**kwargs)
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, 'discussions.log')
+        self.max_bytes = max_bytes
+        self.poll_interval = poll_interval
+
+    def _send(self, event):
+        import fcntl
+        line = (encode(event) + '\n').encode()
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                    # Readers still hold the old file open and drain it before reopening
+                    os.replace(self.path, self.path + '.1')
+                with open(self.path, 'ab') as f:
+                    f.write(line)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _listen(self):
+        open(self.path, 'ab').close()
+        f = open(self.path, 'rb')
+        f.seek(0, os.SEEK_END)
+        self._listening()
+        pending = b''
+        try:
+            while True:
+                chunk = f.readline()
+                if chunk:
+                    pending += chunk
+                    if pending.endswith(b'\n'):
+                        self._deliver(decode(pending))
+                        pending = b''
+                    continue
+                time.sleep(self.poll_interval)
+                try:
+                    rotated = os.stat(self.path).st_ino != os.fstat(f.fileno()).st_ino
+                except FileNotFoundError:
+                    rotated = False
+                if rotated and f.tell() == os.fstat(f.fileno()).st_size:
+                    f.close()
+                    f = open(self.path, 'rb')
+        finally:
+            f.close()
+
+class PostgresBroker(ListeningBroker):
+    """Events sent with NOTIFY and received with LISTEN on a dedicated connection."""
+
+    CHANNEL = 'studyhub_discussion_events'
+    # NOTIFY payloads are limited to 8000 bytes
+    MAX_PAYLOAD = 7900
+
+    def __init__(self, url, **kwargs):
+        super().__init__(**kwargs)
+        scheme, rest = url.split('://', 1)
+        self.dsn = scheme.split('+', 1)[0] + '://' + rest
+        self._connection = None
+        self._send_lock = threading.Lock()
+
+    def _connect(self):
+        import psycopg2
+        connection = psycopg2.connect(self.dsn)
+        connection.autocommit = True
+        return connection
+
+    def _send(self, event):
+        payload = encode(event)
+        if len(payload.encode()) > self.MAX_PAYLOAD:
+            # Too large to carry; subscribers refetch the post instead
+            payload = encode(event._replace(data={'id': event.data.get('id'), 'truncated': True}))
+        with self._send_lock:
+            for attempt in (1, 2):
+                try:
+                    if self._connection is None or self._connection.closed:
+                        self._connection = self._connect()
+                    with self._connection.cursor() as cursor:
+                        cursor.execute('SELECT pg_notify(%s, %s)', (self.CHANNEL, payload))
+                    return
+                except Exception:
+                    self._connection = None
+                    if attempt == 2:
+                        raise
+
+    def _listen(self):
+        import select
+        connection = self._connect()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f'LISTEN {self.CHANNEL}')
+            self._listening()
+            while True:
+                if select.select([connection], [], [], 5) == ([], [], []):
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    self._deliver(decode(connection.notifies.pop(0).payload))
+        finally:
+            connection.close()
+
+def default_events_directory():
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, 'studyhub-events')
+
+def create_broker(url, namespace, **kwargs):
+    """Build a broker from DISCUSSION_EVENTS_URL: ``memory://``, ``file://[/path]`` or a Postgres URL.
+
+    ``namespace`` keeps apps pointed at different databases from sharing a log.
+    """
+    if not url or url.startswith('memory://'):
+        return Broker(**kwargs)
+    if url.startswith('file://'):
+        return FileBroker(os.path.join(url[len('file://'):] or default_events_directory(), namespace), **kwargs)
+    if url.startswith(('postgres://', 'postgresql://', 'postgresql+')):
+        return PostgresBroker(url, **kwargs)
+    raise ValueError(f'Unsupported DISCUSSION_EVENTS_URL: {url}')
+
+class DiscussionEvents:
+    def __init__(self):
+        self.broker = Broker()
+        self.heartbeat = 15
+        self.stream_timeout = 300
+        self.token_ttl = 60
+        self.max_queue = 100
+
+    def init_app(self, app):
+        namespace = hashlib.sha1(app.config['SQLALCHEMY_DATABASE_URI'].encode()).hexdigest()[:12]
+        self.broker = create_broker(
+            app.config['DISCUSSION_EVENTS_URL'], namespace,
+            history=app.config['SSE_HISTORY'], max_subscribers=app.config['SSE_MAX_SUBSCRIBERS'],
+        )
+        self.heartbeat = app.config['SSE_HEARTBEAT']
+        self.stream_timeout = app.config['SSE_STREAM_TIMEOUT']
+        self.token_ttl = app.config['SSE_TOKEN_TTL']
+        app.extensions['discussion_events'] = self
+
+    def _serializer(self):
+        return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt='discussion-stream')
+
+    def stream_token(self, user_id, thread):
+        """Token letting ``user_id`` open the stream of ``thread`` for the next SSE_TOKEN_TTL seconds."""
+        return self._serializer().dumps([user_id, thread])
+
+    def stream_user(self, token, thread):
+        """The user a stream token was issued to, or None if it is invalid, expired or for another thread."""
+        try:
+            user_id, token_thread = self._serializer().loads(token, max_age=self.token_ttl)
+        except (BadSignature, ValueError, TypeError):
+            return None
+        return user_id if token_thread == thread else None
+
+    def publish(self, thread, event_type, data):
+        # Live updates are best effort; the write they describe has already committed
+        try:
+            self.broker.publish(thread, event_type, data)
+        except Exception:
+            logger.warning('Could not publish %s event for %s', event_type, thread, exc_info=True)
+
+    def subscribe(self, thread, last_event_id=None):
+        return self.broker.subscribe(thread, last_event_id, self.max_queue)
+
+    def stream(self, subscription):
+        """SSE response body for a subscription; unsubscribes when it ends."""
+        def format_event(event):
+            return f'id: {event.id}\nevent: {event.type}\ndata: {json.dumps(event.data)}\n\n'
+
+        try:
+            yield 'retry: 3000\n\n'
+            if subscription.backlog is None:
+                yield 'event: reset\ndata: {}\n\n'
+            else:
+                for event in subscription.backlog:
+                    yield format_event(event)
+            deadline = time.monotonic() + self.stream_timeout
+            while time.monotonic() < deadline and not subscription.overflowed:
+                try:
+                    event = subscription.queue.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    yield ': heartbeat\n\n'
+                    continue
+                yield format_event(event)
+        finally:
+            self.broker.unsubscribe(subscription)
+
+discussion_events = DiscussionEvents()
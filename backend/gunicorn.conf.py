@@ -0,0 +1,22 @@
+"""gunicorn settings, read from the working directory by ``gunicorn wsgi:app``.
+
+Workers are sync by default: one request at a time each. With
+GUNICORN_WORKER_CLASS=gevent every worker serves up to WORKER_CONCURRENCY
+(default 200) requests on greenlets, and engine_tuning.py sizes the
+database pool from the same setting. See cooperative.py. WEB_CONCURRENCY
+sets the number of workers either way. Each worker logs the settings its
+database engines got (engine_tuning.py) once it has loaded the app.
+"""
+import os
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+
+if worker_class == 'gevent':
+    # Exported, so the app reads the same value when the worker imports it
+    worker_connections = int(os.environ.setdefault('WORKER_CONCURRENCY', '200'))
+    # Monkey-patching happens in each worker, before it imports the app
+    preload_app = False
+
+def post_worker_init(worker):
+    from engine_tuning import engine_tuning
+    engine_tuning.log_settings(worker.log)
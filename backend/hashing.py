@@ -0,0 +1,176 @@
+"""Password hashing off the request workers.
+
+Hashing is deliberately slow, so signup and login hand it to a small process
+pool instead of running it on the gunicorn worker that serves the request. The
+number of hashes queued or running in one worker is capped: past
+PASSWORD_HASH_QUEUE_LIMIT new requests fail fast with HashingOverloaded (the
+routes answer 503) rather than piling up behind each other.
+
+PASSWORD_HASH_METHOD is any werkzeug method string, e.g. ``scrypt:32768:8:1``
+or ``pbkdf2:sha256:1000000``; cost parameters left out take werkzeug's
+defaults. Stored hashes made with other parameters are upgraded the next time
+the user logs in.
+
+Set PASSWORD_HASH_WORKERS to 0 to hash inline (development and scripts).
+Cooperative (gevent) workers hash on native threads instead, so a hash never
+stalls the worker's other requests. Either way a hash that takes longer than
+PASSWORD_HASH_TIMEOUT fails the request with HashingOverloaded, and keeps its
+place in the queue limit until it really ends.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import generate_password_hash, check_password_hash
+from cooperative import cooperative
+
+class HashingOverloaded(Exception):
+    """Too many hashes are queued in this worker, or one did not finish in time."""
+
+def _timed(operation, *args):
+    # Runs in the pool process; wall-clock times let the caller split queue wait from hashing
+    started = time.time()
+    result = operation(*args)
+    return result, started, time.time()
+
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+class Timing:
+    """Count, total and maximum of a duration, in seconds."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self):
+        return {'count': self.count, 'total': round(self.total, 6), 'max': round(self.max, 6)}
+
+class PasswordHasher:
+    def __init__(self):
+        self.method = 'scrypt:32768:8:1'
+        self.workers = 0
+        self.queue_limit = 32
+        self.timeout = 10
+        self._executor = None
+        self._executor_pid = None
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self.counters = dict.fromkeys(('hashed', 'verified', 'rehashed', 'rejected', 'timeouts', 'pool_restarts'), 0)
+        self.hash_latency = Timing()
+        self.queue_wait = Timing()
+
+    def init_app(self, app):
+        # Werkzeug fills in the defaults of a method given without its cost
+        # ("scrypt" hashes as "scrypt:32768:8:1"); compare with what it writes
+        self.method = generate_password_hash('', app.config['PASSWORD_HASH_METHOD']).split('$', 1)[0]
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self.queue_limit = app.config['PASSWORD_HASH_QUEUE_LIMIT']
+        self.timeout = app.config['PASSWORD_HASH_TIMEOUT']
+        app.extensions['password_hasher'] = self
+
+    def _pool(self):
+        # Created on first use in each process, so gunicorn workers forked from
+        # a preloaded app do not share the master's pool. The worker already
+        # runs threads, whose locks a fork could copy mid-use, so pool processes
+        # start from a fork server or a fresh interpreter.
+        if self._executor is None or self._executor_pid != os.getpid():
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context(method))
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def _discard_pool(self):
+        # A pool whose process died (OOM kill, crash) fails every later call;
+        # the next _pool() starts a fresh one
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self.counters['pool_restarts'] += 1
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def _submit(self, operation, args):
+        if cooperative.enabled:
+            return cooperative.submit(_timed, operation, *args)
+        if self.workers:
+            return self._pool().submit(_timed, operation, *args)
+        future = Future()
+        try:
+            future.set_result(_timed(operation, *args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def _release(self, future=None):
+        with self._lock:
+            self._in_flight -= 1
+
+    def _run(self, operation, *args):
+        try:
+            return self._attempt(operation, args)
+        except BrokenProcessPool:
+            self._discard_pool()
+            return self._attempt(operation, args)
+
+    def _attempt(self, operation, args):
+        with self._lock:
+            if self._in_flight >= self.queue_limit:
+                self.counters['rejected'] += 1
+                raise HashingOverloaded()
+            self._in_flight += 1
+        submitted = time.time()
+        try:
+            future = self._submit(operation, args)
+        except BaseException:
+            self._release()
+            raise
+        # A hash that is already running cannot be cancelled, so its slot is
+        # only freed when it ends, even if the request gave up on it
+        future.add_done_callback(self._release)
+        try:
+            result, started, finished = future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            self.counters['timeouts'] += 1
+            raise HashingOverloaded()
+        self.queue_wait.observe(max(0.0, started - submitted))
+        self.hash_latency.observe(finished - started)
+        return result
+
+    def hash(self, password):
+        self.counters['hashed'] += 1
+        return self._run(_hash, password, self.method)
+
+    def verify(self, stored_hash, password):
+        self.counters['verified'] += 1
+        return self._run(check_password_hash, stored_hash, password)
+
+    def rehash(self, password):
+        """Hash with the current method for a stored hash that ``needs_rehash``."""
+        self.counters['rehashed'] += 1
+        return self.hash(password)
+
+    def needs_rehash(self, stored_hash):
+        """True if ``stored_hash`` was made with a different method or cost."""
+        return stored_hash.split('$', 1)[0] != self.method
+
+    def stats(self):
+        return dict(
+            self.counters,
+            in_flight=self._in_flight,
+            queue_limit=self.queue_limit,
+            workers=self.workers,
+            method=self.method.split(':', 1)[0],
+            hash_latency=self.hash_latency.as_dict(),
+            queue_wait=self.queue_wait.as_dict(),
+        )
+
+password_hasher = PasswordHasher()
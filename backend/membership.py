@@ -0,0 +1,77 @@
+"""Authorization lookups for the item discussion routes.
+
+Answers "which course is this item in" and "which courses is this user
+enrolled in" from a per-request memo on ``flask.g`` backed by short-TTL LRU
+caches shared by the requests of one worker, so a warm check issues no queries.
+
+A cached enrollment set can be stale in two directions. Enrolling invalidates
+the user's entry in the worker that served it, and a check that fails against
+the cached set is retried against the database before access is denied, so
+newly enrolled users are never turned away by another worker's copy. Removing
+an enrollment is only seen once MEMBERSHIP_CACHE_TTL expires.
+"""
+from flask import g, has_request_context
+from sqlalchemy import select
+from cache import LRUCache
+from models import db, ITEM_TYPES, CourseItem, Enrollment
+
+class MembershipCache:
+    def __init__(self):
+        self.items = LRUCache()
+        self.enrollments = LRUCache()
+        self.counters = dict.fromkeys(('hits', 'misses', 'rechecks'), 0)
+
+    def init_app(self, app):
+        max_entries = app.config['MEMBERSHIP_CACHE_MAX_ENTRIES']
+        ttl = app.config['MEMBERSHIP_CACHE_TTL']
+        self.items = LRUCache(max_entries, ttl)
+        self.enrollments = LRUCache(max_entries, ttl)
+        app.extensions['membership'] = self
+
+    def _lookup(self, cache, key, loader):
+        memo = g.setdefault('_membership', {}) if has_request_context() else {}
+        if key in memo:
+            return memo[key]
+        found, value = cache.get(key)
+        if found:
+            self.counters['hits'] += 1
+        else:
+            self.counters['misses'] += 1
+            value = loader()
+            if value is not None:
+                cache.set(key, value)
+        memo[key] = value
+        return value
+
+    def item_course_id(self, item_type, item_id):
+        """Course of a lab/quiz/exam, or None if there is no such item of that type."""
+        return self._lookup(self.items, ('item', item_type, item_id), lambda: db.session.execute(
+            select(CourseItem.course_id).where(CourseItem.id == item_id, CourseItem.item_type == ITEM_TYPES[item_type])
+        ).scalar())
+
+    def enrolled_course_ids(self, user_id):
+        return self._lookup(self.enrollments, ('user', str(user_id)), lambda: self._load_enrollments(user_id))
+
+    def _load_enrollments(self, user_id):
+        return frozenset(db.session.execute(select(Enrollment.course_id).where(Enrollment.user_id == user_id)).scalars())
+
+    def is_enrolled(self, user_id, course_id):
+        if course_id is None:
+            return False
+        if course_id in self.enrolled_course_ids(user_id):
+            return True
+        # The cached set may predate an enrollment made through another worker
+        self.counters['rechecks'] += 1
+        self.invalidate_user(user_id)
+        return course_id in self.enrolled_course_ids(user_id)
+
+    def invalidate_user(self, user_id):
+        key = ('user', str(user_id))
+        self.enrollments.delete(key)
+        if has_request_context():
+            g.get('_membership', {}).pop(key, None)
+
+    def stats(self):
+        return dict(self.counters, items=len(self.items), users=len(self.enrollments))
+
+membership = MembershipCache()
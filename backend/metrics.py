@@ -0,0 +1,424 @@
+"""Prometheus metrics for the API, served at GET /api/metrics.
+
+For every ``api_bp`` route (labelled with its Flask endpoint) this records a
+request latency histogram, the number and duration of SQL statements, the
+time spent serializing JSON and the wait for a pooled database connection.
+Pool occupancy and the cache, membership, password hashing and response
+compression counters are sampled whenever a snapshot is taken.
+
+Each gunicorn worker keeps its own numbers and writes them, at most every
+METRICS_FLUSH_INTERVAL seconds, as a JSON snapshot into a directory shared by
+the workers on the host (METRICS_DIR, under /dev/shm by default). The worker
+answering a scrape refreshes its own snapshot and adds up all of them.
+Counters and histograms of workers that have exited are kept, so totals never
+go backwards; their gauges are dropped. A worker counts as exited when its pid
+is gone or now belongs to a process started at another time. A scrape folds
+exited workers' snapshots into one ``retired.json`` and deletes them, under a
+lock, so the directory does not grow with every worker restart. Request latency runs until the
+response body has been produced, streamed bodies included.
+"""
+import atexit
+import bisect
+import contextlib
+import glob
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from flask import g, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+# name -> (type, help, histogram buckets)
+DEFINITIONS = {
+    'studyhub_http_request_duration_seconds': ('histogram', 'API request latency.', DURATION_BUCKETS),
+    'studyhub_sql_statements_total': ('counter', 'SQL statements executed by API requests.', None),
+    'studyhub_sql_duration_seconds_total': ('counter', 'Time API requests spent executing SQL statements.', None),
+    'studyhub_json_serialization_seconds_total': ('counter', 'Time API requests spent serializing JSON.', None),
+    'studyhub_db_pool_checkout_wait_seconds': ('histogram', 'Wait for a pooled database connection.', WAIT_BUCKETS),
+    'studyhub_db_pool_checked_out': ('gauge', 'Database connections checked out of the pool.', None),
+    'studyhub_db_pool_capacity': ('gauge', 'Connections the pool allows at once (size plus overflow).', None),
+    'studyhub_content_cache_events_total': ('counter', 'Content cache hits, misses and invalidations.', None),
+    'studyhub_membership_cache_events_total': ('counter', 'Membership cache hits, misses and rechecks.', None),
+    'studyhub_password_hashing_events_total': ('counter', 'Password hashing operations and rejections.', None),
+    'studyhub_read_routing_events_total': ('counter', 'Statements routed to replicas or the primary, and replica failures.', None),
+    'studyhub_event_loop_events_total': ('counter', 'Calls offloaded to threads and event loop stalls in cooperative workers.', None),
+    'studyhub_password_hash_seconds_total': ('counter', 'Time spent computing password hashes.', None),
+    'studyhub_api_compression_responses_total': ('counter', 'API responses compressed, by endpoint and encoding.', None),
+    'studyhub_api_compression_bytes_in_total': ('counter', 'Bytes of API responses before compression.', None),
+    'studyhub_api_compression_bytes_out_total': ('counter', 'Bytes of API responses after compression.', None),
+    'studyhub_api_compression_cpu_seconds_total': ('counter', 'Thread CPU time spent compressing API responses.', None),
+    'studyhub_live_workers': ('gauge', 'Live workers whose numbers are included.', None),
+}
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Default JSON provider that adds its ``dumps`` time to the request's metrics."""
+
+    def dumps(self, obj, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            current = g.get('_metrics') if has_request_context() else None
+            if current is not None:
+                current['json'] += time.perf_counter() - started
+
+def component_samples():
+    """Counters kept by the cache, membership, hashing, routing, cooperative and compression modules, as (name, labels, value)."""
+    from cache import content_cache
+    from compression import api_compression
+    from cooperative import cooperative
+    from hashing import password_hasher
+    from membership import membership
+    from routing import read_routing
+    for name, counters in (
+        ('studyhub_content_cache_events_total', content_cache.counters),
+        ('studyhub_membership_cache_events_total', membership.counters),
+        ('studyhub_password_hashing_events_total', password_hasher.counters),
+        ('studyhub_read_routing_events_total', read_routing.counters),
+        ('studyhub_event_loop_events_total', cooperative.counters),
+    ):
+        for event_name, value in counters.items():
+            yield name, {'event': event_name}, value
+    yield 'studyhub_password_hash_seconds_total', {}, password_hasher.hash_latency.total
+    for (endpoint, encoding), values in api_compression.stats().items():
+        labels = {'endpoint': endpoint, 'encoding': encoding}
+        for name, value in zip(('responses', 'bytes_in', 'bytes_out', 'cpu_seconds'), values):
+            yield f'studyhub_api_compression_{name}_total', labels, value
+
+class Registry:
+    """Counters, gauges and histograms of one process, keyed by (name, labels)."""
+
+    def __init__(self):
+        self.values = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = DEFINITIONS[name][2]
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': [0] * (len(buckets) + 1), 'sum': 0.0}
+            histogram['buckets'][bisect.bisect_left(buckets, value)] += 1
+            histogram['sum'] += value
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'values': [[name, list(labels), value] for (name, labels), value in self.values.items()],
+                'histograms': [
+                    [name, list(labels), list(h['buckets']), h['sum']] for (name, labels), h in self.histograms.items()
+                ],
+            }
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def process_start(pid):
+    """Start time of process ``pid`` in clock ticks since boot, or None where /proc is unavailable."""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # Fields after the parenthesised command name, which may contain spaces; starttime is field 22
+    return int(stat.rsplit(')', 1)[1].split()[19])
+
+def snapshot_live(snapshot):
+    """True if the worker that wrote ``snapshot`` is still running."""
+    if not pid_alive(snapshot['pid']):
+        return False
+    started = snapshot.get('process_start')
+    return started is None or process_start(snapshot['pid']) == started
+
+def merge_snapshot(total, snapshot):
+    """Add the counters and histograms of an exited worker's ``snapshot`` to ``total``."""
+    values = {(name, tuple(map(tuple, labels))): value for name, labels, value in total['values']}
+    for name, labels, value in snapshot['values']:
+        if DEFINITIONS[name][0] != 'gauge':
+            key = (name, tuple(map(tuple, labels)))
+            values[key] = values.get(key, 0) + value
+    histograms = {(name, tuple(map(tuple, labels))): [buckets, sum_] for name, labels, buckets, sum_ in total['histograms']}
+    for name, labels, buckets, sum_ in snapshot['histograms']:
+        key = (name, tuple(map(tuple, labels)))
+        merged = histograms.setdefault(key, [[0] * len(buckets), 0.0])
+        merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+        merged[1] += sum_
+    total['values'] = [[name, list(labels), value] for (name, labels), value in values.items()]
+    total['histograms'] = [[name, list(labels), buckets, sum_] for (name, labels), (buckets, sum_) in histograms.items()]
+
+def default_metrics_directory():
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, 'studyhub-metrics')
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels) + '}'
+
+def format_number(value):
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+def render(snapshots):
+    """Prometheus text exposition of the sum of ``snapshots``."""
+    values = {}
+    histograms = {}
+    for snapshot in snapshots:
+        live = snapshot.get('live', True)
+        for name, labels, value in snapshot['values']:
+            if DEFINITIONS[name][0] == 'gauge' and not live:
+                continue
+            key = (name, tuple(map(tuple, labels)))
+            values[key] = values.get(key, 0) + value
+        for name, labels, buckets, total in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            merged = histograms.setdefault(key, {'buckets': [0] * len(buckets), 'sum': 0.0})
+            merged['buckets'] = [a + b for a, b in zip(merged['buckets'], buckets)]
+            merged['sum'] += total
+    lines = []
+    for name, (kind, help_text, bounds) in DEFINITIONS.items():
+        series = sorted((labels, value) for (n, labels), value in values.items() if n == name)
+        hist = sorted((labels, h) for (n, labels), h in histograms.items() if n == name)
+        if not series and not hist:
+            continue
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in series:
+            lines.append(f'{name}{format_labels(labels)} {format_number(value)}')
+        for labels, h in hist:
+            cumulative = 0
+            for bound, count in zip(list(bounds) + ['+Inf'], h['buckets']):
+                cumulative += count
+                le = bound if bound == '+Inf' else format_number(float(bound))
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", le),))} {cumulative}')
+            lines.append(f'{name}_sum{format_labels(labels)} {format_number(h["sum"])}')
+            lines.append(f'{name}_count{format_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+class Metrics:
+    def __init__(self):
+        self.enabled = False
+        self.registry = Registry()
+        self.directory = None
+        self.flush_interval = 5
+        self._flushed = 0.0
+        self._pid = None
+        self._started = None
+        self._process_start = None
+        self._pool = None
+        self._engine_events = False
+
+    def init_app(self, app):
+        self.enabled = app.config['METRICS_ENABLED']
+        self.flush_interval = app.config['METRICS_FLUSH_INTERVAL']
+        namespace = hashlib.sha1(app.config['SQLALCHEMY_DATABASE_URI'].encode()).hexdigest()[:12]
+        self.directory = os.path.join(app.config['METRICS_DIR'] or default_metrics_directory(), namespace)
+        app.extensions['metrics'] = self
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        app.json = TimedJSONProvider(app)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        if not self._engine_events:
+            event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+            self._engine_events = True
+        atexit.register(self.flush)
+
+    def _ensure_process(self):
+        # Workers forked from one parent inherit its registry; each starts afresh
+        if self._pid != os.getpid():
+            self.registry = Registry()
+            self._pid = os.getpid()
+            self._started = time.time_ns()
+            self._process_start = process_start(self._pid)
+
+    def _before_request(self):
+        if request.blueprint != 'api':
+            return
+        self._ensure_process()
+        g._metrics = {'started': time.perf_counter(), 'statements': 0, 'sql': 0.0, 'json': 0.0, 'status': 500}
+        self._instrument_pool()
+
+    def _after_request(self, response):
+        current = g.get('_metrics')
+        if current is not None:
+            current['status'] = response.status_code
+        return response
+
+    def _teardown_request(self, exc):
+        current = g.pop('_metrics', None)
+        if current is None:
+            return
+        endpoint = request.url_rule.endpoint if request.url_rule else 'unmatched'
+        labels = {'endpoint': endpoint}
+        self.registry.observe(
+            'studyhub_http_request_duration_seconds',
+            {'endpoint': endpoint, 'method': request.method, 'status': str(current['status'])},
+            time.perf_counter() - current['started'],
+        )
+        self.registry.inc('studyhub_sql_statements_total', labels, current['statements'])
+        self.registry.inc('studyhub_sql_duration_seconds_total', labels, current['sql'])
+        self.registry.inc('studyhub_json_serialization_seconds_total', labels, current['json'])
+        if time.monotonic() - self._flushed >= self.flush_interval:
+            self.flush()
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        current = g.get('_metrics') if has_request_context() else None
+        if current is not None:
+            current['statements'] += 1
+            conn.info['metrics_started'] = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop('metrics_started', None)
+        current = g.get('_metrics') if has_request_context() else None
+        if current is not None and started is not None:
+            current['sql'] += time.perf_counter() - started
+
+    def _instrument_pool(self):
+        # Pool has no "checkout requested" event, so time Pool.connect itself. The
+        # engine's pool is replaced by dispose(), hence the check on each request.
+        from models import db
+        pool = db.engine.pool
+        self._pool = pool
+        if 'connect' in vars(pool):
+            return
+        connect = pool.connect
+
+        def timed_connect():
+            started = time.perf_counter()
+            try:
+                return connect()
+            finally:
+                self.registry.observe('studyhub_db_pool_checkout_wait_seconds', {}, time.perf_counter() - started)
+
+        pool.connect = timed_connect
+
+    def _sample(self):
+        samples = [('studyhub_live_workers', {}, 1)]
+        pool = self._pool
+        # QueuePool reports its occupancy; the SQLite in-memory pools do not
+        if pool is not None and hasattr(pool, 'checkedout'):
+            samples.append(('studyhub_db_pool_checked_out', {}, pool.checkedout()))
+            samples.append(('studyhub_db_pool_capacity', {}, pool.size() + max(getattr(pool, '_max_overflow', 0), 0)))
+        samples.extend(component_samples())
+        return samples
+
+    def snapshot(self):
+        """This worker's numbers, including the sampled ones."""
+        snapshot = self.registry.snapshot()
+        for name, labels, value in self._sample():
+            snapshot['values'].append([name, sorted(labels.items()), value])
+        snapshot['pid'] = os.getpid()
+        snapshot['process_start'] = self._process_start
+        return snapshot
+
+    def flush(self):
+        """Write this worker's snapshot for the other workers to aggregate."""
+        if not self.enabled:
+            return
+        self._ensure_process()
+        # Named by start time too, so a reused pid does not overwrite an old worker's totals
+        path = os.path.join(self.directory, f'{self._pid}-{self._started}.json')
+        self._flushed = time.monotonic()
+        try:
+            self._write(path, self.snapshot())
+        except OSError:
+            logger.warning('Could not write metrics snapshot', exc_info=True)
+
+    @contextlib.contextmanager
+    def _directory_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _write(self, path, snapshot):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp, path)
+
+    def collect(self):
+        """Snapshots of every worker on the host, this one's fresh."""
+        self.flush()
+        retired_path = os.path.join(self.directory, 'retired.json')
+        with self._directory_lock():
+            try:
+                with open(retired_path) as f:
+                    retired = json.load(f)
+            except (OSError, ValueError):
+                retired = {'values': [], 'histograms': [], 'merged': []}
+            snapshots = []
+            exited = []
+            for path in glob.glob(os.path.join(self.directory, '*-*.json')):
+                try:
+                    with open(path) as f:
+                        snapshot = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                name = os.path.basename(path)
+                if name in retired['merged']:
+                    # Merged by a scrape that stopped before deleting it
+                    exited.append(path)
+                elif snapshot_live(snapshot):
+                    snapshot['live'] = True
+                    snapshots.append(snapshot)
+                else:
+                    merge_snapshot(retired, snapshot)
+                    retired['merged'].append(name)
+                    exited.append(path)
+            if exited:
+                try:
+                    # Written before the snapshots are deleted, so a crash in between merges nothing twice
+                    self._write(retired_path, retired)
+                    for path in exited:
+                        os.remove(path)
+                    retired['merged'] = []
+                    self._write(retired_path, retired)
+                except OSError:
+                    logger.warning('Could not retire metrics snapshots', exc_info=True)
+        retired['live'] = False
+        snapshots.append(retired)
+        return snapshots
+
+    def render(self):
+        return render(self.collect())
+
+metrics = Metrics()
@@ -0,0 +1,37 @@
+"""Add (thread, timestamp DESC, id DESC) indexes for discussion pagination
+
+Revision ID: 5b7e9f13c2d8
+Revises: d41a6c0b7e52
+Create Date: 2026-10-18 12:40:15.227931
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b7e9f13c2d8'
+down_revision = 'd41a6c0b7e52'
+branch_labels = None
+depends_on = None
+
+THREADS = (
+    ('discussion', 'course_id'),
+    ('lab_discussion', 'lab_id'),
+    ('quiz_discussion', 'quiz_id'),
+    ('exam_discussion', 'exam_id'),
+)
+
+
+def upgrade():
+    for table, thread_column in THREADS:
+        op.create_index(
+            f'ix_{table}_{thread_column}_timestamp_id',
+            table,
+            [thread_column, sa.text('timestamp DESC'), sa.text('id DESC')],
+        )
+
+
+def downgrade():
+    for table, thread_column in reversed(THREADS):
+        op.drop_index(f'ix_{table}_{thread_column}_timestamp_id', table_name=table)
@@ -0,0 +1,203 @@
+"""Merge labs, quizzes and exams into course_item with shared completion and discussion tables
+
+Revision ID: 7c1f4e2a9b36
+Revises: e2b8d5a17f60
+Create Date: 2026-10-18 16:37:44.502198
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c1f4e2a9b36'
+down_revision = 'e2b8d5a17f60'
+branch_labels = None
+depends_on = None
+
+# (item_type, old item table, old completion table, old discussion table, old item column)
+ITEM_TABLES = (
+    ('lab', 'lab', 'lab_completion', 'lab_discussion', 'lab_id'),
+    ('quiz', 'quiz', 'quiz_completion', 'quiz_discussion', 'quiz_id'),
+    ('exam', 'exam', 'exam_completion', 'exam_discussion', 'exam_id'),
+)
+
+
+def create_item_tables():
+    op.create_table('course_item',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('course_id', sa.Integer(), nullable=True),
+    sa.Column('item_type', sa.String(length=10), nullable=False),
+    sa.Column('title', sa.String(length=200), nullable=False),
+    sa.Column('description', sa.Text(), nullable=True),
+    sa.ForeignKeyConstraint(['course_id'], ['course.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_course_item_course_id_item_type', 'course_item', ['course_id', 'item_type'])
+    op.create_table('item_completion',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('item_id', sa.Integer(), nullable=True),
+    sa.Column('is_complete', sa.Boolean(), nullable=True),
+    sa.ForeignKeyConstraint(['item_id'], ['course_item.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'item_id', name='uq_item_completion_user_id_item_id')
+    )
+    op.create_index('ix_item_completion_item_id', 'item_completion', ['item_id'])
+    op.create_table('item_discussion',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('item_id', sa.Integer(), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('content', sa.Text(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['item_id'], ['course_item.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(
+        'ix_item_discussion_item_id_timestamp_id',
+        'item_discussion',
+        ['item_id', sa.text('timestamp DESC'), sa.text('id DESC')],
+    )
+
+
+def create_old_tables(item_table, completion_table, discussion_table, item_column):
+    op.create_table(item_table,
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('course_id', sa.Integer(), nullable=True),
+    sa.Column('title', sa.String(length=200), nullable=False),
+    sa.Column('description', sa.Text(), nullable=True),
+    sa.ForeignKeyConstraint(['course_id'], ['course.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(f'ix_{item_table}_course_id', item_table, ['course_id'])
+    op.create_table(completion_table,
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column(item_column, sa.Integer(), nullable=True),
+    sa.Column('is_complete', sa.Boolean(), nullable=True),
+    sa.ForeignKeyConstraint([item_column], [f'{item_table}.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', item_column, name=f'uq_{completion_table}_user_id_{item_column}')
+    )
+    op.create_index(f'ix_{completion_table}_{item_column}', completion_table, [item_column])
+    op.create_table(discussion_table,
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column(item_column, sa.Integer(), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('content', sa.Text(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint([item_column], [f'{item_table}.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(
+        f'ix_{discussion_table}_{item_column}_timestamp_id',
+        discussion_table,
+        [item_column, sa.text('timestamp DESC'), sa.text('id DESC')],
+    )
+
+
+def reset_sequences(tables):
+    # Rows were copied with explicit ids; move Postgres sequences past them
+    if op.get_bind().dialect.name == 'postgresql':
+        for table in tables:
+            op.execute(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)"
+            )
+
+
+def create_legacy_table():
+    op.create_table('legacy_item_id',
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('legacy_id', sa.Integer(), nullable=False),
+    sa.Column('new_id', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('kind', 'legacy_id')
+    )
+
+
+def max_id(bind, table):
+    return bind.execute(sa.text(f'SELECT COALESCE(MAX(id), 0) FROM {table}')).scalar()
+
+
+def copy_rows(table, kind, offset, copy_sql):
+    """Run ``copy_sql``, which copies ``table`` with ids moved up by ``offset``, and record the moves."""
+    op.execute(copy_sql)
+    if offset:
+        op.execute(
+            f"INSERT INTO legacy_item_id (kind, legacy_id, new_id) "
+            f"SELECT '{kind}', id, id + {offset} FROM {table}"
+        )
+
+
+def upgrade():
+    create_item_tables()
+    create_legacy_table()
+    bind = op.get_bind()
+    # Labs keep their ids. Quizzes and exams move past every id already used in
+    # course_item and past their own old ids, so an id of a given type is either
+    # old or current, never both: the routes look up current ids first and fall
+    # back to legacy_item_id, so old /quizzes/<id> and /exams/<id> URLs keep
+    # working. Completions and discussions are moved the same way in their tables.
+    used = {'course_item': 0, 'item_completion': 0, 'item_discussion': 0}
+    for item_type, item_table, completion_table, discussion_table, item_column in ITEM_TABLES:
+        offsets = []
+        for new_table, old_table in (('course_item', item_table), ('item_completion', completion_table), ('item_discussion', discussion_table)):
+            old_max = max_id(bind, old_table)
+            offset = max(used[new_table], old_max) if used[new_table] else 0
+            used[new_table] = offset + old_max
+            offsets.append(offset)
+        item_offset, completion_offset, discussion_offset = offsets
+        copy_rows(item_table, item_type, item_offset,
+            f"INSERT INTO course_item (id, course_id, item_type, title, description) "
+            f"SELECT id + {item_offset}, course_id, '{item_type}', title, description FROM {item_table}"
+        )
+        copy_rows(completion_table, f'{item_type}_completion', completion_offset,
+            f'INSERT INTO item_completion (id, user_id, item_id, is_complete) '
+            f'SELECT id + {completion_offset}, user_id, {item_column} + {item_offset}, is_complete FROM {completion_table}'
+        )
+        copy_rows(discussion_table, f'{item_type}_discussion', discussion_offset,
+            f'INSERT INTO item_discussion (id, item_id, user_id, content, timestamp) '
+            f'SELECT id + {discussion_offset}, {item_column} + {item_offset}, user_id, content, timestamp FROM {discussion_table}'
+        )
+    reset_sequences(('course_item', 'item_completion', 'item_discussion'))
+    for _, item_table, completion_table, discussion_table, _ in reversed(ITEM_TABLES):
+        op.drop_table(discussion_table)
+        op.drop_table(completion_table)
+        op.drop_table(item_table)
+
+
+def old_id(kind, column):
+    """SQL for the pre-merge id of ``column``; rows added since the merge keep theirs."""
+    return f"COALESCE((SELECT legacy_id FROM legacy_item_id WHERE kind = '{kind}' AND new_id = {column}), {column})"
+
+
+def downgrade():
+    # Rows get their old ids back. Rows added since the merge keep their unified
+    # ids, which are above every old id of their type.
+    for item_type, item_table, completion_table, discussion_table, item_column in ITEM_TABLES:
+        create_old_tables(item_table, completion_table, discussion_table, item_column)
+        op.execute(
+            f"INSERT INTO {item_table} (id, course_id, title, description) "
+            f"SELECT {old_id(item_type, 'id')}, course_id, title, description FROM course_item WHERE item_type = '{item_type}'"
+        )
+        op.execute(
+            f'INSERT INTO {completion_table} (id, user_id, {item_column}, is_complete) '
+            f"SELECT {old_id(f'{item_type}_completion', 'c.id')}, c.user_id, {old_id(item_type, 'c.item_id')}, c.is_complete "
+            f'FROM item_completion c JOIN course_item i ON i.id = c.item_id '
+            f"WHERE i.item_type = '{item_type}'"
+        )
+        op.execute(
+            f'INSERT INTO {discussion_table} (id, {item_column}, user_id, content, timestamp) '
+            f"SELECT {old_id(f'{item_type}_discussion', 'd.id')}, {old_id(item_type, 'd.item_id')}, d.user_id, d.content, d.timestamp "
+            f'FROM item_discussion d JOIN course_item i ON i.id = d.item_id '
+            f"WHERE i.item_type = '{item_type}'"
+        )
+        reset_sequences((item_table, completion_table, discussion_table))
+    op.drop_table('legacy_item_id')
+    op.drop_table('item_discussion')
+    op.drop_table('item_completion')
+    op.drop_table('course_item')
@@ -0,0 +1,58 @@
+"""Add progress counters to Enrollment
+
+Revision ID: 8f2d41c7a9e3
+Revises: c6329b885de8
+Create Date: 2026-10-18 09:12:44.518203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8f2d41c7a9e3'
+down_revision = 'c6329b885de8'
+branch_labels = None
+depends_on = None
+
+COUNTERS = (
+    ('labs', 'lab', 'lab_completion', 'lab_id'),
+    ('quizzes', 'quiz', 'quiz_completion', 'quiz_id'),
+    ('exams', 'exam', 'exam_completion', 'exam_id'),
+)
+
+
+def upgrade():
+    with op.batch_alter_table('enrollment', schema=None) as batch_op:
+        for prefix, _, _, _ in COUNTERS:
+            batch_op.add_column(sa.Column(f'{prefix}_completed', sa.Integer(), nullable=False, server_default='0'))
+            batch_op.add_column(sa.Column(f'{prefix}_total', sa.Integer(), nullable=False, server_default='0'))
+
+    # Backfill the counters from the existing completion rows
+    assignments = []
+    for prefix, item_table, completion_table, item_column in COUNTERS:
+        assignments.append(
+            f'{prefix}_total = (SELECT COUNT(*) FROM {item_table} '
+            f'WHERE {item_table}.course_id = enrollment.course_id)'
+        )
+        assignments.append(
+            f'{prefix}_completed = (SELECT COUNT(DISTINCT {completion_table}.{item_column}) FROM {completion_table} '
+            f'JOIN {item_table} ON {item_table}.id = {completion_table}.{item_column} '
+            f'WHERE {item_table}.course_id = enrollment.course_id '
+            f'AND {completion_table}.user_id = enrollment.user_id '
+            f'AND {completion_table}.is_complete)'
+        )
+    op.execute('UPDATE enrollment SET ' + ', '.join(assignments))
+    op.execute(
+        'UPDATE enrollment SET progress = CASE '
+        'WHEN labs_total + quizzes_total + exams_total > 0 '
+        'THEN (labs_completed + quizzes_completed + exams_completed) * 100 / (labs_total + quizzes_total + exams_total) '
+        'ELSE 0 END'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('enrollment', schema=None) as batch_op:
+        for prefix, _, _, _ in reversed(COUNTERS):
+            batch_op.drop_column(f'{prefix}_total')
+            batch_op.drop_column(f'{prefix}_completed')
@@ -0,0 +1,43 @@
+"""Add indexes for the enrollment, course item and completion query shapes
+
+Revision ID: a93c5e2f8b14
+Revises: 5b7e9f13c2d8
+Create Date: 2026-10-18 14:21:52.630417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a93c5e2f8b14'
+down_revision = '5b7e9f13c2d8'
+branch_labels = None
+depends_on = None
+
+# Completion (user_id, item_id) lookups are served by the unique constraints from
+# d41a6c0b7e52 and discussion threads by the keyset indexes from 5b7e9f13c2d8.
+INDEXES = (
+    # Enrollment checks, enrollment listings and progress updates
+    ('ix_enrollment_user_id_course_id', 'enrollment', ['user_id', 'course_id']),
+    # Course detail enrolled_users and course-scoped reconciliation
+    ('ix_enrollment_course_id', 'enrollment', ['course_id']),
+    # Per-course item listings, the workspace query and item totals
+    ('ix_lab_course_id', 'lab', ['course_id']),
+    ('ix_quiz_course_id', 'quiz', ['course_id']),
+    ('ix_exam_course_id', 'exam', ['course_id']),
+    # Item-side completion lookups (item deletes cascading to completions)
+    ('ix_lab_completion_lab_id', 'lab_completion', ['lab_id']),
+    ('ix_quiz_completion_quiz_id', 'quiz_completion', ['quiz_id']),
+    ('ix_exam_completion_exam_id', 'exam_completion', ['exam_id']),
+)
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,101 @@
+"""Add full-text search indexes for course content and discussions
+
+Revision ID: b3d6a0f58e21
+Revises: 7c1f4e2a9b36
+Create Date: 2026-10-18 17:52:06.318840
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3d6a0f58e21'
+down_revision = '7c1f4e2a9b36'
+branch_labels = None
+depends_on = None
+
+# The search objects are not in the models; migrations/env.py keeps autogenerate
+# from dropping them.
+#
+# SQLite: one FTS5 table, search_index, kept in sync by triggers. Its rowid is
+# source id * 4 + kind so a source row's entry is found without a scan. The
+# indexed ``scope`` column holds 'c<course_id> k<kind>' tokens so course and kind
+# filters are part of the MATCH instead of a per-row check. Note that
+# op.batch_alter_table recreates a table on SQLite and drops its triggers.
+# (table, kind, title, body, course_id, item_id, item_type) as SQL on NEW/OLD rows
+SQLITE_SOURCES = (
+    ('course', 0, "{row}.title", "coalesce({row}.description, '')", '{row}.id', 'NULL', 'NULL'),
+    ('course_item', 1, "{row}.title", "coalesce({row}.description, '')", '{row}.course_id', '{row}.id', '{row}.item_type'),
+    ('discussion', 2, "''", '{row}.content', '{row}.course_id', 'NULL', 'NULL'),
+    ('item_discussion', 3, "''", '{row}.content',
+     '(SELECT course_id FROM course_item WHERE id = {row}.item_id)', '{row}.item_id',
+     '(SELECT item_type FROM course_item WHERE id = {row}.item_id)'),
+)
+
+# Postgres: a generated tsvector column with a GIN index on each source table
+# (table, weighted tsvector expression)
+POSTGRES_SOURCES = (
+    ('course', "setweight(to_tsvector('english', title), 'A') || setweight(to_tsvector('english', coalesce(description, '')), 'B')"),
+    ('course_item', "setweight(to_tsvector('english', title), 'A') || setweight(to_tsvector('english', coalesce(description, '')), 'B')"),
+    ('discussion', "to_tsvector('english', content)"),
+    ('item_discussion', "to_tsvector('english', content)"),
+)
+
+
+def sqlite_values(row, kind, title, body, course_id, item_id, item_type):
+    course_id = course_id.format(row=row)
+    return (
+        f"{row}.id * 4 + {kind}, {title.format(row=row)}, {body.format(row=row)}, "
+        f"'c' || coalesce({course_id}, '') || ' k{kind}', "
+        f"{course_id}, {item_id.format(row=row)}, {item_type.format(row=row)}"
+    )
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for table, vector in POSTGRES_SOURCES:
+            op.execute(f'ALTER TABLE {table} ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ({vector}) STORED')
+            op.execute(f'CREATE INDEX ix_{table}_search_vector ON {table} USING GIN (search_vector)')
+        return
+    op.execute(
+        'CREATE VIRTUAL TABLE search_index USING fts5('
+        'title, body, scope, course_id UNINDEXED, item_id UNINDEXED, item_type UNINDEXED, '
+        "tokenize = 'porter unicode61')"
+    )
+    columns = 'rowid, title, body, scope, course_id, item_id, item_type'
+    for table, kind, *expressions in SQLITE_SOURCES:
+        op.execute(f'INSERT INTO search_index ({columns}) SELECT {sqlite_values(table, kind, *expressions)} FROM {table}')
+        op.execute(
+            f'CREATE TRIGGER search_index_{table}_insert AFTER INSERT ON {table} BEGIN '
+            f'INSERT INTO search_index ({columns}) VALUES ({sqlite_values("new", kind, *expressions)}); END'
+        )
+        op.execute(
+            f'CREATE TRIGGER search_index_{table}_update AFTER UPDATE ON {table} BEGIN '
+            f'DELETE FROM search_index WHERE rowid = old.id * 4 + {kind}; '
+            f'INSERT INTO search_index ({columns}) VALUES ({sqlite_values("new", kind, *expressions)}); END'
+        )
+        op.execute(
+            f'CREATE TRIGGER search_index_{table}_delete AFTER DELETE ON {table} BEGIN '
+            f'DELETE FROM search_index WHERE rowid = old.id * 4 + {kind}; END'
+        )
+    # Item discussions are scoped by their item's course
+    op.execute(
+        'CREATE TRIGGER search_index_course_item_move AFTER UPDATE OF course_id, item_type ON course_item BEGIN '
+        "UPDATE search_index SET scope = 'c' || coalesce(new.course_id, '') || ' k3', "
+        'course_id = new.course_id, item_type = new.item_type '
+        'WHERE rowid IN (SELECT id * 4 + 3 FROM item_discussion WHERE item_id = new.id); END'
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for table, _ in reversed(POSTGRES_SOURCES):
+            op.execute(f'DROP INDEX ix_{table}_search_vector')
+            op.execute(f'ALTER TABLE {table} DROP COLUMN search_vector')
+        return
+    op.execute('DROP TRIGGER search_index_course_item_move')
+    for table, *_ in reversed(SQLITE_SOURCES):
+        for event in ('delete', 'update', 'insert'):
+            op.execute(f'DROP TRIGGER search_index_{table}_{event}')
+    op.execute('DROP TABLE search_index')
@@ -0,0 +1,53 @@
+"""Deduplicate completions and add unique (user_id, item_id) constraints
+
+Revision ID: d41a6c0b7e52
+Revises: 8f2d41c7a9e3
+Create Date: 2026-10-18 11:03:27.904615
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41a6c0b7e52'
+down_revision = '8f2d41c7a9e3'
+branch_labels = None
+depends_on = None
+
+COMPLETIONS = (
+    ('labs', 'lab', 'lab_completion', 'lab_id'),
+    ('quizzes', 'quiz', 'quiz_completion', 'quiz_id'),
+    ('exams', 'exam', 'exam_completion', 'exam_id'),
+)
+
+
+def upgrade():
+    for prefix, item_table, completion_table, item_column in COMPLETIONS:
+        # Keep the most recent row for each (user, item) pair
+        op.execute(
+            f'DELETE FROM {completion_table} WHERE id NOT IN '
+            f'(SELECT MAX(id) FROM {completion_table} GROUP BY user_id, {item_column})'
+        )
+        with op.batch_alter_table(completion_table, schema=None) as batch_op:
+            batch_op.create_unique_constraint(f'uq_{completion_table}_user_id_{item_column}', ['user_id', item_column])
+        # The surviving row may differ from the duplicates that were counted before
+        op.execute(
+            f'UPDATE enrollment SET {prefix}_completed = (SELECT COUNT(*) FROM {completion_table} '
+            f'JOIN {item_table} ON {item_table}.id = {completion_table}.{item_column} '
+            f'WHERE {item_table}.course_id = enrollment.course_id '
+            f'AND {completion_table}.user_id = enrollment.user_id '
+            f'AND {completion_table}.is_complete)'
+        )
+    op.execute(
+        'UPDATE enrollment SET progress = CASE '
+        'WHEN labs_total + quizzes_total + exams_total > 0 '
+        'THEN (labs_completed + quizzes_completed + exams_completed) * 100 / (labs_total + quizzes_total + exams_total) '
+        'ELSE 0 END'
+    )
+
+
+def downgrade():
+    for _, _, completion_table, item_column in reversed(COMPLETIONS):
+        with op.batch_alter_table(completion_table, schema=None) as batch_op:
+            batch_op.drop_constraint(f'uq_{completion_table}_user_id_{item_column}', type_='unique')
@@ -0,0 +1,28 @@
+"""Add content_version table for catalog and course ETags
+
+Revision ID: e2b8d5a17f60
+Revises: a93c5e2f8b14
+Create Date: 2026-10-18 15:48:09.117254
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b8d5a17f60'
+down_revision = 'a93c5e2f8b14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('content_version',
+    sa.Column('scope', sa.String(length=50), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('scope')
+    )
+
+
+def downgrade():
+    op.drop_table('content_version')
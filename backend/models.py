@@ -1,8 +1,19 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects import postgresql, sqlite
 from datetime import datetime
+from routing import RoutingSession
 
 # Initialize  SQLAlchemy instance (to be initialized in app.py)
-db = SQLAlchemy()
+# RoutingSession sends request reads to replicas when some are configured
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+def dialect_insert(table, dialect_name):
+    """INSERT construct with ON CONFLICT support (upserts) for Postgres and SQLite."""
+    if dialect_name == 'postgresql':
+        return postgresql.insert(table)
+    if dialect_name == 'sqlite':
+        return sqlite.insert(table)
+    raise NotImplementedError(f'Upserts are not supported on {dialect_name}')
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -25,11 +36,19 @@ class Course(db.Model):
     discussions = db.relationship('Discussion', back_populates='course', cascade='all, delete-orphan')
 
 class Enrollment(db.Model):
+    __table_args__ = (db.Index('ix_enrollment_user_id_course_id', 'user_id', 'course_id'),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    course_id = db.Column(db.Integer, db.ForeignKey('course.id'))
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), index=True)
     progress = db.Column(db.Integer, default=0)
     date_enrolled = db.Column(db.DateTime, default=datetime.utcnow)
+    # Progress counters, maintained alongside completion toggles (see progress.py)
+    labs_completed = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    labs_total = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    quizzes_completed = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    quizzes_total = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    exams_completed = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    exams_total = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     user = db.relationship('User', back_populates='enrollments')
     course = db.relationship('Course', back_populates='enrollments')
 
@@ -42,77 +61,72 @@ class Discussion(db.Model):
     user = db.relationship('User', back_populates='discussions')
     course = db.relationship('Course', back_populates='discussions')
 
-class Lab(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    course_id = db.Column(db.Integer, db.ForeignKey('course.id'))
-    title = db.Column(db.String(200), nullable=False)
-    description = db.Column(db.Text)
-    completions = db.relationship('LabCompletion', back_populates='lab', cascade='all, delete-orphan')
-    discussions = db.relationship('LabDiscussion', back_populates='lab', cascade='all, delete-orphan')
+# Keyset pagination indexes for thread listings, newest first
+db.Index('ix_discussion_course_id_timestamp_id', Discussion.course_id, Discussion.timestamp.desc(), Discussion.id.desc())
 
-class Quiz(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    course_id = db.Column(db.Integer, db.ForeignKey('course.id'))
-    title = db.Column(db.String(200), nullable=False)
-    description = db.Column(db.Text)
-    completions = db.relationship('QuizCompletion', back_populates='quiz', cascade='all, delete-orphan')
-    discussions = db.relationship('QuizDiscussion', back_populates='quiz', cascade='all, delete-orphan')
+# Course item types: URL segment -> item_type discriminator stored on CourseItem
+ITEM_TYPES = {
+    'labs': 'lab',
+    'quizzes': 'quiz',
+    'exams': 'exam',
+}
 
-class Exam(db.Model):
+class CourseItem(db.Model):
+    """A lab, quiz or exam; ``item_type`` says which."""
+    __table_args__ = (db.Index('ix_course_item_course_id_item_type', 'course_id', 'item_type'),)
     id = db.Column(db.Integer, primary_key=True)
     course_id = db.Column(db.Integer, db.ForeignKey('course.id'))
+    item_type = db.Column(db.String(10), nullable=False)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
-    completions = db.relationship('ExamCompletion', back_populates='exam', cascade='all, delete-orphan')
-    discussions = db.relationship('ExamDiscussion', back_populates='exam', cascade='all, delete-orphan')
+    completions = db.relationship('ItemCompletion', back_populates='item', cascade='all, delete-orphan')
+    discussions = db.relationship('ItemDiscussion', back_populates='item', cascade='all, delete-orphan')
+    __mapper_args__ = {'polymorphic_on': item_type}
 
-class LabCompletion(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    lab_id = db.Column(db.Integer, db.ForeignKey('lab.id'))
-    is_complete = db.Column(db.Boolean, default=False)
-    user = db.relationship('User')
-    lab = db.relationship('Lab', back_populates='completions')
+# Per-type views of CourseItem, kept so code written against the old Lab/Quiz/Exam
+# models (e.g. seed_courses.py) keeps working; queries through them filter on item_type
+class Lab(CourseItem):
+    __mapper_args__ = {'polymorphic_identity': 'lab'}
 
-class QuizCompletion(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'))
-    is_complete = db.Column(db.Boolean, default=False)
-    user = db.relationship('User')
-    quiz = db.relationship('Quiz', back_populates='completions')
+class Quiz(CourseItem):
+    __mapper_args__ = {'polymorphic_identity': 'quiz'}
+
+class Exam(CourseItem):
+    __mapper_args__ = {'polymorphic_identity': 'exam'}
 
-class ExamCompletion(db.Model):
+class ItemCompletion(db.Model):
+    __table_args__ = (db.UniqueConstraint('user_id', 'item_id', name='uq_item_completion_user_id_item_id'),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    exam_id = db.Column(db.Integer, db.ForeignKey('exam.id'))
+    item_id = db.Column(db.Integer, db.ForeignKey('course_item.id'), index=True)
     is_complete = db.Column(db.Boolean, default=False)
     user = db.relationship('User')
-    exam = db.relationship('Exam', back_populates='completions')
+    item = db.relationship('CourseItem', back_populates='completions')
 
-class LabDiscussion(db.Model):
+class ItemDiscussion(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    lab_id = db.Column(db.Integer, db.ForeignKey('lab.id'))
+    item_id = db.Column(db.Integer, db.ForeignKey('course_item.id'))
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     content = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    lab = db.relationship('Lab', back_populates='discussions')
+    item = db.relationship('CourseItem', back_populates='discussions')
     user = db.relationship('User')
 
-class QuizDiscussion(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'))
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    content = db.Column(db.Text, nullable=False)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    quiz = db.relationship('Quiz', back_populates='discussions')
-    user = db.relationship('User')
+db.Index('ix_item_discussion_item_id_timestamp_id', ItemDiscussion.item_id, ItemDiscussion.timestamp.desc(), ItemDiscussion.id.desc())
 
-class ExamDiscussion(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    exam_id = db.Column(db.Integer, db.ForeignKey('exam.id'))
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    content = db.Column(db.Text, nullable=False)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    exam = db.relationship('Exam', back_populates='discussions')
-    user = db.relationship('User') 
+class LegacyItemId(db.Model):
+    """Old id of a quiz or exam, or of one of their completions or discussions.
+
+    Merging the per-type tables into course_item (migration 7c1f4e2a9b36) gave
+    these rows new ids. ``kind`` is the item type, optionally followed by
+    ``_completion`` or ``_discussion``. Old ids never clash with current ids of
+    the same kind.
+    """
+    kind = db.Column(db.String(20), primary_key=True)
+    legacy_id = db.Column(db.Integer, primary_key=True)
+    new_id = db.Column(db.Integer, nullable=False)
+
+class ContentVersion(db.Model):
+    """Version counter for a cacheable slice of content ('catalog' or 'course:<id>')."""
+    scope = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
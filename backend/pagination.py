@@ -0,0 +1,48 @@
+import base64
+from datetime import datetime
+from flask import current_app, request
+import reads
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(timestamp, row_id):
+    """Opaque cursor for the (timestamp, id) position of a row."""
+    raw = f'{timestamp.isoformat()}|{row_id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        timestamp, row_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except ValueError as e:
+        raise InvalidCursor(cursor) from e
+
+def page_size():
+    """Page size from the ``limit`` query argument, clamped to the configured maximum."""
+    default = current_app.config['DISCUSSION_PAGE_SIZE']
+    limit = request.args.get('limit', default, type=int)
+    return max(1, min(limit, current_app.config['DISCUSSION_MAX_PAGE_SIZE']))
+
+def paginate_discussions(model, thread_column, thread_id):
+    """One page of a discussion thread, newest first, using keyset pagination.
+
+    Reads ``cursor`` and ``limit`` from the request. Rows are ordered by
+    (timestamp DESC, id DESC) so the position is stable when posts share a
+    timestamp. Returns ``(discussions, next_cursor)``, the discussions being rows
+    with ``id``, ``content``, ``user_email`` and ``timestamp``; ``next_cursor`` is
+    None on the last page. Raises InvalidCursor for a malformed cursor.
+    """
+    limit = page_size()
+    first, after = reads.discussion_page_statements(model, thread_column)
+    cursor = request.args.get('cursor')
+    if cursor:
+        timestamp, row_id = decode_cursor(cursor)
+        discussions = reads.rows(after, thread_id=thread_id, limit=limit + 1, timestamp=timestamp, row_id=row_id).all()
+    else:
+        discussions = reads.rows(first, thread_id=thread_id, limit=limit + 1).all()
+    if len(discussions) <= limit:
+        return discussions, None
+    last = discussions[limit - 1]
+    return discussions[:limit], encode_cursor(last.timestamp, last.id)
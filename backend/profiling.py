@@ -0,0 +1,269 @@
+"""Opt-in sampling profiler for single API requests.
+
+A request is profiled when it carries an ``X-Profile`` header signed with
+PROFILE_SECRET (mint one with ``flask profile-token``) or, with
+PROFILE_SAMPLE_RATE > 0, when it is picked at random. While it runs, a sampler
+thread reads the request thread's stack every PROFILE_INTERVAL seconds and
+adds the time since the previous sample to that stack. Samples taken inside a
+database call end in an ``[sql] <statement>`` frame and samples inside JSON
+encoding in ``[json]``, so both show up in the graph and in the totals.
+
+Each profile is written as ``<name>.collapsed`` (Brendan Gregg's collapsed
+stack format, weights in microseconds, for flamegraph.pl or speedscope) and
+``<name>.html`` (a self-contained icicle graph) into PROFILE_DIR, which keeps
+the newest PROFILE_KEEP profiles. The response carries the name in
+``X-Profile-Id``. Each worker profiles one request at a time. Streamed
+responses are profiled until the stream ends, or for at most
+PROFILE_MAX_SECONDS.
+
+With neither a secret nor a sample rate configured no hooks are installed,
+so requests pay nothing.
+"""
+import hashlib
+import hmac
+import html
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import click
+from flask import current_app, g, request
+from cooperative import cooperative
+
+logger = logging.getLogger(__name__)
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+SQL_FUNCTIONS = {'do_execute', 'do_executemany', 'do_execute_no_params'}
+# Nodes narrower than this share of the total are left out of the HTML graph
+MIN_HTML_SHARE = 0.002
+
+def sign(secret, expires):
+    return hmac.new(secret.encode(), str(expires).encode(), hashlib.sha256).hexdigest()
+
+def profile_token(secret, ttl):
+    """``X-Profile`` header value valid for ``ttl`` seconds."""
+    expires = int(time.time() + ttl)
+    return f'{expires}.{sign(secret, expires)}'
+
+def token_valid(secret, token):
+    expires, _, signature = token.partition('.')
+    if not secret or not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(signature, sign(secret, expires))
+
+def frame_label(frame):
+    code = frame.f_code
+    path = code.co_filename
+    if path.startswith(APP_DIR + os.sep):
+        path = os.path.relpath(path, APP_DIR)
+    else:
+        # Library frames by package path, e.g. sqlalchemy/orm/query.py
+        match = re.search(r'(?:site-packages|python\d\.\d+)[/\\](.*)$', path)
+        path = match.group(1) if match else os.path.basename(path)
+    return f'{path}:{code.co_name}'.replace(';', ',').replace(' ', '_')
+
+def sample_stack(frame):
+    """Collapsed-stack frames from the WSGI entry point down to ``frame``, and its category.
+
+    Returns (None, None) once the request thread is inside this module.
+    """
+    frames = []
+    category = 'python'
+    sql = None
+    while frame is not None:
+        code = frame.f_code
+        if code.co_filename == __file__:
+            # The request thread is stopping the sampler
+            return None, None
+        if code.co_name == 'wsgi_app' and code.co_filename.endswith(os.path.join('flask', 'app.py')):
+            frames.append(frame_label(frame))
+            break
+        if sql is None and code.co_name in SQL_FUNCTIONS and 'sqlalchemy' in code.co_filename:
+            sql = frame.f_locals.get('statement') or ''
+        elif category == 'python' and code.co_filename.endswith(os.path.join('json', 'encoder.py')):
+            category = 'json'
+        frames.append(frame_label(frame))
+        frame = frame.f_back
+    frames.reverse()
+    if sql is not None:
+        category = 'sql'
+        frames.append('[sql] ' + ' '.join(sql.split())[:80].replace(';', ','))
+    elif category == 'json':
+        frames.append('[json]')
+    return ';'.join(frames), category
+
+class Sampler(threading.Thread):
+    def __init__(self, thread_id, interval, max_seconds):
+        super().__init__(name='request-profiler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.stacks = {}
+        self.totals = {'python': 0.0, 'sql': 0.0, 'json': 0.0}
+        self.finished = threading.Event()
+
+    def run(self):
+        started = last = time.perf_counter()
+        while not self.finished.wait(self.interval):
+            now = time.perf_counter()
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None or now - started > self.max_seconds:
+                break
+            stack, category = sample_stack(frame)
+            del frame
+            if stack is None:
+                break
+            self.stacks[stack] = self.stacks.get(stack, 0.0) + (now - last)
+            self.totals[category] += now - last
+            last = now
+
+    def stop(self):
+        self.finished.set()
+        self.join()
+
+def collapsed(stacks):
+    return ''.join(f'{stack} {max(round(seconds * 1e6), 1)}\n' for stack, seconds in sorted(stacks.items()))
+
+def render_html(title, stacks, totals):
+    """Self-contained icicle graph: callers on top, width proportional to time."""
+    root = {'name': 'all', 'value': 0.0, 'children': {}}
+    for stack, seconds in stacks.items():
+        node = root
+        node['value'] += seconds
+        for name in stack.split(';'):
+            node = node['children'].setdefault(name, {'name': name, 'value': 0.0, 'children': {}})
+            node['value'] += seconds
+    sampled = root['value']
+    total = sampled or 1.0
+
+    def render(node, parent_value, depth):
+        share = node['value'] / total
+        width = 100.0 * node['value'] / parent_value
+        label = html.escape(node['name'])
+        children = ''.join(
+            render(child, node['value'], depth + 1)
+            for child in sorted(node['children'].values(), key=lambda c: -c['value'])
+            if child['value'] / total >= MIN_HTML_SHARE
+        )
+        hue = 0 if node['name'].startswith('[sql]') else 200 if node['name'] == '[json]' else 30 + (depth * 7) % 30
+        return (
+            f'<div class="n" style="width:{width:.3f}%">'
+            f'<div class="f" style="background:hsl({hue},80%,{62 + depth % 3 * 5}%)" '
+            f'title="{label} — {node["value"] * 1000:.1f} ms ({share:.1%})">{label}</div>'
+            f'<div class="c">{children}</div></div>'
+        )
+
+    summary = ', '.join(f'{category} {seconds * 1000:.1f} ms' for category, seconds in totals.items())
+    return (
+        '<!doctype html><meta charset="utf-8">'
+        f'<title>{html.escape(title)}</title>'
+        '<style>body{font:12px sans-serif;margin:8px}.n{box-sizing:border-box;overflow:hidden}'
+        '.c{display:flex}.f{height:17px;line-height:17px;padding:0 3px;margin:0 1px 1px 0;'
+        'white-space:nowrap;overflow:hidden;text-overflow:ellipsis;cursor:default}'
+        '.f:hover{filter:brightness(85%)}</style>'
+        f'<h3>{html.escape(title)}</h3><p>{sampled * 1000:.1f} ms sampled: {summary}</p>'
+        f'<div class="c">{render(root, total, 0)}</div>'
+    )
+
+class RequestProfiler:
+    def __init__(self):
+        self.secret = ''
+        self.sample_rate = 0.0
+        self.interval = 0.002
+        self.max_seconds = 30
+        self.directory = None
+        self.keep = 50
+        self._active = threading.Lock()
+
+    def init_app(self, app):
+        self.secret = app.config['PROFILE_SECRET']
+        self.sample_rate = app.config['PROFILE_SAMPLE_RATE']
+        self.interval = app.config['PROFILE_INTERVAL']
+        self.max_seconds = app.config['PROFILE_MAX_SECONDS']
+        self.keep = app.config['PROFILE_KEEP']
+        self.directory = app.config['PROFILE_DIR'] or os.path.join(tempfile.gettempdir(), 'studyhub-profiles')
+        app.extensions['profiler'] = self
+        if cooperative.enabled and (self.secret or self.sample_rate > 0):
+            # The sampler reads native thread stacks; greenlets share one thread
+            logger.warning('Request profiling is not available in cooperative (gevent) workers')
+        elif self.secret or self.sample_rate > 0:
+            app.before_request(self._before_request)
+            app.after_request(self._after_request)
+            app.teardown_request(self._teardown_request)
+
+    def _wanted(self):
+        token = request.headers.get('X-Profile')
+        if token:
+            return token_valid(self.secret, token)
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def _before_request(self):
+        if request.blueprint != 'api' or not self._wanted():
+            return
+        if not self._active.acquire(blocking=False):
+            return
+        sampler = Sampler(threading.get_ident(), self.interval, self.max_seconds)
+        sampler.start()
+        endpoint = request.url_rule.endpoint.split('.')[-1] if request.url_rule else 'unmatched'
+        name = time.strftime('%Y%m%dT%H%M%S') + f'-{time.time_ns() % 10**9:09d}-{os.getpid()}-{endpoint}'
+        g._profile = {'sampler': sampler, 'name': name, 'status': 500}
+
+    def _after_request(self, response):
+        profile = g.get('_profile')
+        if profile is not None:
+            profile['status'] = response.status_code
+            response.headers['X-Profile-Id'] = profile['name']
+        return response
+
+    def _teardown_request(self, exc):
+        # Runs once the body is built, or once a stream_with_context body is exhausted
+        profile = g.pop('_profile', None)
+        if profile is None:
+            return
+        try:
+            profile['sampler'].stop()
+            title = f'{request.method} {request.full_path.rstrip("?")} → {profile["status"]}'
+            self.save(profile['name'], title, profile['sampler'])
+        finally:
+            self._active.release()
+
+    def save(self, name, title, sampler):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            base = os.path.join(self.directory, name)
+            with open(base + '.collapsed', 'w') as f:
+                f.write(collapsed(sampler.stacks))
+            with open(base + '.html', 'w') as f:
+                f.write(render_html(title, sampler.stacks, sampler.totals))
+            self.prune()
+        except OSError:
+            logger.warning('Could not write profile %s', name, exc_info=True)
+            return
+        logger.info('Profiled %s (%s) into %s', title, ', '.join(
+            f'{category} {seconds * 1000:.1f} ms' for category, seconds in sampler.totals.items()
+        ), base)
+
+    def prune(self):
+        """Keep the newest ``keep`` profiles; names start with their timestamp."""
+        names = sorted({os.path.splitext(n)[0] for n in os.listdir(self.directory) if n.endswith(('.collapsed', '.html'))})
+        for name in names[:-self.keep or None]:
+            for extension in ('.collapsed', '.html'):
+                try:
+                    os.remove(os.path.join(self.directory, name + extension))
+                except FileNotFoundError:
+                    pass
+
+request_profiler = RequestProfiler()
+
+@click.command('profile-token')
+@click.option('--ttl', type=int, default=600, show_default=True, help='Seconds the token stays valid.')
+def profile_token_command(ttl):
+    """Print an X-Profile header value that profiles the requests sending it."""
+    secret = current_app.config['PROFILE_SECRET']
+    if not secret:
+        raise click.ClickException('PROFILE_SECRET is not set.')
+    click.echo(profile_token(secret, ttl))
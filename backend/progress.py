@@ -0,0 +1,191 @@
+import time
+from collections import namedtuple
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import select, update, func, case, and_, or_
+from models import db, dialect_insert, ITEM_TYPES, Enrollment, CourseItem, ItemCompletion
+
+def completed_column(item_type):
+    return getattr(Enrollment, f'{item_type}_completed')
+
+def total_column(item_type):
+    return getattr(Enrollment, f'{item_type}_total')
+
+def progress_expression(completed_delta=None):
+    """SQL expression for Enrollment.progress computed from the counter columns.
+
+    ``completed_delta`` maps item types to an adjustment applied to their completed
+    counter, so the expression can be used in the same UPDATE that changes it.
+    """
+    completed_delta = completed_delta or {}
+    completed = sum(completed_column(t) + completed_delta.get(t, 0) for t in ITEM_TYPES)
+    total = sum(total_column(t) for t in ITEM_TYPES)
+    return case((total > 0, completed * 100 // total), else_=0)
+
+def course_item_totals(course_id):
+    """Number of items of each type in a course, in one query."""
+    counts = dict(db.session.execute(
+        select(CourseItem.item_type, func.count())
+        .where(CourseItem.course_id == course_id)
+        .group_by(CourseItem.item_type)
+    ).all())
+    return {item_type: counts.get(discriminator, 0) for item_type, discriminator in ITEM_TYPES.items()}
+
+def set_completion(user_id, item_type, item_id, is_complete):
+    """Set a user's completion state for an item and update their progress counters.
+
+    Everything happens in the caller's transaction. The completion row is changed
+    by one conditional write that returns the row only if its state actually
+    flipped, and only then is the enrollment counter moved, so concurrent toggles
+    of the same item cannot count a change twice. Toggles that don't change the
+    stored state write nothing. Returns the item's course id, or None if there is
+    no item of that type.
+    """
+    course_id = db.session.execute(
+        select(CourseItem.course_id).where(CourseItem.id == item_id, CourseItem.item_type == ITEM_TYPES[item_type])
+    ).first()
+    if course_id is None:
+        return None
+    course_id = course_id[0]
+    table = ItemCompletion.__table__
+    if is_complete:
+        # A missing row counts as incomplete, so inserting one is a change too
+        stmt = dialect_insert(table, db.session.get_bind().dialect.name)
+        stmt = stmt.values(user_id=user_id, item_id=item_id, is_complete=True).on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.item_id],
+            set_={'is_complete': True},
+            where=table.c.is_complete.is_distinct_from(True),
+        )
+        delta = 1
+    else:
+        stmt = update(table).where(table.c.user_id == user_id, table.c.item_id == item_id, table.c.is_complete == True).values(is_complete=False)
+        delta = -1
+    if db.session.execute(stmt.returning(table.c.id)).first() is None:
+        return course_id
+    db.session.execute(
+        update(Enrollment)
+        .where(Enrollment.user_id == user_id, Enrollment.course_id == course_id)
+        .values({
+            completed_column(item_type): completed_column(item_type) + delta,
+            Enrollment.progress: progress_expression({item_type: delta}),
+        })
+        .execution_options(synchronize_session=False)
+    )
+    return course_id
+
+def apply_completions(user_id, entries):
+    """Apply a batch of completion changes for one user in the caller's transaction.
+
+    ``entries`` is a list of ``(item_type, item_id, is_complete)``; later entries for
+    the same item win. The same id under two types is one unknown item. Rows are written with one native INSERT ... ON CONFLICT
+    upsert that skips rows already in the requested state, then progress is
+    reconciled once for the affected courses. Returns ``(rows_changed, course_ids)``,
+    or raises LookupError listing unknown items before anything is written.
+    """
+    requested = {}
+    for item_type, item_id, is_complete in entries:
+        requested[item_type, item_id] = bool(is_complete)
+    found = {
+        row.id: row for row in db.session.execute(
+            select(CourseItem.id, CourseItem.course_id, CourseItem.item_type).where(CourseItem.id.in_({i for _, i in requested}))
+        )
+    }
+    missing = [
+        (item_type, item_id) for item_type, item_id in requested
+        if item_id not in found or found[item_id].item_type != ITEM_TYPES[item_type]
+    ]
+    if missing:
+        raise LookupError(missing)
+    table = ItemCompletion.__table__
+    stmt = dialect_insert(table, db.session.get_bind().dialect.name)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.item_id],
+        set_={'is_complete': stmt.excluded.is_complete},
+        where=table.c.is_complete.is_distinct_from(stmt.excluded.is_complete),
+    ).returning(table.c.id)
+    changed = db.session.execute(
+        stmt,
+        [{'user_id': user_id, 'item_id': item_id, 'is_complete': state} for (_, item_id), state in requested.items()],
+    ).all()
+    course_ids = {row.course_id for row in found.values()}
+    reconcile_progress(sorted(course_ids), user_id=user_id)
+    return len(changed), course_ids
+
+ReconcileResult = namedtuple('ReconcileResult', ['counters_changed', 'progress_changed', 'elapsed'])
+
+def _reconcile_source(course_ids=None, user_id=None):
+    """Recomputed counters for every enrollment in scope, as one aggregate subquery."""
+    totals = select(CourseItem.course_id).group_by(CourseItem.course_id)
+    completed = (
+        select(ItemCompletion.user_id, CourseItem.course_id)
+        .join(CourseItem, CourseItem.id == ItemCompletion.item_id)
+        .where(ItemCompletion.is_complete == True)
+        .group_by(ItemCompletion.user_id, CourseItem.course_id)
+    )
+    for item_type, discriminator in ITEM_TYPES.items():
+        of_type = CourseItem.item_type == discriminator
+        totals = totals.add_columns(func.count(case((of_type, 1))).label(item_type))
+        completed = completed.add_columns(func.count(func.distinct(case((of_type, ItemCompletion.item_id)))).label(item_type))
+    enrollments = select(Enrollment.id.label('enrollment_id'))
+    if course_ids is not None:
+        totals = totals.where(CourseItem.course_id.in_(course_ids))
+        completed = completed.where(CourseItem.course_id.in_(course_ids))
+        enrollments = enrollments.where(Enrollment.course_id.in_(course_ids))
+    if user_id is not None:
+        completed = completed.where(ItemCompletion.user_id == user_id)
+        enrollments = enrollments.where(Enrollment.user_id == user_id)
+    totals = totals.subquery('totals')
+    completed = completed.subquery('completed')
+    enrollments = (
+        enrollments
+        .outerjoin(totals, totals.c.course_id == Enrollment.course_id)
+        .outerjoin(completed, and_(completed.c.user_id == Enrollment.user_id, completed.c.course_id == Enrollment.course_id))
+    )
+    for item_type in ITEM_TYPES:
+        enrollments = enrollments.add_columns(
+            func.coalesce(totals.c[item_type], 0).label(f'{item_type}_total'),
+            func.coalesce(completed.c[item_type], 0).label(f'{item_type}_completed'),
+        )
+    return enrollments.subquery('reconciled')
+
+def reconcile_progress(course_ids=None, user_id=None):
+    """Recompute progress counters from the item and completion tables.
+
+    Covers every enrollment, or only those in ``course_ids`` and/or belonging to
+    ``user_id``, with two set-based UPDATEs: one for the counters, one for the
+    progress percentage. Runs in the caller's transaction; commit to persist.
+    """
+    started = time.perf_counter()
+    source = _reconcile_source(course_ids, user_id)
+    counters = {}
+    for item_type in ITEM_TYPES:
+        counters[completed_column(item_type)] = source.c[f'{item_type}_completed']
+        counters[total_column(item_type)] = source.c[f'{item_type}_total']
+    counters_changed = db.session.execute(
+        update(Enrollment)
+        .where(Enrollment.id == source.c.enrollment_id)
+        .where(or_(*(column != value for column, value in counters.items())))
+        .values(counters)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    progress = update(Enrollment).where(Enrollment.progress.is_distinct_from(progress_expression()))
+    if course_ids is not None:
+        progress = progress.where(Enrollment.course_id.in_(course_ids))
+    if user_id is not None:
+        progress = progress.where(Enrollment.user_id == user_id)
+    progress_changed = db.session.execute(
+        progress.values(progress=progress_expression()).execution_options(synchronize_session=False)
+    ).rowcount
+    return ReconcileResult(counters_changed, progress_changed, time.perf_counter() - started)
+
+@click.command('reconcile-progress')
+@click.option('--course-id', 'course_ids', type=int, multiple=True, help='Only reconcile enrollments in this course (repeatable).')
+@with_appcontext
+def reconcile_progress_command(course_ids):
+    """Recompute enrollment progress after course content changes."""
+    result = reconcile_progress(course_ids or None)
+    db.session.commit()
+    click.echo(
+        f'Reconciled progress: {result.counters_changed} counter rows and '
+        f'{result.progress_changed} progress values changed in {result.elapsed:.2f}s'
+    )
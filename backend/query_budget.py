@@ -0,0 +1,316 @@
+"""Per-route query budgets, to catch N+1 regressions.
+
+``QueryRecorder`` records the statements run while it is active: their SQL and
+parameters, the rows fetched from each, and the line of application code that
+issued it. Statements run more than once with different parameters are
+reported as N+1 patterns. ``query_budget`` wraps it as a context manager or
+decorator that raises ``QueryBudgetExceeded``; with pytest installed, add
+``pytest_plugins = ['query_budget']`` to a conftest to get a
+``query_recorder`` fixture.
+
+``flask check-query-budgets`` replays the ``query_plans`` scenarios, one
+request per API route, against a scratch database built with the migrations
+and fails when a route runs more statements or fetches more rows than its
+entry in ``BUDGETS``, repeats a statement, or has no budget. Every scenario
+must succeed, so the budgets measure the route's real work. The fixtures are
+fixed and each run starts with empty caches, so the counts are deterministic.
+"""
+import os
+import sys
+import sysconfig
+import tempfile
+import traceback
+from functools import wraps
+import click
+from flask_migrate import upgrade
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.cursor import _DEFAULT_FETCH, BufferedRowCursorFetchStrategy, ResultFetchStrategy
+from query_plans import MIGRATIONS_DIR, SCENARIOS, SKIPPED_ENDPOINTS, create_check_app, seed_fixtures
+
+try:
+    import pytest
+except ImportError:
+    pytest = None
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# Frames in these are skipped when reporting where a statement came from
+LIBRARY_DIRS = tuple({sysconfig.get_paths()[key] + os.sep for key in ('stdlib', 'purelib', 'platlib')})
+
+# endpoint -> (statements, rows fetched) for one request of its query_plans scenario
+BUDGETS = {
+    'signup': (2, 0),
+    'login': (1, 1),
+    'get_courses': (2, 3),
+    'get_course': (3, 4),
+    'get_cache_stats': (1, 1),
+    'get_hashing_stats': (1, 1),
+    'get_metrics': (1, 1),
+    'enroll': (4, 4),
+    'get_enrollments': (1, 2),
+    'create_discussion': (1, 0),
+    'get_discussions': (1, 2),
+    'update_discussion': (2, 1),
+    'get_labs': (2, 6),
+    'get_quizzes': (1, 0),
+    'get_exams': (1, 0),
+    'search_content': (2, 7),
+    'get_workspace': (2, 1),
+    'set_lab_completion': (3, 2),
+    'set_quiz_completion': (3, 2),
+    'set_exam_completion': (3, 2),
+    'batch_completions': (5, 3),
+    'get_lab_discussions': (2, 2),
+    'create_lab_discussion': (3, 2),
+    'update_lab_discussion': (4, 3),
+    'get_quiz_discussions': (2, 2),
+    'create_quiz_discussion': (3, 2),
+    'update_quiz_discussion': (4, 3),
+    'get_exam_discussions': (2, 2),
+    'create_exam_discussion': (3, 2),
+    'update_exam_discussion': (4, 3),
+    'delete_discussion': (2, 1),
+    'delete_lab_discussion': (2, 1),
+    'delete_quiz_discussion': (2, 1),
+    'delete_exam_discussion': (2, 1),
+}
+
+# Statements a route is meant to repeat: endpoint -> SQL prefixes
+ALLOWED_REPEATS = {}
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+class RecordedStatement:
+    def __init__(self, sql, parameters, origin):
+        self.sql = ' '.join(sql.split())
+        self.parameters = parameters
+        self.origin = origin
+        self.rows = 0
+
+class CountingFetchStrategy(ResultFetchStrategy):
+    """Counts the rows a result hands out, delegating the fetching to ``inner``."""
+
+    __slots__ = ('inner', 'recorded')
+
+    def __init__(self, inner, recorded):
+        self.inner = inner
+        self.recorded = recorded
+
+    @property
+    def alternate_cursor_description(self):
+        return self.inner.alternate_cursor_description
+
+    def soft_close(self, result, dbapi_cursor):
+        self.inner.soft_close(result, dbapi_cursor)
+
+    def hard_close(self, result, dbapi_cursor):
+        self.inner.hard_close(result, dbapi_cursor)
+
+    def handle_exception(self, result, dbapi_cursor, err):
+        self.inner.handle_exception(result, dbapi_cursor, err)
+
+    def yield_per(self, result, dbapi_cursor, num):
+        self.inner.yield_per(result, dbapi_cursor, num)
+        # The default strategy swaps itself for a buffered one here
+        if result.cursor_strategy is not self:
+            result.cursor_strategy = CountingFetchStrategy(result.cursor_strategy, self.recorded)
+
+    def fetchone(self, result, dbapi_cursor, hard_close=False):
+        row = self.inner.fetchone(result, dbapi_cursor, hard_close)
+        if row is not None:
+            self.recorded.rows += 1
+        return row
+
+    def fetchmany(self, result, dbapi_cursor, size=None):
+        rows = self.inner.fetchmany(result, dbapi_cursor, size)
+        self.recorded.rows += len(rows)
+        return rows
+
+    def fetchall(self, result, dbapi_cursor):
+        rows = self.inner.fetchall(result, dbapi_cursor)
+        self.recorded.rows += len(rows)
+        return rows
+
+def statement_origin(depth=3):
+    """The innermost application frames on the stack, as ``file:line in function < caller ...``."""
+    frames = []
+    for frame in reversed(traceback.extract_stack()):
+        if frame.filename.startswith('<'):
+            continue
+        path = os.path.abspath(frame.filename)
+        if path == os.path.abspath(__file__):
+            # Inside the recorder, or past the code it was recording
+            if frames:
+                break
+            continue
+        if path.startswith(LIBRARY_DIRS):
+            continue
+        if path.startswith(APP_DIR + os.sep):
+            path = os.path.relpath(path, APP_DIR)
+        frames.append(f'{path}:{frame.lineno} in {frame.name}')
+        if len(frames) == depth:
+            break
+    return ' < '.join(frames) or 'unknown'
+
+class QueryRecorder:
+    """Statements run on any engine while the recorder is active."""
+
+    def __init__(self):
+        self.statements = []
+
+    def __enter__(self):
+        event.listen(Engine, 'after_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(Engine, 'after_cursor_execute', self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        recorded = RecordedStatement(statement, parameters, statement_origin())
+        self.statements.append(recorded)
+        if context is None:
+            return
+        # Results are built from the context's fetch strategy after this event
+        strategy = context.cursor_fetch_strategy
+        if strategy is _DEFAULT_FETCH and context.execution_options.get('stream_results'):
+            strategy = BufferedRowCursorFetchStrategy(context.cursor, context.execution_options)
+        context.cursor_fetch_strategy = CountingFetchStrategy(strategy, recorded)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    @property
+    def rows(self):
+        return sum(s.rows for s in self.statements)
+
+    def repeated(self):
+        """{sql: [statements]} for SQL run more than once with different parameters."""
+        groups = {}
+        for s in self.statements:
+            groups.setdefault(s.sql, []).append(s)
+        return {
+            sql: group for sql, group in groups.items()
+            if len({repr(s.parameters) for s in group}) > 1
+        }
+
+    def report(self):
+        lines = [f'{self.count} statement(s), {self.rows} row(s) fetched']
+        for n, s in enumerate(self.statements, 1):
+            sql = s.sql if len(s.sql) <= 160 else s.sql[:157] + '...'
+            lines.append(f'  {n}. [{s.rows} row(s)] {s.origin}\n       {sql}')
+        for sql, group in self.repeated().items():
+            origins = sorted({s.origin for s in group})
+            lines.append(f'  N+1: run {len(group)} times from {", ".join(origins)}\n       {sql[:160]}')
+        return '\n'.join(lines)
+
+class query_budget:
+    """Fail if the block or function runs more than ``statements`` statements,
+    fetches more than ``rows`` rows, or repeats one. ``allow_repeats`` is True
+    or the SQL prefixes of statements that may repeat.
+
+        with query_budget(2):
+            client.get('/api/courses/1')
+
+        @query_budget(3, rows=50)
+        def test_workspace(client): ...
+    """
+
+    def __init__(self, statements, rows=None, allow_repeats=()):
+        self.statements = statements
+        self.max_rows = rows
+        self.allow_repeats = allow_repeats
+        self.recorder = None
+
+    def __enter__(self):
+        self.recorder = QueryRecorder().__enter__()
+        return self.recorder
+
+    def __exit__(self, exc_type, exc, tb):
+        self.recorder.__exit__(exc_type, exc, tb)
+        if exc_type is None:
+            problems = budget_problems(self.recorder, (self.statements, self.max_rows), self.allow_repeats)
+            if problems:
+                raise QueryBudgetExceeded('; '.join(problems) + '\n' + self.recorder.report())
+
+    def __call__(self, fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self:
+                return fn(*args, **kwargs)
+        return wrapper
+
+def budget_problems(recorder, budget, allow_repeats=()):
+    """Ways ``recorder`` breaks ``budget`` (statements, rows or None)."""
+    statements, rows = budget
+    problems = []
+    if recorder.count > statements:
+        problems.append(f'{recorder.count} statements (budget {statements})')
+    if rows is not None and recorder.rows > rows:
+        problems.append(f'{recorder.rows} rows fetched (budget {rows})')
+    if allow_repeats is not True:
+        for sql, group in recorder.repeated().items():
+            if not sql.startswith(tuple(allow_repeats)):
+                problems.append(f'N+1: statement run {len(group)} times with different parameters')
+    return problems
+
+if pytest is not None:
+    @pytest.fixture
+    def query_recorder():
+        """Records the statements run during the test; assert on ``.count``, ``.rows`` or ``.repeated()``."""
+        with QueryRecorder() as recorder:
+            yield recorder
+
+def record_routes(app):
+    """Replay every scenario and return {endpoint: QueryRecorder}."""
+    recorded = {}
+    with app.app_context():
+        tokens = seed_fixtures()
+        client = app.test_client()
+        for endpoint, method, path, body, user in SCENARIOS:
+            headers = {'Authorization': f'Bearer {tokens[user]}'} if user is not None else {}
+            with QueryRecorder() as recorder:
+                response = client.open(path, method=method, json=body, headers=headers)
+                # Streaming bodies are consumed, except SSE streams which never end
+                if response.mimetype != 'text/event-stream':
+                    response.get_data()
+                response.close()
+            # A rejected request would only budget the checks in front of the route's work
+            if not 200 <= response.status_code < 300:
+                raise click.ClickException(f'{endpoint}: {method} {path} returned {response.status_code}')
+            recorded[endpoint] = recorder
+    return recorded
+
+def check_query_budgets(database_url):
+    """Run the scenarios against ``database_url``; returns (problems, {endpoint: QueryRecorder})."""
+    app = create_check_app(database_url)
+    with app.app_context():
+        upgrade(directory=MIGRATIONS_DIR)
+    expected = {rule.endpoint.split('.', 1)[1] for rule in app.url_map.iter_rules() if rule.endpoint.startswith('api.')}
+    problems = [f'{endpoint}: no query budget' for endpoint in sorted(expected - set(BUDGETS) - SKIPPED_ENDPOINTS)]
+    recorded = record_routes(app)
+    for endpoint, recorder in recorded.items():
+        if endpoint not in BUDGETS:
+            continue
+        broken = budget_problems(recorder, BUDGETS[endpoint], ALLOWED_REPEATS.get(endpoint, ()))
+        if broken:
+            problems.append(f'{endpoint}: {"; ".join(broken)}\n' + recorder.report())
+    return problems, recorded
+
+@click.command('check-query-budgets')
+@click.option('--database-url', help='Scratch database to check against (default: a temporary SQLite file).')
+@click.option('--verbose', is_flag=True, help='Print every route\'s statements and where they came from.')
+def check_query_budgets_command(database_url, verbose):
+    """Fail if any API route runs more queries than its budget or repeats one."""
+    with tempfile.TemporaryDirectory() as scratch:
+        problems, recorded = check_query_budgets(database_url or f'sqlite:///{os.path.join(scratch, "budgets.db")}')
+    if verbose:
+        for endpoint, recorder in recorded.items():
+            click.echo(f'{endpoint} (budget {BUDGETS.get(endpoint)}): {recorder.report()}')
+    if problems:
+        click.echo(f'{len(problems)} query budget problem(s):')
+        for problem in problems:
+            click.echo(f'  {problem}')
+        sys.exit(1)
+    click.echo(f'All {len(recorded)} route scenarios are within their query budgets.')
@@ -0,0 +1,220 @@
+"""EXPLAIN-based regression check for the queries issued by the API routes.
+
+Every route in ``api_bp`` is replayed through a Flask test client against a
+scratch database built with the Alembic migrations. Each SELECT/UPDATE/DELETE it
+issues is then run through ``EXPLAIN QUERY PLAN`` (SQLite) or ``EXPLAIN`` with
+sequential scans disabled (Postgres), and any plan that still scans a whole table
+is reported. ``flask check-query-plans`` exits non-zero on a full scan, on a
+scenario that does not get a 2xx response, or on a route that has no scenario.
+"""
+import os
+import re
+import sys
+import tempfile
+import click
+from flask import Flask
+from flask_jwt_extended import JWTManager, create_access_token
+from flask_migrate import Migrate, upgrade
+from sqlalchemy import event, text
+from cache import content_cache
+from hashing import password_hasher
+from membership import membership
+from events import discussion_events
+from metrics import metrics
+from compression import api_compression
+from config import Config
+from models import db, User, Course, Enrollment, Discussion, Lab, Quiz, Exam, ItemDiscussion
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+# (endpoint, method, path, JSON body, acting user index or None)
+SCENARIOS = [
+    ('signup', 'POST', '/api/signup', {'name': 'New', 'email': 'new@example.com', 'student_id': 'S-NEW', 'password': 'password'}, None),
+    ('login', 'POST', '/api/login', {'email': 'new@example.com', 'password': 'password'}, None),
+    ('get_courses', 'GET', '/api/courses', None, None),
+    ('get_course', 'GET', '/api/courses/1', None, None),
+    ('get_cache_stats', 'GET', '/api/cache/stats', None, 0),
+    ('get_hashing_stats', 'GET', '/api/hashing/stats', None, 0),
+    ('get_metrics', 'GET', '/api/metrics', None, 0),
+    ('enroll', 'POST', '/api/enrollments', {'course_id': 2}, 0),
+    ('get_enrollments', 'GET', '/api/enrollments/1', None, None),
+    ('create_discussion', 'POST', '/api/discussions', {'course_id': 1, 'content': 'A course-wide discussion post'}, 0),
+    ('get_discussions', 'GET', '/api/discussions/1', None, None),
+    ('update_discussion', 'PUT', '/api/discussions/1', {'content': 'An edited course-wide discussion post'}, 0),
+    ('get_labs', 'GET', '/api/courses/1/labs', None, 0),
+    ('get_quizzes', 'GET', '/api/courses/1/quizzes', None, 0),
+    ('get_exams', 'GET', '/api/courses/1/exams', None, 0),
+    ('search_content', 'GET', '/api/search?q=post', None, 0),
+    ('get_workspace', 'GET', '/api/courses/1/workspace', None, 0),
+    ('set_lab_completion', 'POST', '/api/labs/1/completion', {'is_complete': True}, 0),
+    ('set_quiz_completion', 'POST', '/api/quizzes/5/completion', {'is_complete': True}, 0),
+    ('set_exam_completion', 'POST', '/api/exams/9/completion', {'is_complete': True}, 0),
+    ('batch_completions', 'POST', '/api/completions:batch', {'completions': [{'type': 'labs', 'id': 2}, {'type': 'quizzes', 'id': 6, 'is_complete': False}]}, 0),
+    ('get_lab_discussions', 'GET', '/api/labs/1/discussions', None, 0),
+    ('create_lab_discussion', 'POST', '/api/labs/1/discussions', {'content': 'A lab discussion post'}, 0),
+    ('update_lab_discussion', 'PUT', '/api/lab-discussions/1', {'content': 'An edited lab post'}, 0),
+    ('get_quiz_discussions', 'GET', '/api/quizzes/5/discussions', None, 0),
+    ('create_quiz_discussion', 'POST', '/api/quizzes/5/discussions', {'content': 'A quiz discussion post'}, 0),
+    ('update_quiz_discussion', 'PUT', '/api/quiz-discussions/2', {'content': 'An edited quiz post'}, 0),
+    ('get_exam_discussions', 'GET', '/api/exams/9/discussions', None, 0),
+    ('create_exam_discussion', 'POST', '/api/exams/9/discussions', {'content': 'An exam discussion post'}, 0),
+    ('update_exam_discussion', 'PUT', '/api/exam-discussions/3', {'content': 'An edited exam post'}, 0),
+    ('delete_discussion', 'DELETE', '/api/discussions/1', None, 0),
+    ('delete_lab_discussion', 'DELETE', '/api/lab-discussions/1', None, 0),
+    ('delete_quiz_discussion', 'DELETE', '/api/quiz-discussions/2', None, 0),
+    ('delete_exam_discussion', 'DELETE', '/api/exam-discussions/3', None, 0),
+]
+
+# Full scans that are the point of the route
+ALLOWED_SCANS = {
+    'get_courses': {'course'},
+}
+
+# Routes that cannot be replayed through the test client
+SKIPPED_ENDPOINTS = set()
+
+CHECKED_STATEMENT = re.compile(r'^\s*(SELECT|UPDATE|DELETE|WITH)\b', re.IGNORECASE)
+SQLITE_SCAN = re.compile(r'^SCAN (\w+)')
+POSTGRES_SCAN = re.compile(r'Seq Scan on (\w+)')
+
+def create_check_app(database_url):
+    """Minimal app exposing ``api_bp`` on its own database."""
+    from routes import api_bp
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['TESTING'] = True
+    # Cache misses are what issue the queries; keep this run's cache private
+    app.config['CACHE_L2_URL'] = ''
+    app.config['PASSWORD_HASH_WORKERS'] = 0
+    # The first seeded user, so the admin-only routes get past their check
+    app.config['ADMIN_EMAILS'] = 'student0@example.com'
+    db.init_app(app)
+    content_cache.init_app(app)
+    password_hasher.init_app(app)
+    membership.init_app(app)
+    discussion_events.init_app(app)
+    metrics.init_app(app)
+    api_compression.init_app(app)
+    Migrate(app, db, directory=MIGRATIONS_DIR)
+    JWTManager(app)
+    app.register_blueprint(api_bp, url_prefix='/api')
+    return app
+
+def seed_fixtures():
+    users = [
+        User(name=f'Student {i}', email=f'student{i}@example.com', student_id=f'S-{i}', password_hash='!')
+        for i in range(2)
+    ]
+    db.session.add_all(users)
+    for course_id in (1, 2):
+        db.session.add(Course(id=course_id, title=f'Course {course_id}'))
+    # Items share one id space: labs 1-4, quizzes 5-8, exams 9-12 (course 1 first)
+    for model in (Lab, Quiz, Exam):
+        for n in range(4):
+            db.session.add(model(course_id=1 + n // 2, title=f'{model.__name__} {n % 2}'))
+    db.session.flush()
+    for user in users:
+        db.session.add(Enrollment(user_id=user.id, course_id=1, labs_total=2, quizzes_total=2, exams_total=2))
+    db.session.add(Discussion(course_id=1, user_id=users[0].id, content='Seeded course discussion'))
+    db.session.add(ItemDiscussion(item_id=1, user_id=users[0].id, content='Seeded lab post'))
+    db.session.add(ItemDiscussion(item_id=5, user_id=users[0].id, content='Seeded quiz post'))
+    db.session.add(ItemDiscussion(item_id=9, user_id=users[0].id, content='Seeded exam post'))
+    db.session.commit()
+    return [create_access_token(identity=str(user.id)) for user in users]
+
+def capture_route_statements(app):
+    """Replay every scenario and return {endpoint: [(statement, parameters), ...]}."""
+    captured = {}
+    current = []
+    with app.app_context():
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if not executemany and CHECKED_STATEMENT.match(statement):
+                current.append((statement, parameters))
+
+        tokens = seed_fixtures()
+        client = app.test_client()
+        for endpoint, method, path, body, user in SCENARIOS:
+            current.clear()
+            headers = {'Authorization': f'Bearer {tokens[user]}'} if user is not None else {}
+            response = client.open(path, method=method, json=body, headers=headers)
+            # Streaming bodies (SSE) are not consumed; their queries run before the first byte
+            response.close()
+            # Every scenario is meant to succeed; a rejection only checks the lookups in front of it
+            if not 200 <= response.status_code < 300:
+                raise click.ClickException(f'{endpoint}: {method} {path} returned {response.status_code}')
+            captured[endpoint] = list(current)
+        event.remove(db.engine, 'before_cursor_execute', record)
+    return captured
+
+def full_scans(connection, statement, parameters, tables):
+    """Tables scanned in full by the plan of one statement."""
+    if connection.dialect.name == 'sqlite':
+        plan = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+        details = [row[-1] for row in plan]
+        pattern = SQLITE_SCAN
+    else:
+        connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+        details = [row[0] for row in connection.exec_driver_sql('EXPLAIN ' + statement, parameters)]
+        pattern = POSTGRES_SCAN
+    scanned = set()
+    for detail in details:
+        match = pattern.search(detail)
+        if match and match.group(1) in tables:
+            scanned.add(match.group(1))
+    return scanned, details
+
+def check_query_plans(database_url):
+    """Run the scenarios against ``database_url`` and return a list of problems."""
+    app = create_check_app(database_url)
+    problems = []
+    with app.app_context():
+        upgrade(directory=MIGRATIONS_DIR)
+    expected = {rule.endpoint.split('.', 1)[1] for rule in app.url_map.iter_rules() if rule.endpoint.startswith('api.')}
+    covered = {endpoint for endpoint, *_ in SCENARIOS}
+    for endpoint in sorted(expected - covered - SKIPPED_ENDPOINTS):
+        problems.append(f'{endpoint}: no query plan scenario')
+    captured = capture_route_statements(app)
+    with app.app_context():
+        tables = set(db.metadata.tables)
+        with db.engine.connect() as connection:
+            for endpoint, statements in captured.items():
+                for statement, parameters in statements:
+                    with connection.begin():
+                        scanned, details = full_scans(connection, statement, parameters, tables)
+                    scanned -= ALLOWED_SCANS.get(endpoint, set())
+                    if scanned:
+                        problems.append(
+                            f'{endpoint}: full scan of {", ".join(sorted(scanned))}\n'
+                            f'    {" ".join(statement.split())}\n    ' + '\n    '.join(map(str, details))
+                        )
+    return problems
+
+@click.command('check-query-plans')
+@click.option('--database-url', help='Scratch database to check against (default: a temporary SQLite file).')
+@click.option('--postgres-url', envvar='PLAN_CHECK_POSTGRES_URL', help='Also check against this scratch Postgres database when it is reachable.')
+def check_query_plans_command(database_url, postgres_url):
+    """Fail if any API route's queries fall back to a full table scan."""
+    with tempfile.TemporaryDirectory() as scratch:
+        targets = [database_url or f'sqlite:///{os.path.join(scratch, "plans.db")}']
+        if postgres_url:
+            from sqlalchemy import create_engine
+            try:
+                with create_engine(postgres_url).connect() as connection:
+                    connection.execute(text('SELECT 1'))
+                targets.append(postgres_url)
+            except Exception as e:
+                click.echo(f'Skipping Postgres plan check: {e.__class__.__name__}: {e}')
+        failed = False
+        for url in targets:
+            problems = check_query_plans(url)
+            dialect = url.split(':', 1)[0]
+            if problems:
+                failed = True
+                click.echo(f'[{dialect}] {len(problems)} query plan problem(s):')
+                for problem in problems:
+                    click.echo(f'  {problem}')
+            else:
+                click.echo(f'[{dialect}] All route queries use indexes.')
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,90 @@
+"""Column-only read queries for the GET routes.
+
+Each statement selects just the columns a response needs and is built once, at
+import, with bind parameters: a request skips building the statement and
+computing its cache key, and finds the compiled SQL in SQLAlchemy's statement
+cache. Results are plain Row tuples, so nothing is added to the session's
+identity map and no relationship state is tracked. Use the ORM for writes and
+for anything that needs to modify the rows it reads.
+"""
+from sqlalchemy import and_, bindparam, or_, select
+from models import db, Course, CourseItem, Enrollment, ItemCompletion, User
+
+COURSE_COLUMNS = (Course.id, Course.title, Course.description, Course.instructor_id)
+
+COURSES = select(*COURSE_COLUMNS)
+COURSE = select(*COURSE_COLUMNS).where(Course.id == bindparam('course_id'))
+COURSE_USER_IDS = select(Enrollment.user_id).where(Enrollment.course_id == bindparam('course_id'))
+COURSE_ITEMS = (
+    select(CourseItem.id, CourseItem.item_type, CourseItem.title, CourseItem.description)
+    .where(CourseItem.course_id == bindparam('course_id'))
+    .order_by(CourseItem.id)
+)
+USER_ENROLLMENTS = (
+    select(Enrollment.id, Enrollment.course_id, Enrollment.progress, Enrollment.date_enrolled)
+    .where(Enrollment.user_id == bindparam('user_id'))
+)
+ENROLLMENT_PROGRESS = select(Enrollment.progress).where(
+    Enrollment.user_id == bindparam('user_id'), Enrollment.course_id == bindparam('course_id')
+).limit(1)
+COMPLETED_ITEM_IDS = select(ItemCompletion.item_id).where(
+    ItemCompletion.user_id == bindparam('user_id'),
+    ItemCompletion.is_complete == True,
+    ItemCompletion.item_id.in_(bindparam('item_ids', expanding=True)),
+)
+
+# (model, thread column) -> (first page, page after a cursor)
+_discussion_pages = {}
+
+def discussion_page_statements(model, thread_column):
+    """Keyset page statements for a discussion thread, newest first.
+
+    Rows have ``id``, ``content``, ``user_email`` and ``timestamp``. Parameters:
+    ``thread_id`` and ``limit``, plus ``timestamp`` and ``row_id`` for the page
+    after a cursor.
+    """
+    key = (model, thread_column.key)
+    statements = _discussion_pages.get(key)
+    if statements is None:
+        first = (
+            select(model.id, model.content, User.email.label('user_email'), model.timestamp)
+            .outerjoin(User, User.id == model.user_id)
+            .where(thread_column == bindparam('thread_id'))
+            .order_by(model.timestamp.desc(), model.id.desc())
+            .limit(bindparam('limit'))
+        )
+        after = first.where(or_(
+            model.timestamp < bindparam('timestamp'),
+            and_(model.timestamp == bindparam('timestamp'), model.id < bindparam('row_id')),
+        ))
+        statements = _discussion_pages[key] = (first, after)
+    return statements
+
+def rows(statement, **params):
+    return db.session.execute(statement, params)
+
+def courses():
+    return rows(COURSES)
+
+def course(course_id):
+    return rows(COURSE, course_id=course_id).first()
+
+def course_user_ids(course_id):
+    return rows(COURSE_USER_IDS, course_id=course_id).scalars().all()
+
+def course_items(course_id):
+    return rows(COURSE_ITEMS, course_id=course_id)
+
+def user_enrollments(user_id, yield_per=None):
+    options = {'yield_per': yield_per} if yield_per else {}
+    return db.session.execute(USER_ENROLLMENTS, {'user_id': user_id}, execution_options=options)
+
+def enrollment_progress(user_id, course_id):
+    """The user's progress in the course, or None if not enrolled."""
+    return rows(ENROLLMENT_PROGRESS, user_id=user_id, course_id=course_id).scalar()
+
+def completed_item_ids(user_id, item_ids):
+    """The subset of ``item_ids`` the user has completed, in one query."""
+    if not item_ids:
+        return set()
+    return set(rows(COMPLETED_ITEM_IDS, user_id=user_id, item_ids=list(item_ids)).scalars())
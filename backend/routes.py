@@ -1,12 +1,55 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, current_app, abort
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity, verify_jwt_in_request
-from models import db, User, Course, Enrollment, Discussion, Lab, Quiz, Exam, LabCompletion, QuizCompletion, ExamCompletion, LabDiscussion, QuizDiscussion, ExamDiscussion
-from werkzeug.security import generate_password_hash, check_password_hash
+from models import db, ITEM_TYPES, User, Course, Enrollment, Discussion, CourseItem, ItemDiscussion, LegacyItemId
 from datetime import datetime
+import hmac
+from functools import wraps
+from sqlalchemy import select
 from sqlalchemy.orm import joinedload
+from pagination import InvalidCursor, paginate_discussions
+from cache import content_cache
+from hashing import password_hasher, HashingOverloaded
+from membership import membership
+from events import TooManySubscribers, discussion_events, thread_key
+from cooperative import cooperative
+from metrics import metrics
+from search import search
+from streaming import json_array_response
+import reads
+from catalog import get_catalog, get_course_detail, get_course_items
+from versioning import CATALOG, course_scope, versioned
+from progress import set_completion, course_item_totals, apply_completions
 
 api_bp = Blueprint('api', __name__)
 
+def admin_required(view):
+    """Like ``jwt_required()``, for users whose email is listed in ADMIN_EMAILS."""
+    @wraps(view)
+    @jwt_required()
+    def wrapper(*args, **kwargs):
+        admins = {email.strip().lower() for email in current_app.config['ADMIN_EMAILS'].split(',') if email.strip()}
+        user = db.session.get(User, int(get_jwt_identity()))
+        if user is None or user.email.lower() not in admins:
+            return jsonify({'error': 'Admins only'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+def scraper_or_admin_required(view):
+    """Like ``admin_required``, but also lets in ``Authorization: Bearer <METRICS_TOKEN>``."""
+    admin_view = admin_required(view)
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = current_app.config['METRICS_TOKEN']
+        if token and hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+            return view(*args, **kwargs)
+        return admin_view(*args, **kwargs)
+    return wrapper
+
+def hashing_unavailable():
+    response = jsonify({'error': 'Server busy, please retry'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
 # User signup
 @api_bp.route('/signup', methods=['POST'])
 def signup():
@@ -21,7 +64,10 @@ def signup():
     if User.query.filter((User.email == email) | (User.student_id == student_id)).first():
         return jsonify({'error': 'Email or student ID already exists'}), 400
     user = User(name=name, email=email, student_id=student_id, track=track)
-    user.password_hash = generate_password_hash(password)
+    try:
+        user.password_hash = password_hasher.hash(password)
+    except HashingOverloaded:
+        return hashing_unavailable()
     db.session.add(user)
     db.session.commit()
     return jsonify({'message': 'User created successfully'}), 201
@@ -33,23 +79,55 @@ def login():
     email = data.get('email')
     password = data.get('password')
     user = User.query.filter_by(email=email).first()
-    if not user or not check_password_hash(getattr(user, 'password_hash', ''), password):
-        return jsonify({'error': 'Invalid credentials'}), 401
+    try:
+        if not user or not password_hasher.verify(user.password_hash or '', password):
+            return jsonify({'error': 'Invalid credentials'}), 401
+    except HashingOverloaded:
+        return hashing_unavailable()
+    if password_hasher.needs_rehash(user.password_hash):
+        try:
+            user.password_hash = password_hasher.rehash(password)
+            db.session.commit()
+        except HashingOverloaded:
+            # The old hash still works; upgrade it on a later login
+            pass
     access_token = create_access_token(identity=str(user.id))
     return jsonify({'access_token': access_token, 'user_id': user.id, 'name': user.name, 'student_id': user.student_id}), 200
 
 # List all courses
 @api_bp.route('/courses', methods=['GET'])
+@versioned(lambda: CATALOG)
 def get_courses():
-    courses = Course.query.all()
-    return jsonify([{'id': c.id, 'title': c.title, 'description': c.description, 'instructor_id': c.instructor_id} for c in courses])
+    return json_array_response(get_catalog())
 
 # Get course detail
 @api_bp.route('/courses/<int:course_id>', methods=['GET'])
+@versioned(lambda course_id: course_scope(course_id))
 def get_course(course_id):
-    course = Course.query.get_or_404(course_id)
-    enrolled_users = [e.user_id for e in course.enrollments]
-    return jsonify({'id': course.id, 'title': course.title, 'description': course.description, 'instructor_id': course.instructor_id, 'enrolled_users': enrolled_users})
+    course = get_course_detail(course_id)
+    if course is None:
+        abort(404)
+    return jsonify(course)
+
+# Content and membership cache hit/miss/eviction counters for this worker
+@api_bp.route('/cache/stats', methods=['GET'])
+@admin_required
+def get_cache_stats():
+    return jsonify(dict(content_cache.stats(), membership=membership.stats()))
+
+# Password hashing pool counters and timings for this worker
+@api_bp.route('/hashing/stats', methods=['GET'])
+@admin_required
+def get_hashing_stats():
+    return jsonify(password_hasher.stats())
+
+# Prometheus metrics summed over every worker on this host
+@api_bp.route('/metrics', methods=['GET'])
+@scraper_or_admin_required
+def get_metrics():
+    if not metrics.enabled:
+        abort(404)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 # Enroll user in course
 @api_bp.route('/enrollments', methods=['POST'])
@@ -63,17 +141,20 @@ def enroll():
     if Enrollment.query.filter_by(user_id=user_id, course_id=course_id).first():
         return jsonify({'error': 'Already enrolled'}), 400
     enrollment = Enrollment(user_id=user_id, course_id=course_id, progress=0)
+    for item_type, total in course_item_totals(course_id).items():
+        setattr(enrollment, f'{item_type}_total', total)
     db.session.add(enrollment)
     db.session.commit()
+    membership.invalidate_user(user_id)
     return jsonify({'message': 'Enrolled successfully'}), 201
 
 # Get user enrollments
 @api_bp.route('/enrollments/<int:user_id>', methods=['GET'])
 def get_enrollments(user_id):
-    enrollments = Enrollment.query.filter_by(user_id=user_id).all()
-    return jsonify([
-        {'id': e.id, 'course_id': e.course_id, 'progress': e.progress, 'date_enrolled': e.date_enrolled.isoformat() if e.date_enrolled else None} for e in enrollments
-    ])
+    enrollments = reads.user_enrollments(user_id, yield_per=current_app.config['JSON_STREAM_YIELD_PER'])
+    return json_array_response(enrollments, lambda e: {
+        'id': e.id, 'course_id': e.course_id, 'progress': e.progress, 'date_enrolled': e.date_enrolled.isoformat() if e.date_enrolled else None
+    })
 
 # Create new discussion in courses
 @api_bp.route('/discussions', methods=['POST'])
@@ -90,13 +171,28 @@ def create_discussion():
     db.session.commit()
     return jsonify({'message': 'Discussion created'}), 201
 
+def discussion_json(d):
+    return {'id': d.id, 'content': d.content, 'user_email': d.user.email if d.user else None, 'timestamp': d.timestamp.isoformat()}
+
+def discussion_row_json(r):
+    # Same shape as discussion_json, from a reads.discussion_page_statements row
+    return {'id': r.id, 'content': r.content, 'user_email': r.user_email, 'timestamp': r.timestamp.isoformat()}
+
+def discussion_page(model, thread_column, thread_id):
+    """One page of a discussion thread; the next page's cursor goes in X-Next-Cursor."""
+    try:
+        discussions, next_cursor = paginate_discussions(model, thread_column, thread_id)
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    response = json_array_response(discussions, discussion_row_json)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
 # Get discussions for a course
 @api_bp.route('/discussions/<int:course_id>', methods=['GET'])
 def get_discussions(course_id):
-    discussions = Discussion.query.options(joinedload(Discussion.user)).filter_by(course_id=course_id).order_by(Discussion.timestamp.desc()).all()
-    return jsonify([
-        {'id': d.id, 'content': d.content, 'user_email': d.user.email if d.user else None, 'timestamp': d.timestamp.isoformat()} for d in discussions
-    ])
+    return discussion_page(Discussion, Discussion.course_id, course_id)
 
 # Update discussion
 @api_bp.route('/discussions/<int:discussion_id>', methods=['PUT'])
@@ -105,7 +201,7 @@ def update_discussion(discussion_id):
     data = request.get_json()
     user_id = get_jwt_identity()
     discussion = Discussion.query.get_or_404(discussion_id)
-    if discussion.user_id != user_id:
+    if discussion.user_id != int(user_id):
         return jsonify({'error': 'Unauthorized'}), 403
     content = data.get('content')
     if not content or len(content) < 15:
@@ -120,237 +216,197 @@ def update_discussion(discussion_id):
 def delete_discussion(discussion_id):
     user_id = get_jwt_identity()
     discussion = Discussion.query.get_or_404(discussion_id)
-    if discussion.user_id != user_id:
+    if discussion.user_id != int(user_id):
         return jsonify({'error': 'Unauthorized'}), 403
     db.session.delete(discussion)
     db.session.commit()
     return jsonify({'message': 'Discussion deleted'})
 
-# Fetch labs for a course (with completion status)
-@api_bp.route('/courses/<int:course_id>/labs', methods=['GET'])
-@jwt_required()
-def get_labs(course_id):
-    user_id = get_jwt_identity()
-    labs = Lab.query.filter_by(course_id=course_id).all()
-    completions = {c.lab_id: c.is_complete for c in LabCompletion.query.filter_by(user_id=user_id).all()}
-    return jsonify([
-        {
-            'id': lab.id,
-            'title': lab.title,
-            'description': lab.description,
-            'is_complete': completions.get(lab.id, False)
-        } for lab in labs
-    ])
-
-# Fetch quizzes for a course (with completion status)
-@api_bp.route('/courses/<int:course_id>/quizzes', methods=['GET'])
-@jwt_required()
-def get_quizzes(course_id):
-    user_id = get_jwt_identity()
-    quizzes = Quiz.query.filter_by(course_id=course_id).all()
-    completions = {c.quiz_id: c.is_complete for c in QuizCompletion.query.filter_by(user_id=user_id).all()}
-    return jsonify([
-        {
-            'id': quiz.id,
-            'title': quiz.title,
-            'description': quiz.description,
-            'is_complete': completions.get(quiz.id, False)
-        } for quiz in quizzes
-    ])
-
-# Fetch exams for a course (with completion status)
-@api_bp.route('/courses/<int:course_id>/exams', methods=['GET'])
-@jwt_required()
-def get_exams(course_id):
-    user_id = get_jwt_identity()
-    exams = Exam.query.filter_by(course_id=course_id).all()
-    completions = {c.exam_id: c.is_complete for c in ExamCompletion.query.filter_by(user_id=user_id).all()}
-    return jsonify([
-        {
-            'id': exam.id,
-            'title': exam.title,
-            'description': exam.description,
-            'is_complete': completions.get(exam.id, False)
-        } for exam in exams
-    ])
-
-def recalculate_progress(user_id, course_id):
-    total_labs = Lab.query.filter_by(course_id=course_id).count()
-    total_quizzes = Quiz.query.filter_by(course_id=course_id).count()
-    total_exams = Exam.query.filter_by(course_id=course_id).count()
-    completed_labs = LabCompletion.query.join(Lab).filter(Lab.course_id==course_id, LabCompletion.user_id==user_id, LabCompletion.is_complete==True).count()
-    completed_quizzes = QuizCompletion.query.join(Quiz).filter(Quiz.course_id==course_id, QuizCompletion.user_id==user_id, QuizCompletion.is_complete==True).count()
-    completed_exams = ExamCompletion.query.join(Exam).filter(Exam.course_id==course_id, ExamCompletion.user_id==user_id, ExamCompletion.is_complete==True).count()
-    total_items = total_labs + total_quizzes + total_exams
-    completed_items = completed_labs + completed_quizzes + completed_exams
-    progress = int((completed_items / total_items) * 100) if total_items > 0 else 0
-    enrollment = Enrollment.query.filter_by(user_id=user_id, course_id=course_id).first()
-    if enrollment:
-        enrollment.progress = progress
-        db.session.commit()
-
-# Mark lab as complete/incomplete
-@api_bp.route('/labs/<int:lab_id>/completion', methods=['POST'])
+# Fetch everything the course workspace page needs in one response
+@api_bp.route('/courses/<int:course_id>/workspace', methods=['GET'])
 @jwt_required()
-def set_lab_completion(lab_id):
+def get_workspace(course_id):
     user_id = get_jwt_identity()
-    data = request.get_json()
-    is_complete = data.get('is_complete', True)
-    completion = LabCompletion.query.filter_by(user_id=user_id, lab_id=lab_id).first()
-    if not completion:
-        completion = LabCompletion(user_id=user_id, lab_id=lab_id, is_complete=is_complete)
-        db.session.add(completion)
-    else:
-        completion.is_complete = is_complete
-    db.session.commit()
-    # Update progress
-    lab = Lab.query.get(lab_id)
-    if lab:
-        recalculate_progress(user_id, lab.course_id)
-    return jsonify({'message': 'Lab completion updated'})
-
-# Mark quiz as complete/incomplete
-@api_bp.route('/quizzes/<int:quiz_id>/completion', methods=['POST'])
+    items = get_course_items(course_id)
+    completed = reads.completed_item_ids(user_id, [item['id'] for entries in items.values() for item in entries])
+    workspace = {
+        item_type: [dict(item, is_complete=item['id'] in completed) for item in entries]
+        for item_type, entries in items.items()
+    }
+    return jsonify({
+        'course_id': course_id,
+        'labs': workspace['labs'],
+        'quizzes': workspace['quizzes'],
+        'exams': workspace['exams'],
+        'totals': {
+            item_type: {'total': len(entries), 'completed': sum(1 for e in entries if e['is_complete'])}
+            for item_type, entries in workspace.items()
+        },
+        'progress': reads.enrollment_progress(user_id, course_id)
+    })
+
+# Apply several completion changes in one request
+@api_bp.route('/completions:batch', methods=['POST'])
 @jwt_required()
-def set_quiz_completion(quiz_id):
+def batch_completions():
     user_id = get_jwt_identity()
     data = request.get_json()
-    is_complete = data.get('is_complete', True)
-    completion = QuizCompletion.query.filter_by(user_id=user_id, quiz_id=quiz_id).first()
-    if not completion:
-        completion = QuizCompletion(user_id=user_id, quiz_id=quiz_id, is_complete=is_complete)
-        db.session.add(completion)
-    else:
-        completion.is_complete = is_complete
+    items = data.get('completions') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Missing completions'}), 400
+    if len(items) > current_app.config['COMPLETION_BATCH_LIMIT']:
+        return jsonify({'error': 'Too many completions in one batch'}), 400
+    entries = []
+    for item in items:
+        if not (
+            isinstance(item, dict) and item.get('type') in ITEM_TYPES
+            and isinstance(item.get('id'), int) and not isinstance(item['id'], bool)
+            and isinstance(item.get('is_complete', True), bool)
+        ):
+            return jsonify({'error': 'Invalid completion entry'}), 400
+        entries.append((item['type'], item['id'], item.get('is_complete', True)))
+    try:
+        updated, course_ids = apply_batch(user_id, entries)
+    except LookupError as e:
+        db.session.rollback()
+        return jsonify({'error': 'Unknown items', 'items': [{'type': t, 'id': i} for t, i in e.args[0]]}), 404
     db.session.commit()
-    # Update progress
-    quiz = Quiz.query.get(quiz_id)
-    if quiz:
-        recalculate_progress(user_id, quiz.course_id)
-    return jsonify({'message': 'Quiz completion updated'})
-
-# Mark exam as complete/incomplete
-@api_bp.route('/exams/<int:exam_id>/completion', methods=['POST'])
+    progress = Enrollment.query.with_entities(Enrollment.course_id, Enrollment.progress).filter(
+        Enrollment.user_id == user_id, Enrollment.course_id.in_(course_ids)
+    ).all()
+    return jsonify({
+        'message': 'Completions updated',
+        'updated': updated,
+        'progress': {str(course_id): value for course_id, value in progress}
+    })
+
+def apply_batch(user_id, entries):
+    """``apply_completions``, retried once with the current ids of renumbered quizzes and exams."""
+    try:
+        return apply_completions(user_id, entries)
+    except LookupError as e:
+        renamed = renamed_item_ids(e.args[0])
+        if not renamed:
+            raise
+    return apply_completions(user_id, [(t, renamed.get((t, i), i), state) for t, i, state in entries])
+
+# Ranked full-text search over the user's enrolled courses. Paginated like
+# discussions: pass the X-Next-Cursor header value back as ``cursor``.
+@api_bp.route('/search', methods=['GET'])
 @jwt_required()
-def set_exam_completion(exam_id):
+def search_content():
     user_id = get_jwt_identity()
-    data = request.get_json()
-    is_complete = data.get('is_complete', True)
-    completion = ExamCompletion.query.filter_by(user_id=user_id, exam_id=exam_id).first()
-    if not completion:
-        completion = ExamCompletion(user_id=user_id, exam_id=exam_id, is_complete=is_complete)
-        db.session.add(completion)
-    else:
-        completion.is_complete = is_complete
-    db.session.commit()
-    # Update progress
-    exam = Exam.query.get(exam_id)
-    if exam:
-        recalculate_progress(user_id, exam.course_id)
-    return jsonify({'message': 'Exam completion updated'})
-
-def user_enrolled_in_course(user_id, course_id):
-    from models import Enrollment
-    return Enrollment.query.filter_by(user_id=user_id, course_id=course_id).first() is not None
-
-# Update LabDiscussion GET/POST endpoints
-def get_lab_course_id(lab_id):
-    lab = Lab.query.get(lab_id)
-    return lab.course_id if lab else None
-
-@api_bp.route('/labs/<int:lab_id>/discussions', methods=['GET'])
-@jwt_required()
-def get_lab_discussions(lab_id):
-    user_id = get_jwt_identity()
-    course_id = get_lab_course_id(lab_id)
-    if not user_enrolled_in_course(user_id, course_id):
-        return jsonify({'error': 'Not enrolled in this course'}), 403
-    discussions = LabDiscussion.query.options(joinedload(LabDiscussion.user)).filter_by(lab_id=lab_id).order_by(LabDiscussion.timestamp.desc()).all()
-    return jsonify([
-        {'id': d.id, 'content': d.content, 'user_email': d.user.email if d.user else None, 'timestamp': d.timestamp.isoformat()} for d in discussions
-    ])
-
-@api_bp.route('/labs/<int:lab_id>/discussions', methods=['POST'])
-@jwt_required()
-def create_lab_discussion(lab_id):
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Missing q'}), 400
+    limit = request.args.get('limit', current_app.config['SEARCH_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, current_app.config['SEARCH_MAX_PAGE_SIZE']))
+    offset = request.args.get('cursor', 0, type=int)
+    if offset < 0:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    results = search(query, membership.enrolled_course_ids(user_id), limit + 1, offset)
+    response = jsonify(results[:limit])
+    if len(results) > limit:
+        response.headers['X-Next-Cursor'] = str(offset + limit)
+    return response
+
+# Quizzes, exams and their discussions got new ids when the item tables were
+# merged. Old ids never clash with current ones, so lookups that miss retry
+# with the current id of an old one and old URLs keep working.
+def current_ids(kind, ids):
+    """{old id: current id} for the ``ids`` of ``kind`` (see LegacyItemId) that were renumbered."""
+    return dict(db.session.execute(
+        select(LegacyItemId.legacy_id, LegacyItemId.new_id).where(LegacyItemId.kind == kind, LegacyItemId.legacy_id.in_(ids))
+    ).all())
+
+def renamed_item_ids(items):
+    """{(item_type, old id): current id} for the renumbered items among ``(item_type, id)`` pairs."""
+    renamed = {}
+    for item_type in sorted({item_type for item_type, _ in items}):
+        ids = [item_id for t, item_id in items if t == item_type]
+        for old_id, new_id in current_ids(ITEM_TYPES[item_type], ids).items():
+            renamed[item_type, old_id] = new_id
+    return renamed
+
+def find_item(item_type, item_id):
+    """(current id, course id) of a lab, quiz or exam; the course id is None if there is no such item."""
+    course_id = membership.item_course_id(item_type, item_id)
+    if course_id is None:
+        new_id = renamed_item_ids([(item_type, item_id)]).get((item_type, item_id))
+        if new_id is not None:
+            return new_id, membership.item_course_id(item_type, new_id)
+    return item_id, course_id
+
+def get_item_discussion_or_404(item_type, discussion_id):
+    def find(discussion_id):
+        return ItemDiscussion.query.join(ItemDiscussion.item).filter(
+            ItemDiscussion.id == discussion_id, CourseItem.item_type == ITEM_TYPES[item_type]
+        ).first()
+
+    discussion = find(discussion_id)
+    if discussion is None:
+        new_id = current_ids(f'{ITEM_TYPES[item_type]}_discussion', [discussion_id]).get(discussion_id)
+        discussion = find(new_id) if new_id is not None else None
+    if discussion is None:
+        abort(404)
+    return discussion
+
+# Labs, quizzes and exams share one set of views over CourseItem; the per-type
+# URLs below keep the routes (and endpoint names) the frontend already uses.
+# URL segment -> (singular used in endpoint and discussion URLs, label for messages)
+ITEM_ROUTES = {
+    'labs': ('lab', 'Lab'),
+    'quizzes': ('quiz', 'Quiz'),
+    'exams': ('exam', 'Exam'),
+}
+
+# Fetch the labs, quizzes or exams of a course (with completion status)
+def get_course_items_of_type(item_type, course_id):
     user_id = get_jwt_identity()
-    course_id = get_lab_course_id(lab_id)
-    if not user_enrolled_in_course(user_id, course_id):
-        return jsonify({'error': 'Not enrolled in this course'}), 403
-    data = request.get_json()
-    content = data.get('content')
-    if not content or len(content) < 5:
-        return jsonify({'error': 'Content too short'}), 400
-    discussion = LabDiscussion(lab_id=lab_id, user_id=user_id, content=content)
-    db.session.add(discussion)
-    db.session.commit()
-    return jsonify({'message': 'Lab discussion created'})
+    items = get_course_items(course_id)[item_type]
+    completed = reads.completed_item_ids(user_id, [item['id'] for item in items])
+    return json_array_response(items, lambda item: dict(item, is_complete=item['id'] in completed))
 
-@api_bp.route('/lab-discussions/<int:discussion_id>', methods=['PUT'])
-@jwt_required()
-def update_lab_discussion(discussion_id):
+# Mark a lab, quiz or exam as complete/incomplete
+def set_item_completion(item_type, item_id):
+    label = ITEM_ROUTES[item_type][1]
     user_id = get_jwt_identity()
-    discussion = LabDiscussion.query.get_or_404(discussion_id)
-    if discussion.user_id != user_id:
-        return jsonify({'error': 'Unauthorized'}), 403
-    data = request.get_json()
-    content = data.get('content')
-    if not content or len(content) < 5:
-        return jsonify({'error': 'Content too short'}), 400
-    discussion.content = content
+    is_complete = request.get_json().get('is_complete', True)
+    if not isinstance(is_complete, bool):
+        return jsonify({'error': 'is_complete must be true or false'}), 400
+    if set_completion(user_id, item_type, item_id, is_complete) is None:
+        new_id = renamed_item_ids([(item_type, item_id)]).get((item_type, item_id))
+        if new_id is None or set_completion(user_id, item_type, new_id, is_complete) is None:
+            return jsonify({'error': f'{label} not found'}), 404
     db.session.commit()
-    return jsonify({'message': 'Lab discussion updated'})
+    return jsonify({'message': f'{label} completion updated'})
 
-@api_bp.route('/lab-discussions/<int:discussion_id>', methods=['DELETE'])
-@jwt_required()
-def delete_lab_discussion(discussion_id):
+def get_item_discussions(item_type, item_id):
     user_id = get_jwt_identity()
-    discussion = LabDiscussion.query.get_or_404(discussion_id)
-    if discussion.user_id != user_id:
-        return jsonify({'error': 'Unauthorized'}), 403
-    db.session.delete(discussion)
-    db.session.commit()
-    return jsonify({'message': 'Lab discussion deleted'})
-
-# Update QuizDiscussion GET/POST endpoints
-def get_quiz_course_id(quiz_id):
-    quiz = Quiz.query.get(quiz_id)
-    return quiz.course_id if quiz else None
-
-@api_bp.route('/quizzes/<int:quiz_id>/discussions', methods=['GET'])
-@jwt_required()
-def get_quiz_discussions(quiz_id):
-    user_id = get_jwt_identity()
-    course_id = get_quiz_course_id(quiz_id)
-    if not user_enrolled_in_course(user_id, course_id):
+    item_id, course_id = find_item(item_type, item_id)
+    if not membership.is_enrolled(user_id, course_id):
         return jsonify({'error': 'Not enrolled in this course'}), 403
-    discussions = QuizDiscussion.query.options(joinedload(QuizDiscussion.user)).filter_by(quiz_id=quiz_id).order_by(QuizDiscussion.timestamp.desc()).all()
-    return jsonify([
-        {'id': d.id, 'content': d.content, 'user_email': d.user.email if d.user else None, 'timestamp': d.timestamp.isoformat()} for d in discussions
-    ])
+    return discussion_page(ItemDiscussion, ItemDiscussion.item_id, item_id)
 
-@api_bp.route('/quizzes/<int:quiz_id>/discussions', methods=['POST'])
-@jwt_required()
-def create_quiz_discussion(quiz_id):
+def create_item_discussion(item_type, item_id):
     user_id = get_jwt_identity()
-    course_id = get_quiz_course_id(quiz_id)
-    if not user_enrolled_in_course(user_id, course_id):
+    item_id, course_id = find_item(item_type, item_id)
+    if not membership.is_enrolled(user_id, course_id):
         return jsonify({'error': 'Not enrolled in this course'}), 403
     data = request.get_json()
     content = data.get('content')
     if not content or len(content) < 5:
         return jsonify({'error': 'Content too short'}), 400
-    discussion = QuizDiscussion(quiz_id=quiz_id, user_id=user_id, content=content)
+    discussion = ItemDiscussion(item_id=item_id, user_id=user_id, content=content)
     db.session.add(discussion)
     db.session.commit()
-    return jsonify({'message': 'Quiz discussion created'})
+    discussion_events.publish(thread_key(item_type, item_id), 'created', discussion_json(discussion))
+    return jsonify({'message': f'{ITEM_ROUTES[item_type][1]} discussion created'})
 
-@api_bp.route('/quiz-discussions/<int:discussion_id>', methods=['PUT'])
-@jwt_required()
-def update_quiz_discussion(discussion_id):
+def update_item_discussion(item_type, discussion_id):
     user_id = get_jwt_identity()
-    discussion = QuizDiscussion.query.get_or_404(discussion_id)
-    if discussion.user_id != user_id:
+    discussion = get_item_discussion_or_404(item_type, discussion_id)
+    if discussion.user_id != int(user_id):
         return jsonify({'error': 'Unauthorized'}), 403
     data = request.get_json()
     content = data.get('content')
@@ -358,74 +414,75 @@ def update_quiz_discussion(discussion_id):
         return jsonify({'error': 'Content too short'}), 400
     discussion.content = content
     db.session.commit()
-    return jsonify({'message': 'Quiz discussion updated'})
+    discussion_events.publish(thread_key(item_type, discussion.item_id), 'updated', discussion_json(discussion))
+    return jsonify({'message': f'{ITEM_ROUTES[item_type][1]} discussion updated'})
 
-@api_bp.route('/quiz-discussions/<int:discussion_id>', methods=['DELETE'])
-@jwt_required()
-def delete_quiz_discussion(discussion_id):
+def delete_item_discussion(item_type, discussion_id):
     user_id = get_jwt_identity()
-    discussion = QuizDiscussion.query.get_or_404(discussion_id)
-    if discussion.user_id != user_id:
+    discussion = get_item_discussion_or_404(item_type, discussion_id)
+    if discussion.user_id != int(user_id):
         return jsonify({'error': 'Unauthorized'}), 403
+    thread = thread_key(item_type, discussion.item_id)
     db.session.delete(discussion)
     db.session.commit()
-    return jsonify({'message': 'Quiz discussion deleted'})
-
-# Update ExamDiscussion GET/POST endpoints
-def get_exam_course_id(exam_id):
-    exam = Exam.query.get(exam_id)
-    return exam.course_id if exam else None
+    discussion_events.publish(thread, 'deleted', {'id': discussion.id})
+    return jsonify({'message': f'{ITEM_ROUTES[item_type][1]} discussion deleted'})
 
-@api_bp.route('/exams/<int:exam_id>/discussions', methods=['GET'])
-@jwt_required()
-def get_exam_discussions(exam_id):
+# Short-lived token for one item's discussion stream; EventSource cannot send
+# the Authorization header, and access tokens must not end up in URLs and logs
+def create_stream_token(item_type, item_id):
     user_id = get_jwt_identity()
-    course_id = get_exam_course_id(exam_id)
-    if not user_enrolled_in_course(user_id, course_id):
+    item_id, course_id = find_item(item_type, item_id)
+    if not membership.is_enrolled(user_id, course_id):
         return jsonify({'error': 'Not enrolled in this course'}), 403
-    discussions = ExamDiscussion.query.options(joinedload(ExamDiscussion.user)).filter_by(exam_id=exam_id).order_by(ExamDiscussion.timestamp.desc()).all()
-    return jsonify([
-        {'id': d.id, 'content': d.content, 'user_email': d.user.email if d.user else None, 'timestamp': d.timestamp.isoformat()} for d in discussions
-    ])
-
-@api_bp.route('/exams/<int:exam_id>/discussions', methods=['POST'])
-@jwt_required()
-def create_exam_discussion(exam_id):
-    user_id = get_jwt_identity()
-    course_id = get_exam_course_id(exam_id)
-    if not user_enrolled_in_course(user_id, course_id):
+    token = discussion_events.stream_token(user_id, thread_key(item_type, item_id))
+    return jsonify({'token': token, 'expires_in': discussion_events.token_ttl})
+
+# Live created/updated/deleted events for one item's discussion thread (SSE),
+# authenticated with ?token= from the stream-token route
+def stream_item_discussions(item_type, item_id):
+    item_id, course_id = find_item(item_type, item_id)
+    user_id = discussion_events.stream_user(request.args.get('token', ''), thread_key(item_type, item_id))
+    if user_id is None:
+        return jsonify({'error': 'Invalid or expired stream token'}), 401
+    if not membership.is_enrolled(user_id, course_id):
         return jsonify({'error': 'Not enrolled in this course'}), 403
-    data = request.get_json()
-    content = data.get('content')
-    if not content or len(content) < 5:
-        return jsonify({'error': 'Content too short'}), 400
-    discussion = ExamDiscussion(exam_id=exam_id, user_id=user_id, content=content)
-    db.session.add(discussion)
-    db.session.commit()
-    return jsonify({'message': 'Exam discussion created'})
-
-@api_bp.route('/exam-discussions/<int:discussion_id>', methods=['PUT'])
-@jwt_required()
-def update_exam_discussion(discussion_id):
-    user_id = get_jwt_identity()
-    discussion = ExamDiscussion.query.get_or_404(discussion_id)
-    if discussion.user_id != user_id:
-        return jsonify({'error': 'Unauthorized'}), 403
-    data = request.get_json()
-    content = data.get('content')
-    if not content or len(content) < 5:
-        return jsonify({'error': 'Content too short'}), 400
-    discussion.content = content
-    db.session.commit()
-    return jsonify({'message': 'Exam discussion updated'})
-
-@api_bp.route('/exam-discussions/<int:discussion_id>', methods=['DELETE'])
-@jwt_required()
-def delete_exam_discussion(discussion_id):
-    user_id = get_jwt_identity()
-    discussion = ExamDiscussion.query.get_or_404(discussion_id)
-    if discussion.user_id != user_id:
-        return jsonify({'error': 'Unauthorized'}), 403
-    db.session.delete(discussion)
-    db.session.commit()
-    return jsonify({'message': 'Exam discussion deleted'}) 
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        subscription = discussion_events.subscribe(
+            thread_key(item_type, item_id), int(last_event_id) if last_event_id else None
+        )
+    except ValueError:
+        return jsonify({'error': 'Invalid Last-Event-ID'}), 400
+    except TooManySubscribers:
+        response = jsonify({'error': 'Too many live connections, please retry'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    return Response(
+        discussion_events.stream(subscription),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+for item_type, (singular, _) in ITEM_ROUTES.items():
+    defaults = {'item_type': item_type}
+    rules = [
+        (f'/courses/<int:course_id>/{item_type}', f'get_{item_type}', get_course_items_of_type, ['GET']),
+        (f'/{item_type}/<int:item_id>/completion', f'set_{singular}_completion', set_item_completion, ['POST']),
+        (f'/{item_type}/<int:item_id>/discussions', f'get_{singular}_discussions', get_item_discussions, ['GET']),
+        (f'/{item_type}/<int:item_id>/discussions', f'create_{singular}_discussion', create_item_discussion, ['POST']),
+        (f'/{singular}-discussions/<int:discussion_id>', f'update_{singular}_discussion', update_item_discussion, ['PUT']),
+        (f'/{singular}-discussions/<int:discussion_id>', f'delete_{singular}_discussion', delete_item_discussion, ['DELETE']),
+    ]
+    # A stream holds its request open, so a few viewers would use up sync workers;
+    # without these routes the frontend polls instead
+    if cooperative.enabled:
+        rules += [
+            (f'/{item_type}/<int:item_id>/discussions/stream-token', f'create_{singular}_stream_token', create_stream_token, ['POST']),
+            (f'/{item_type}/<int:item_id>/discussions/stream', f'stream_{singular}_discussions', stream_item_discussions, ['GET']),
+        ]
+    for rule, endpoint, view, methods in rules:
+        # The stream checks its own token
+        if view is not stream_item_discussions:
+            view = jwt_required()(view)
+        api_bp.add_url_rule(rule, endpoint, view, methods=methods, defaults=defaults)
@@ -0,0 +1,224 @@
+"""Read/write splitting between the primary database and read replicas.
+
+DATABASE_REPLICA_URLS (comma separated) adds one Flask-SQLAlchemy bind per
+replica (``replica0``, ``replica1``, ...), each with its own pool of
+REPLICA_POOL_SIZE connections plus REPLICA_MAX_OVERFLOW. ``RoutingSession``
+sends a statement to a replica only when all of these hold; everything else
+goes to the primary (``SQLALCHEMY_DATABASE_URI``):
+
+- the request is a GET or HEAD on ``api_bp``;
+- the requesting user has not written in the last READ_AFTER_WRITE_SECONDS,
+  so users read their own writes even if a replica lags;
+- the statement is a SELECT and the session has not written in this request;
+- a replica is healthy. A replica whose connection fails is skipped for
+  REPLICA_RETRY_SECONDS, then tried again.
+
+Users who wrote are remembered in this worker and in the shared store named
+by CACHE_L2_URL, so other workers send them to the primary too. Cached
+catalog and course entries are always loaded from the primary (catalog.py),
+so replica lag is never written into the shared cache.
+
+To try it locally, copy the SQLite database and point a replica at the copy,
+e.g. ``sqlite3 instance/app.db ".backup instance/replica.db"`` and
+``DATABASE_REPLICA_URLS=sqlite:///replica.db``, or use two Postgres servers
+with streaming replication.
+"""
+import hashlib
+import logging
+import random
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.sql.elements import TextClause
+from cache import create_backend
+
+logger = logging.getLogger(__name__)
+
+READ_METHODS = ('GET', 'HEAD')
+
+class ReadRouting:
+    def __init__(self):
+        self.replicas = []
+        self.sticky_seconds = 5
+        self.retry_seconds = 30
+        self.store = None
+        # bind key -> time.monotonic() until which it is skipped
+        self._down = {}
+        # user id -> time.time() until which reads go to the primary
+        self._sticky = {}
+        self._lock = threading.Lock()
+        self._watched = weakref.WeakSet()
+        self.counters = dict.fromkeys(('replica_reads', 'primary_reads', 'writes', 'replica_failures', 'fallbacks'), 0)
+
+    def init_app(self, app):
+        """Add the replica binds; call before ``db.init_app``."""
+        urls = [url.strip() for url in app.config['DATABASE_REPLICA_URLS'].split(',') if url.strip()]
+        self.replicas = [f'replica{n}' for n in range(len(urls))]
+        binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+        for key, url in zip(self.replicas, urls):
+            binds[key] = {
+                'url': url,
+                'pool_size': app.config['REPLICA_POOL_SIZE'],
+                'max_overflow': app.config['REPLICA_MAX_OVERFLOW'],
+                'pool_pre_ping': True,
+            }
+        self.sticky_seconds = app.config['READ_AFTER_WRITE_SECONDS']
+        self.retry_seconds = app.config['REPLICA_RETRY_SECONDS']
+        namespace = hashlib.sha1(app.config['SQLALCHEMY_DATABASE_URI'].encode()).hexdigest()[:12]
+        self.store = create_backend(app.config['CACHE_L2_URL'], namespace + '-sticky') if self.replicas else None
+        app.extensions['read_routing'] = self
+        if self.replicas:
+            app.before_request(self._before_request)
+            app.after_request(self._after_request)
+
+    def _user_id(self):
+        try:
+            verify_jwt_in_request(optional=True)
+            return get_jwt_identity()
+        except Exception:
+            return None
+
+    def _before_request(self):
+        g._read_replica = (
+            request.blueprint == 'api' and request.method in READ_METHODS
+            and not self._is_sticky(self._user_id())
+        )
+
+    def _after_request(self, response):
+        from models import db
+        if db.session.info.get('wrote'):
+            self.mark_written(self._user_id())
+        return response
+
+    def _is_sticky(self, user_id):
+        if user_id is None:
+            return False
+        until = self._sticky.get(user_id, 0)
+        if until < time.time() and self.store is not None:
+            try:
+                found, value = self.store.get(f'sticky:{user_id}')
+            except Exception:
+                logger.warning('Could not read read-after-write marker', exc_info=True)
+                found = False
+            if found:
+                until = value
+                self._sticky[user_id] = until
+        return until >= time.time()
+
+    def mark_written(self, user_id):
+        """Send ``user_id``'s reads to the primary for READ_AFTER_WRITE_SECONDS."""
+        if user_id is None or self.sticky_seconds <= 0:
+            return
+        until = time.time() + self.sticky_seconds
+        with self._lock:
+            self._sticky[user_id] = until
+            # Forget expired users now and then
+            if len(self._sticky) > 10000:
+                now = time.time()
+                self._sticky = {u: t for u, t in self._sticky.items() if t >= now}
+        if self.store is not None:
+            try:
+                self.store.set(f'sticky:{user_id}', until, self.sticky_seconds)
+            except Exception:
+                logger.warning('Could not share read-after-write marker', exc_info=True)
+
+    def healthy_replica(self):
+        """Bind key of a healthy replica, chosen at random, or None."""
+        now = time.monotonic()
+        healthy = [key for key in self.replicas if self._down.get(key, 0) <= now]
+        if not healthy:
+            self.counters['fallbacks'] += 1
+            return None
+        return random.choice(healthy)
+
+    def mark_down(self, key):
+        now = time.monotonic()
+        if self._down.get(key, 0) <= now:
+            logger.warning('Read replica %s failed; using the primary for %.0f s', key, self.retry_seconds)
+            self.counters['replica_failures'] += 1
+        self._down[key] = now + self.retry_seconds
+
+    def watch(self, engines):
+        """Mark a replica down when one of its connections fails."""
+        for key in self.replicas:
+            engine = engines[key]
+            if engine in self._watched:
+                continue
+
+            def handle_error(context, key=key):
+                if context.is_disconnect or isinstance(context.original_exception, context.dialect.loaded_dbapi.OperationalError):
+                    self.mark_down(key)
+
+            event.listen(engine, 'handle_error', handle_error)
+            self._watched.add(engine)
+
+    def wants_replica(self, session):
+        if not has_request_context() or not g.get('_read_replica'):
+            return False
+        return not (session.info.get('wrote') or session.info.get('primary'))
+
+    @contextmanager
+    def primary(self):
+        """Read from the primary inside the block."""
+        from models import db
+        info = db.session.info
+        previous = info.get('primary', False)
+        info['primary'] = True
+        try:
+            yield
+        finally:
+            info['primary'] = previous
+
+read_routing = ReadRouting()
+
+def is_read(clause):
+    if isinstance(clause, TextClause):
+        return clause.text.lstrip()[:6].upper() == 'SELECT'
+    return bool(getattr(clause, 'is_select', False))
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that sends request reads to a replica (see ``read_routing``)."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and read_routing.replicas:
+            if self._flushing or (clause is not None and not is_read(clause)):
+                # Later reads in this request must see the write
+                self.info['wrote'] = True
+                read_routing.counters['writes'] += 1
+            elif clause is not None and read_routing.wants_replica(self):
+                engine = self._replica()
+                if engine is not None:
+                    read_routing.counters['replica_reads'] += 1
+                    return engine
+                read_routing.counters['primary_reads'] += 1
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+    def _replica(self):
+        """The replica engine this session reads from, or None to use the primary.
+
+        A session sticks to one replica so a request reads one consistent
+        snapshot. Its connection is opened here, so a replica that is down
+        sends the request to the primary instead of failing it.
+        """
+        engines = self._db.engines
+        key = self.info.get('replica')
+        if key is not None:
+            return engines[key]
+        key = read_routing.healthy_replica()
+        if key is None:
+            return None
+        read_routing.watch(engines)
+        try:
+            self.connection(bind_arguments={'bind': engines[key]})
+        except DBAPIError:
+            read_routing.mark_down(key)
+            read_routing.counters['fallbacks'] += 1
+            return None
+        self.info['replica'] = key
+        return engines[key]
@@ -0,0 +1,112 @@
+"""Ranked full-text search over courses, course items and discussions.
+
+Backed by the indexes from migration b3d6a0f58e21: the ``search_index`` FTS5
+table on SQLite, generated ``search_vector`` columns with GIN indexes on
+Postgres. Results are limited to the courses the user is enrolled in.
+"""
+import re
+from flask import current_app
+from sqlalchemy import bindparam, text
+from models import db, ITEM_TYPES
+
+# Order of the kinds matches the rowid encoding in the SQLite index (rowid % 4)
+KINDS = ('course', 'item', 'discussion', 'item_discussion')
+SEGMENTS = {discriminator: item_type for item_type, discriminator in ITEM_TYPES.items()}
+
+# Courses and items are few and always ranked in full. Discussions matching a
+# common word can number in the millions, so on both backends only the newest
+# SEARCH_CANDIDATES of them are ranked, newest meaning the highest id * 4 + kind
+# (the SQLite rowid). The rowid bound lets FTS5 skip the older doclist entries.
+SQLITE_HIT = (
+    "SELECT rowid % 4 AS kind, rowid / 4 AS id, course_id, item_id, item_type, title, "
+    "snippet(search_index, 1, '[', ']', '...', 16) AS snippet, bm25(search_index, 4.0, 1.0, 0.0) AS score "
+    "FROM search_index WHERE search_index MATCH "
+)
+SQLITE_SEARCH = text(
+    SQLITE_HIT + ":content_query "
+    "UNION ALL "
+    + SQLITE_HIT + ":discussion_query AND rowid > coalesce(("
+    "SELECT rowid FROM search_index WHERE search_index MATCH :discussion_query "
+    "ORDER BY rowid DESC LIMIT 1 OFFSET :candidates), 0) "
+    "ORDER BY score LIMIT :limit OFFSET :offset"
+)
+
+POSTGRES_SEARCH = text(
+    "SELECT kind, id, course_id, item_id, item_type, title, "
+    "ts_headline('english', body, websearch_to_tsquery('english', :query), "
+    "'MaxFragments=1, MaxWords=16, MinWords=6, StartSel=[, StopSel=]') AS snippet, score FROM ("
+    "SELECT 0 AS kind, c.id, c.id AS course_id, NULL AS item_id, NULL AS item_type, c.title, "
+    "coalesce(c.description, '') AS body, ts_rank_cd(c.search_vector, q) AS score "
+    "FROM course c, websearch_to_tsquery('english', :query) q "
+    "WHERE c.search_vector @@ q AND c.id IN :course_ids "
+    "UNION ALL "
+    "SELECT 1, i.id, i.course_id, i.id, i.item_type, i.title, coalesce(i.description, ''), ts_rank_cd(i.search_vector, q) "
+    "FROM course_item i, websearch_to_tsquery('english', :query) q "
+    "WHERE i.search_vector @@ q AND i.course_id IN :course_ids "
+    "UNION ALL "
+    "SELECT kind, id, course_id, item_id, item_type, '', body, ts_rank_cd(vector, q) FROM ("
+    "SELECT * FROM ("
+    "SELECT 2 AS kind, d.id, d.course_id, NULL AS item_id, NULL AS item_type, d.content AS body, d.search_vector AS vector "
+    "FROM discussion d, websearch_to_tsquery('english', :query) q "
+    "WHERE d.search_vector @@ q AND d.course_id IN :course_ids "
+    "UNION ALL "
+    "SELECT 3, d.id, i.course_id, d.item_id, i.item_type, d.content, d.search_vector "
+    "FROM item_discussion d JOIN course_item i ON i.id = d.item_id, websearch_to_tsquery('english', :query) q "
+    "WHERE d.search_vector @@ q AND i.course_id IN :course_ids"
+    ") matches ORDER BY id * 4 + kind DESC LIMIT :candidates"
+    ") candidates, websearch_to_tsquery('english', :query) q"
+    ") hits ORDER BY score DESC, kind, id LIMIT :limit OFFSET :offset"
+).bindparams(bindparam('course_ids', expanding=True))
+
+def fts5_queries(query, course_ids):
+    """FTS5 queries for the course/item and the discussion halves of a search, or None.
+
+    Every word must match the title or body. The porter tokenizer folds word
+    endings; prefix queries are not used as they cannot seek through the index.
+    """
+    words = re.findall(r'\w+', query)
+    if not words:
+        return None
+    terms = ['"' + word + '"' for word in words]
+    scope = '{title body} : (%s) AND scope : (%s)' % (' '.join(terms), ' OR '.join(f'c{c}' for c in course_ids))
+    # Course and item tokens are rare, so filtering on them is cheap either way
+    return scope + ' AND scope : (k0 OR k1)', scope + ' NOT scope : (k0 OR k1)'
+
+def search(query, course_ids, limit, offset=0):
+    """One page of hits for ``query`` within ``course_ids``, best first.
+
+    Returns up to ``limit`` dicts with the kind of hit, its id, course, item
+    (for items and item discussions), title, a snippet with matches in
+    [brackets] and the score.
+    """
+    if not course_ids:
+        return []
+    if db.session.get_bind().dialect.name == 'postgresql':
+        rows = db.session.execute(POSTGRES_SEARCH, {
+            'query': query, 'course_ids': sorted(course_ids),
+            'candidates': current_app.config['SEARCH_CANDIDATES'], 'limit': limit, 'offset': offset,
+        })
+        score = lambda value: value
+    else:
+        queries = fts5_queries(query, sorted(course_ids))
+        if queries is None:
+            return []
+        rows = db.session.execute(SQLITE_SEARCH, {
+            'content_query': queries[0], 'discussion_query': queries[1],
+            'candidates': current_app.config['SEARCH_CANDIDATES'], 'limit': limit, 'offset': offset,
+        })
+        # bm25() is lower for better matches
+        score = lambda value: -value
+    return [
+        {
+            'type': KINDS[r.kind],
+            'id': r.id,
+            'course_id': r.course_id,
+            'item_id': r.item_id,
+            'item_type': SEGMENTS.get(r.item_type),
+            'title': r.title or None,
+            'snippet': r.snippet,
+            'score': round(score(r.score), 6),
+        }
+        for r in rows
+    ]
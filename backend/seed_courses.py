@@ -1,6 +1,12 @@
-from app import app
+"""Canonical demo courses with their labs, quizzes and exams.
 
-from models import db, Course, Lab, Quiz, Exam
+``seed_demo_content`` adds whatever is missing and is safe to run repeatedly;
+``flask generate-data`` calls it before generating synthetic data.
+Run directly with ``python seed_courses.py``.
+"""
+from sqlalchemy import select
+from models import db, Course, CourseItem, Lab, Quiz, Exam
+from progress import reconcile_progress
 
 courses = [
     {"id": 1, "title": "Software Engineering", "description": "Master the art of building robust, scalable software systems."},
@@ -84,24 +90,41 @@ exams_examples = {
     5: "Final Exam: Cybersecurity",
 }
 
-with app.app_context():
+def demo_items(course):
+    """(model, title, description) of every item of a demo course."""
+    for i, title in enumerate(labs_examples[course["id"]], 1):
+        yield Lab, title, f"Lab {i} for {course['title']}: {title}"
+    for i, title in enumerate(quizzes_examples[course["id"]], 1):
+        yield Quiz, title, f"Quiz {i} for {course['title']}: {title}"
+    yield Exam, exams_examples[course["id"]], f"Comprehensive final exam for {course['title']}."
+
+def seed_demo_content():
+    """Add the demo courses and items that are missing, with one existence query per table.
+
+    Runs in the caller's transaction; commit to persist. Returns the number of
+    rows added.
+    """
+    course_ids = [c["id"] for c in courses]
+    existing_courses = set(db.session.execute(select(Course.id).where(Course.id.in_(course_ids))).scalars())
+    existing_items = set(db.session.execute(
+        select(CourseItem.course_id, CourseItem.item_type, CourseItem.title).where(CourseItem.course_id.in_(course_ids))
+    ).all())
+    added = [Course(**c) for c in courses if c["id"] not in existing_courses]
     for c in courses:
-        course = Course.query.get(c["id"])
-        if not course:
-            course = Course(id=c["id"], title=c["title"], description=c["description"])
-            db.session.add(course)
-            db.session.commit()
-        # Labs
-        for i, lab_title in enumerate(labs_examples[c["id"]], 1):
-            if not Lab.query.filter_by(course_id=course.id, title=lab_title).first():
-                db.session.add(Lab(course_id=course.id, title=lab_title, description=f"Lab {i} for {course.title}: {lab_title}"))
-        # Quizzes
-        for i, quiz_title in enumerate(quizzes_examples[c["id"]], 1):
-            if not Quiz.query.filter_by(course_id=course.id, title=quiz_title).first():
-                db.session.add(Quiz(course_id=course.id, title=quiz_title, description=f"Quiz {i} for {course.title}: {quiz_title}"))
-        # Exam
-        exam_title = exams_examples[c["id"]]
-        if not Exam.query.filter_by(course_id=course.id, title=exam_title).first():
-            db.session.add(Exam(course_id=course.id, title=exam_title, description=f"Comprehensive final exam for {course.title}."))
-    db.session.commit()
-    print("Courses, labs, quizzes, and exams seeded!") 
+        for model, title, description in demo_items(c):
+            if (c["id"], model.__mapper__.polymorphic_identity, title) not in existing_items:
+                added.append(model(course_id=c["id"], title=title, description=description))
+    db.session.add_all(added)
+    db.session.flush()
+    if added:
+        # New items change every enrollment's totals in their course
+        reconcile_progress(course_ids)
+    return len(added)
+
+if __name__ == "__main__":
+    from app import app
+
+    with app.app_context():
+        added = seed_demo_content()
+        db.session.commit()
+        print(f"Courses, labs, quizzes, and exams seeded! {added} rows added.")
@@ -0,0 +1,62 @@
+"""Chunked JSON array responses for the list routes.
+
+``json_array_response`` serializes the items of an iterable one at a time, so a
+route can hand it a database cursor (``yield_per``) instead of a built list and
+worker memory stays bounded by JSON_STREAM_CHUNK_SIZE plus one batch of rows.
+The body is byte-for-byte what ``jsonify`` returns for the same list. A response
+that fits in one chunk is sent whole with a Content-Length; a larger one starts
+streaming (chunked transfer encoding) as soon as its first chunk is ready.
+"""
+from functools import partial
+from flask import current_app, jsonify, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+
+def _compact(provider):
+    # Same rule DefaultJSONProvider.response uses to choose compact output
+    return isinstance(provider, DefaultJSONProvider) and (
+        provider.compact or (provider.compact is None and not current_app.debug)
+    )
+
+def json_array_chunks(items, dumps, chunk_size):
+    """Pieces of ``[item,item,...]\\n`` of about ``chunk_size`` characters each.
+
+    Only the last piece ends with a newline: compact JSON never contains one.
+    """
+    parts = ['[']
+    size = 1
+    separator = ''
+    for item in items:
+        encoded = separator + dumps(item)
+        separator = ','
+        parts.append(encoded)
+        size += len(encoded)
+        if size >= chunk_size:
+            yield ''.join(parts)
+            parts = []
+            size = 0
+    parts.append(']\n')
+    yield ''.join(parts)
+
+def json_array_response(items, serialize=None):
+    """Response with the JSON array of ``items``, each passed through ``serialize``.
+
+    ``items`` is consumed lazily, inside the request context, after the view
+    returns; any rows it reads must come from the request's session.
+    """
+    if serialize is not None:
+        items = map(serialize, items)
+    provider = current_app.json
+    if not _compact(provider):
+        # Indented (debug) output is small and not worth streaming
+        return jsonify(list(items))
+    dumps = partial(provider.dumps, separators=(',', ':'))
+    chunks = json_array_chunks(items, dumps, current_app.config['JSON_STREAM_CHUNK_SIZE'])
+    first = next(chunks)
+    if first.endswith('\n'):
+        return current_app.response_class(first, mimetype=provider.mimetype)
+
+    def generate():
+        yield first
+        yield from chunks
+
+    return current_app.response_class(stream_with_context(generate()), mimetype=provider.mimetype)
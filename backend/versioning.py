@@ -0,0 +1,76 @@
+from functools import wraps
+from flask import current_app, g, has_request_context, request, make_response
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from models import db, dialect_insert, ContentVersion, Course, CourseItem, Enrollment
+
+CATALOG = 'catalog'
+
+def course_scope(course_id):
+    return f'course:{course_id}'
+
+def changed_scopes(session):
+    """Version scopes affected by the objects being flushed (call from after_flush)."""
+    scopes = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        modified = obj not in session.dirty or session.is_modified(obj)
+        if isinstance(obj, Course) and modified:
+            scopes.update((CATALOG, course_scope(obj.id)))
+        elif isinstance(obj, CourseItem) and modified:
+            scopes.add(course_scope(obj.course_id))
+        elif isinstance(obj, Enrollment) and obj not in session.dirty:
+            # Course detail lists enrolled users
+            scopes.add(course_scope(obj.course_id))
+    return scopes
+
+def bump_versions(connection, scopes):
+    """Increment the version of each scope, creating missing counters at 1."""
+    if not scopes:
+        return
+    table = ContentVersion.__table__
+    stmt = dialect_insert(table, connection.dialect.name)
+    stmt = stmt.on_conflict_do_update(index_elements=[table.c.scope], set_={'version': table.c.version + 1})
+    connection.execute(stmt, [{'scope': scope, 'version': 1} for scope in sorted(scopes)])
+
+@event.listens_for(Session, 'after_flush')
+def _bump_changed_scopes(session, flush_context):
+    # The new/dirty/deleted collections still describe the flush here, with ids assigned
+    scopes = changed_scopes(session)
+    bump_versions(session.connection(), scopes)
+    # Cached copies are invalidated once the transaction commits (see catalog.py)
+    session.info.setdefault('changed_scopes', set()).update(scopes)
+
+def content_version(scope):
+    version = db.session.execute(select(ContentVersion.version).where(ContentVersion.scope == scope)).scalar() or 0
+    if has_request_context():
+        g.setdefault('_content_versions', {})[scope] = version
+    return version
+
+def known_version(scope):
+    """The version of ``scope`` this request sent as its ETag, or None."""
+    return g.get('_content_versions', {}).get(scope) if has_request_context() else None
+
+def versioned(scope_for):
+    """Serve a GET route with a version-based strong ETag.
+
+    ``scope_for`` maps the view arguments to a version scope. When the request's
+    If-None-Match matches the current version the view is skipped and a 304 is
+    returned, so only the version counter is read.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            scope = scope_for(**kwargs)
+            etag = f'{scope.replace(":", "-")}-v{content_version(scope)}'
+            # Weak comparison: compression.py sends the tag as W/"..." with encoded bodies
+            if request.if_none_match.contains_weak(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = current_app.config['CONTENT_CACHE_CONTROL']
+            return response
+        return wrapper
+    return decorator
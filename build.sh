@@ -20,4 +20,10 @@ cp -r frontend/build/* backend/static/
 # Install backend dependencies
 pip install -r requirements.txt
 
+# Precompress the React build served from backend/static
+(cd backend && flask --app app.py compress-assets)
+
+# Fail the build if an API route now runs more queries than its budget
+(cd backend && flask --app app.py check-query-budgets) || exit 1
+
 echo "Build completed successfully!" 
\ No newline at end of file
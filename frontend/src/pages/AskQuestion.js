@@ -12,6 +12,7 @@ const FeedbackSchema = Yup.object().shape({
 
 function GiveFeedback() {
   const [feedbacks, setFeedbacks] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [loading, setLoading] = useState(true);
   const [feedbackMsg, setFeedbackMsg] = useState(null);
   const [feedbackLoading, setFeedbackLoading] = useState(false);
@@ -24,6 +25,7 @@ function GiveFeedback() {
         const data = await res.json();
         if (res.ok) {
           setFeedbacks(data);
+          setNextCursor(res.headers.get('X-Next-Cursor'));
         }
       } catch (err) {
         setFeedbacks([]);
@@ -57,7 +59,10 @@ function GiveFeedback() {
         // Refresh feedbacks
         const res2 = await fetch('/api/discussions/1');
         const data2 = await res2.json();
-        if (res2.ok) setFeedbacks(data2);
+        if (res2.ok) {
+          setFeedbacks(data2);
+          setNextCursor(res2.headers.get('X-Next-Cursor'));
+        }
       } else {
         setFeedbackMsg(data.error || 'Failed to post feedback.');
       }
@@ -68,6 +73,19 @@ function GiveFeedback() {
     setFeedbackLoading(false);
   };
 
+  const handleLoadMore = async () => {
+    try {
+      const res = await fetch(`/api/discussions/1?cursor=${encodeURIComponent(nextCursor)}`);
+      const data = await res.json();
+      if (res.ok) {
+        setFeedbacks(feedbacks => [...feedbacks, ...data]);
+        setNextCursor(res.headers.get('X-Next-Cursor'));
+      }
+    } catch (err) {
+      setFeedbackMsg('Network error.');
+    }
+  };
+
   return (
     <div className="container py-5" style={{ maxWidth: 700 }}>
       <div className="card shadow" style={{ border: `2px solid ${maroon}`, background: white, borderRadius: 16 }}>
@@ -111,6 +129,11 @@ function GiveFeedback() {
                 )) : <li>No feedback yet.</li>}
               </ul>
             )}
+            {!loading && nextCursor && (
+              <button className="btn btn-sm" style={{ background: '#eee', color: maroon, fontWeight: 600, borderRadius: 6 }} onClick={handleLoadMore}>
+                Load more feedback
+              </button>
+            )}
           </div>
         </div>
       </div>
@@ -5,6 +5,8 @@ import * as Yup from 'yup';
 
 const maroon = '#800000';
 const white = '#fff';
+const POLL_INTERVAL = 15000;
+const RECONNECT_DELAY = 3000;
 
 const DiscussionSchema = Yup.object().shape({
   content: Yup.string().min(5, 'Comment must be at least 5 characters').required('Required'),
@@ -13,10 +15,12 @@ const DiscussionSchema = Yup.object().shape({
 function ItemDiscussion() {
   const { type, itemId } = useParams(); // type: labs/quizzes/exams
   const [discussions, setDiscussions] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [loading, setLoading] = useState(true);
   const [msg, setMsg] = useState(null);
   const [editId, setEditId] = useState(null);
   const [editContent, setEditContent] = useState('');
+  const [live, setLive] = useState(false);
   const token = localStorage.getItem('token');
   const userId = localStorage.getItem('user_id');
 
@@ -29,8 +33,10 @@ function ItemDiscussion() {
       try {
         const res = await fetch(endpoint, { headers: { Authorization: `Bearer ${token}` } });
         const data = await res.json();
-        if (res.ok) setDiscussions(data);
-        else setDiscussions([]);
+        if (res.ok) {
+          setDiscussions(data);
+          setNextCursor(res.headers.get('X-Next-Cursor'));
+        } else setDiscussions([]);
       } catch {
         setDiscussions([]);
       }
@@ -39,6 +45,89 @@ function ItemDiscussion() {
     fetchDiscussions();
   }, [endpoint, token]);
 
+  // Apply posts, edits and deletes from other viewers as they happen
+  useEffect(() => {
+    let source = null;
+    let timer = null;
+    let closed = false;
+    let lastEventId = '';
+    const upsert = d => {
+      // Posts too large for the event carry only their id
+      if (d.truncated) return mergeLatest();
+      setDiscussions(discussions =>
+        discussions.some(x => x.id === d.id) ? discussions.map(x => (x.id === d.id ? { ...x, ...d } : x)) : [d, ...discussions]
+      );
+    };
+    const track = handler => e => {
+      lastEventId = e.lastEventId || lastEventId;
+      handler(JSON.parse(e.data));
+    };
+    // Streams need a short-lived token, which the server only hands out when it can stream
+    const connect = async () => {
+      let streamToken = null;
+      try {
+        const res = await fetch(`${endpoint}/stream-token`, { method: 'POST', headers: { Authorization: `Bearer ${token}` } });
+        if (res.ok) streamToken = (await res.json()).token;
+      } catch {}
+      if (closed) return;
+      if (!streamToken) {
+        // No live updates from this server; poll instead
+        timer = setInterval(mergeLatest, POLL_INTERVAL);
+        return;
+      }
+      source = new EventSource(`${endpoint}/stream?token=${encodeURIComponent(streamToken)}&last_event_id=${encodeURIComponent(lastEventId)}`);
+      source.onopen = () => setLive(true);
+      source.onerror = () => {
+        setLive(false);
+        // The browser gives up once the token has expired; resume with a new one
+        if (source.readyState === EventSource.CLOSED) timer = setTimeout(connect, RECONNECT_DELAY);
+      };
+      source.addEventListener('created', track(upsert));
+      source.addEventListener('updated', track(upsert));
+      source.addEventListener('deleted', track(({ id }) => setDiscussions(discussions => discussions.filter(d => d.id !== id))));
+      // Sent when updates may have been missed while disconnected
+      source.addEventListener('reset', e => {
+        lastEventId = e.lastEventId || lastEventId;
+        refreshDiscussions();
+      });
+    };
+    connect();
+    return () => {
+      closed = true;
+      clearInterval(timer);
+      clearTimeout(timer);
+      if (source) source.close();
+    };
+  }, [endpoint, token]); // eslint-disable-line react-hooks/exhaustive-deps
+
+  const refreshDiscussions = async () => {
+    try {
+      const res = await fetch(endpoint, { headers: { Authorization: `Bearer ${token}` } });
+      const data = await res.json();
+      if (res.ok) {
+        setDiscussions(data);
+        setNextCursor(res.headers.get('X-Next-Cursor'));
+      }
+    } catch {}
+  };
+
+  // Fold the newest page into the list, keeping pages loaded with "Load more" and their cursor
+  const mergeLatest = async () => {
+    try {
+      const res = await fetch(endpoint, { headers: { Authorization: `Bearer ${token}` } });
+      const data = await res.json();
+      if (!res.ok) return;
+      setDiscussions(discussions => {
+        const latest = new Map(data.map(d => [d.id, d]));
+        const known = new Set(discussions.map(d => d.id));
+        return [
+          ...data.filter(d => !known.has(d.id)),
+          ...discussions.map(d => (latest.has(d.id) ? { ...d, ...latest.get(d.id) } : d)),
+        ];
+      });
+    } catch {}
+  };
+
   const handleSubmit = async (values, { setSubmitting, resetForm }) => {
     setMsg(null);
     try {
@@ -51,10 +140,8 @@ function ItemDiscussion() {
       if (res.ok) {
         setMsg('Comment posted!');
         resetForm();
-        // Refresh
-        const res2 = await fetch(endpoint, { headers: { Authorization: `Bearer ${token}` } });
-        const data2 = await res2.json();
-        if (res2.ok) setDiscussions(data2);
+        // The live stream delivers the new comment; fetch it only without one
+        if (!live) await mergeLatest();
       } else {
         setMsg(data.error || 'Failed to post comment.');
       }
@@ -64,6 +151,19 @@ function ItemDiscussion() {
     setSubmitting(false);
   };
 
+  const handleLoadMore = async () => {
+    try {
+      const res = await fetch(`${endpoint}?cursor=${encodeURIComponent(nextCursor)}`, { headers: { Authorization: `Bearer ${token}` } });
+      const data = await res.json();
+      if (res.ok) {
+        setDiscussions(discussions => [...discussions, ...data]);
+        setNextCursor(res.headers.get('X-Next-Cursor'));
+      }
+    } catch {
+      setMsg('Network error.');
+    }
+  };
+
   const handleEdit = (id, content) => {
     setEditId(id);
     setEditContent(content);
@@ -81,12 +181,9 @@ function ItemDiscussion() {
       const data = await res.json();
       if (res.ok) {
         setMsg('Comment updated!');
+        setDiscussions(discussions => discussions.map(d => (d.id === editId ? { ...d, content: editContent } : d)));
         setEditId(null);
         setEditContent('');
-        // Refresh
-        const res2 = await fetch(endpoint, { headers: { Authorization: `Bearer ${token}` } });
-        const data2 = await res2.json();
-        if (res2.ok) setDiscussions(data2);
       } else {
         setMsg(data.error || 'Failed to update comment.');
       }
@@ -174,6 +271,11 @@ function ItemDiscussion() {
                 )) : <li>No comments yet.</li>}
               </ul>
             )}
+            {!loading && nextCursor && (
+              <button className="btn btn-sm" style={{ background: '#eee', color: maroon, fontWeight: 600, borderRadius: 6 }} onClick={handleLoadMore}>
+                Load more comments
+              </button>
+            )}
           </div>
         </div>
       </div>
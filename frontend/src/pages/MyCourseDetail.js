@@ -16,23 +16,18 @@ function MyCourseDetail() {
   const navigate = useNavigate();
 
   useEffect(() => {
-    async function fetchAll() {
+    async function fetchWorkspace() {
       setLoading(true);
       setError(null);
       try {
-        const headers = { Authorization: `Bearer ${token}` };
-        const [labsRes, quizzesRes, examsRes] = await Promise.all([
-          fetch(`/api/courses/${courseId}/labs`, { headers }),
-          fetch(`/api/courses/${courseId}/quizzes`, { headers }),
-          fetch(`/api/courses/${courseId}/exams`, { headers }),
-        ]);
-        const labsData = await labsRes.json();
-        const quizzesData = await quizzesRes.json();
-        const examsData = await examsRes.json();
-        if (labsRes.ok && quizzesRes.ok && examsRes.ok) {
-          setLabs(labsData);
-          setQuizzes(quizzesData);
-          setExams(examsData);
+        const res = await fetch(`/api/courses/${courseId}/workspace`, {
+          headers: { Authorization: `Bearer ${token}` },
+        });
+        const data = await res.json();
+        if (res.ok) {
+          setLabs(data.labs);
+          setQuizzes(data.quizzes);
+          setExams(data.exams);
         } else {
           setError('Failed to load course items.');
         }
@@ -41,7 +36,7 @@ function MyCourseDetail() {
       }
       setLoading(false);
     }
-    fetchAll();
+    fetchWorkspace();
   }, [courseId, token]);
 
   async function toggleCompletion(type, id, is_complete) {